@@ -0,0 +1,159 @@
+import random
+import re
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from apps.delivery.models import Assignment, DeliveryRequest
+from apps.delivery.serializers import ACTIVE_ASSIGNMENT_STATUSES
+from apps.users.models import User
+
+# シードデータの配送依頼のステータス（重み付き）
+SEED_REQUEST_STATUSES = [
+    ('pending', 10),
+    ('assigned', 5),
+    ('in_progress', 5),
+    ('completed', 70),
+    ('cancelled', 10),
+]
+
+# 配送依頼のステータスに対応するアサインのステータス
+SEED_ASSIGNMENT_STATUSES = {
+    'assigned': 'accepted',
+    'in_progress': 'in_progress',
+    'completed': 'completed',
+    'cancelled': 'rejected',
+}
+
+SEQ_SCAN_PATTERN = re.compile(r'Seq Scan on (delivery_\w+)')
+
+
+class Command(BaseCommand):
+    help = '配送依頼・アサインの主要なクエリを EXPLAIN ANALYZE し、実行計画を表示する（シードデータは最後に破棄する）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help='シードする配送依頼の件数')
+        parser.add_argument('--no-seed', action='store_true', help='シードせず既存のデータで実行する')
+        parser.add_argument(
+            '--fail-on-seq-scan', action='store_true',
+            help='配送依頼・アサインのテーブルをシーケンシャルスキャンするクエリがあればエラーにする'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('PostgreSQLでのみ実行できます。')
+
+        with transaction.atomic():
+            if options['no_seed']:
+                company = User.objects.filter(user_type='company', requested_deliveries__isnull=False).first()
+                driver = User.objects.filter(user_type='driver', assignments__isnull=False).first()
+                if company is None or driver is None:
+                    raise CommandError('配送依頼・アサインのデータがありません。--no-seed を外して実行してください。')
+            else:
+                company, driver = self.seed(options['requests'])
+
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE delivery_deliveryrequest')
+                cursor.execute('ANALYZE delivery_assignment')
+                cursor.execute('ANALYZE users_user')
+
+            seq_scans = []
+            for name, queryset in self.hot_queries(company, driver):
+                plan = queryset.explain(analyze=True)
+                self.stdout.write(self.style.MIGRATE_HEADING(f"== {name}"))
+                self.stdout.write(plan)
+                self.stdout.write('')
+                tables = sorted(set(SEQ_SCAN_PATTERN.findall(plan)))
+                if tables:
+                    seq_scans.append(f"{name}（{', '.join(tables)}）")
+
+            # シードデータは残さない
+            transaction.set_rollback(True)
+
+        if seq_scans:
+            message = f"シーケンシャルスキャン: {' / '.join(seq_scans)}"
+            if options['fail_on_seq_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('配送依頼・アサインのシーケンシャルスキャンはありません。'))
+
+    def hot_queries(self, company, driver):
+        """(名前, クエリセット) の一覧（一覧APIなどで実際に発行されるクエリ）"""
+        pending = DeliveryRequest.objects.filter(status='pending').order_by('-created_at')
+        request_ids = list(DeliveryRequest.objects.filter(requester=company).values_list('pk', flat=True)[:20])
+        return [
+            ('driver_feed', pending[:20]),
+            ('company_list', DeliveryRequest.objects.filter(requester=company).order_by('-created_at')[:20]),
+            ('driver_assignments', Assignment.objects.filter(driver=driver).order_by('-created_at')[:20]),
+            (
+                'driver_active_assignments',
+                Assignment.objects.filter(driver=driver, status__in=['accepted', 'in_progress'])
+            ),
+            (
+                'request_active_assignment',
+                Assignment.objects.filter(
+                    delivery_request_id=request_ids[0] if request_ids else 0,
+                    status__in=['accepted', 'in_progress']
+                )
+            ),
+            (
+                'assigned_driver_prefetch',
+                # DeliveryRequestSerializer.setup_eager_loading のプリフェッチと同じ条件
+                Assignment.objects.filter(
+                    status__in=ACTIVE_ASSIGNMENT_STATUSES, delivery_request_id__in=request_ids
+                ).select_related('driver')
+            ),
+        ]
+
+    def seed(self, request_count):
+        """配送依頼・アサインのシードデータを作成し、(事業者, ドライバー) を返す"""
+        rng = random.Random(1833)
+        companies = User.objects.bulk_create([
+            User(username=f'explain-company-{i}', email=f'explain-company-{i}@example.com',
+                 user_type='company', password='!')
+            for i in range(max(request_count // 200, 1))
+        ])
+        drivers = User.objects.bulk_create([
+            User(username=f'explain-driver-{i}', email=f'explain-driver-{i}@example.com',
+                 user_type='driver', password='!')
+            for i in range(max(request_count // 100, 1))
+        ])
+
+        statuses, weights = zip(*SEED_REQUEST_STATUSES)
+        delivery_requests = DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(
+                requester=rng.choice(companies),
+                title=f'シード案件{i}',
+                sender_name='差出人',
+                sender_phone='000-0000-0000',
+                sender_address='東京都',
+                recipient_name='受取人',
+                recipient_phone='000-0000-0000',
+                recipient_address='大阪府',
+                item_name='荷物',
+                delivery_date=date.today() + timedelta(days=rng.randint(0, 30)),
+                status=rng.choices(statuses, weights)[0],
+            )
+            for i in range(request_count)
+        ], batch_size=1000)
+
+        # created_at は auto_now_add のため、作成後に過去1年の範囲へ散らす
+        DeliveryRequest.objects.filter(pk__in=[r.pk for r in delivery_requests]).update(
+            created_at=RawSQL("now() - random() * interval '365 days'", [])
+        )
+
+        Assignment.objects.bulk_create([
+            Assignment(
+                delivery_request=delivery_request,
+                driver=rng.choice(drivers),
+                status=SEED_ASSIGNMENT_STATUSES[delivery_request.status],
+            )
+            for delivery_request in delivery_requests
+            if delivery_request.status in SEED_ASSIGNMENT_STATUSES
+        ], batch_size=1000)
+
+        self.stdout.write(
+            f"シードデータ: 事業者 {len(companies)}件 / ドライバー {len(drivers)}件 / 配送依頼 {len(delivery_requests)}件"
+        )
+        return companies[0], drivers[0]
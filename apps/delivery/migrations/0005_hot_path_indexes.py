@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:11
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 稼働中のテーブルへの書き込みを止めないよう CREATE INDEX CONCURRENTLY で作成する
+    # （トランザクション内では実行できないため atomic = False）
+    atomic = False
+
+    dependencies = [
+        ('delivery', '0004_deliveryrequest_request_amount'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='assignment',
+            index=models.Index(fields=['driver', 'status'], name='assignment_driver_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='assignment',
+            index=models.Index(condition=models.Q(('status__in', ['accepted', 'in_progress'])), fields=['delivery_request'], name='assignment_request_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='deliveryrequest',
+            index=models.Index(fields=['requester', '-created_at'], name='delivery_requester_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='deliveryrequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-created_at'], name='delivery_pending_created_idx'),
+        ),
+    ]
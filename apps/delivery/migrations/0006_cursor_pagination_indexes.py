@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:15
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 稼働中のテーブルへの書き込みを止めないよう CREATE INDEX CONCURRENTLY で作成する
+    # （トランザクション内では実行できないため atomic = False）
+    atomic = False
+
+    dependencies = [
+        ('delivery', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='assignment',
+            index=models.Index(fields=['-created_at', '-id'], name='assignment_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='deliveryrequest',
+            index=models.Index(fields=['-created_at', '-id'], name='delivery_created_id_idx'),
+        ),
+    ]
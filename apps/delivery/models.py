@@ -65,6 +65,14 @@ class DeliveryRequest(models.Model):
         verbose_name = '配送依頼'
         verbose_name_plural = '配送依頼'
         ordering = ['-created_at']
+        indexes = [
+            # 事業者の案件一覧（requester + 作成日時の降順）
+            models.Index(fields=['requester', '-created_at'], name='delivery_requester_created_idx'),
+            # ドライバー向けの受付中案件一覧（受付中の行のみの部分インデックス）
+            models.Index(fields=['-created_at'], name='delivery_pending_created_idx', condition=models.Q(status='pending')),
+            # 全案件のカーソルページネーション（created_at, id の降順）
+            models.Index(fields=['-created_at', '-id'], name='delivery_created_id_idx'),
+        ]
 
 
 class Assignment(models.Model):
@@ -100,3 +108,14 @@ class Assignment(models.Model):
         verbose_name = 'アサイン'
         verbose_name_plural = 'アサイン'
         ordering = ['-created_at']
+        indexes = [
+            # ドライバーごとのステータス別アサイン（進行中の案件の確認など）
+            models.Index(fields=['driver', 'status'], name='assignment_driver_status_idx'),
+            # 配送依頼ごとの進行中のアサイン（受諾・配送中の行のみの部分インデックス）
+            models.Index(
+                fields=['delivery_request'], name='assignment_request_active_idx',
+                condition=models.Q(status__in=['accepted', 'in_progress'])
+            ),
+            # 全アサインのカーソルページネーション（created_at, id の降順）
+            models.Index(fields=['-created_at', '-id'], name='assignment_created_id_idx'),
+        ]
@@ -1,9 +1,13 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from .models import DeliveryRequest, Assignment
 
 User = get_user_model()
 
+# 割り当て済みドライバーとして扱うアサインのステータス
+ACTIVE_ASSIGNMENT_STATUSES = ['accepted', 'in_progress', 'completed']
+
 
 class DeliveryRequestSerializer(serializers.ModelSerializer):
     """配送依頼シリアライザー"""
@@ -15,9 +19,24 @@ class DeliveryRequestSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['requester']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """依頼者・割り当て済みのアサインとドライバーをまとめて取得する（件数に関わらずクエリ数を一定にする）"""
+        return queryset.select_related('requester').prefetch_related(
+            Prefetch(
+                'assignments',
+                queryset=Assignment.objects.filter(status__in=ACTIVE_ASSIGNMENT_STATUSES).select_related('driver'),
+                to_attr='active_assignments'
+            )
+        )
+
     def get_assigned_driver(self, obj):
         """割り当てられたドライバー情報を取得"""
-        assignment = obj.assignments.filter(status__in=['accepted', 'in_progress', 'completed']).first()
+        if hasattr(obj, 'active_assignments'):
+            # setup_eager_loading で取得済みのアサイン（作成日時の降順）
+            assignment = obj.active_assignments[0] if obj.active_assignments else None
+        else:
+            assignment = obj.assignments.filter(status__in=ACTIVE_ASSIGNMENT_STATUSES).select_related('driver').first()
         if assignment:
             driver = assignment.driver
             return {
@@ -53,6 +72,11 @@ class AssignmentSerializer(serializers.ModelSerializer):
     delivery_request = DeliveryRequestMiniSerializer(read_only=True)
     driver = DriverMiniSerializer(read_only=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """配送依頼・ドライバーをJOINで取得する"""
+        return queryset.select_related('delivery_request', 'driver')
+
     class Meta:
         model = Assignment
         fields = '__all__'
@@ -2,6 +2,7 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from config.pagination import StandardPagination
 from .models import DeliveryRequest, Assignment
 from .serializers import DeliveryRequestSerializer, AssignmentSerializer, DeliveryRequestCreateSerializer
 
@@ -9,8 +10,9 @@ User = get_user_model()
 
 
 class DeliveryRequestListCreateView(generics.ListCreateAPIView):
-    """配送依頼一覧・作成API"""
+    """配送依頼一覧・作成API（?pagination=cursor でカーソルページネーション）"""
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = StandardPagination
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -21,13 +23,14 @@ class DeliveryRequestListCreateView(generics.ListCreateAPIView):
         user = self.request.user
         if user.user_type == 'driver':
             # ドライバーは受付中の案件のみ表示
-            return DeliveryRequest.objects.filter(status='pending')
+            queryset = DeliveryRequest.objects.filter(status='pending')
         elif user.user_type == 'seed':
             # シードユーザーは全案件表示
-            return DeliveryRequest.objects.all()
+            queryset = DeliveryRequest.objects.all()
         else:
             # 事業者は自分の案件のみ表示
-            return DeliveryRequest.objects.filter(requester=user)
+            queryset = DeliveryRequest.objects.filter(requester=user)
+        return DeliveryRequestSerializer.setup_eager_loading(queryset)
 
 
 class DeliveryRequestDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -38,28 +41,31 @@ class DeliveryRequestDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.user_type == 'driver':
-            return DeliveryRequest.objects.all()
+            queryset = DeliveryRequest.objects.all()
         elif user.user_type == 'seed':
             # シードユーザーは全案件編集可能
-            return DeliveryRequest.objects.all()
+            queryset = DeliveryRequest.objects.all()
         else:
-            return DeliveryRequest.objects.filter(requester=user)
+            queryset = DeliveryRequest.objects.filter(requester=user)
+        return DeliveryRequestSerializer.setup_eager_loading(queryset)
 
 
 class AssignmentListView(generics.ListAPIView):
-    """アサイン一覧API"""
+    """アサイン一覧API（?pagination=cursor でカーソルページネーション）"""
     serializer_class = AssignmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = StandardPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.user_type == 'driver':
-            return Assignment.objects.filter(driver=user)
+            queryset = Assignment.objects.filter(driver=user)
         elif user.user_type == 'seed':
             # シードユーザーは全アサイン表示
-            return Assignment.objects.all()
+            queryset = Assignment.objects.all()
         else:
-            return Assignment.objects.filter(delivery_request__requester=user)
+            queryset = Assignment.objects.filter(delivery_request__requester=user)
+        return AssignmentSerializer.setup_eager_loading(queryset)
 
 
 @api_view(['POST'])
@@ -1,10 +1,34 @@
 from django.contrib import admin
-from .models import FileUpload
+from .models import ClaudeBatch, FileUpload, ProcessingJob, UploadSession
 
 
 @admin.register(FileUpload)
 class FileUploadAdmin(admin.ModelAdmin):
     list_display = ['original_name', 'uploader', 'file_type', 'is_processed', 'created_at']
-    list_filter = ['file_type', 'is_processed', 'created_at']
+    list_filter = ['file_type', 'is_processed', 'processing_source', 'created_at']
     search_fields = ['original_name', 'uploader__username']
     readonly_fields = ['created_at', 'updated_at', 'file_size', 'mime_type']
+
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'file_upload', 'requested_by', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['file_upload__original_name', 'requested_by__username']
+    readonly_fields = ['created_at', 'updated_at', 'started_at', 'finished_at', 'worker_id']
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'original_name', 'uploader', 'status', 'received_size', 'total_size', 'updated_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['original_name', 'uploader__username']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(ClaudeBatch)
+class ClaudeBatchAdmin(admin.ModelAdmin):
+    list_display = ['batch_id', 'status', 'request_count', 'succeeded_count', 'errored_count', 'created_at', 'ended_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['batch_id']
+    readonly_fields = ['created_at', 'updated_at', 'ended_at']
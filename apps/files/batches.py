@@ -0,0 +1,216 @@
+import json
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .claude_client import get_claude_client
+from .models import ClaudeBatch, FileUpload
+from .processing import apply_claude_response, prepare_claude_request
+
+logger = logging.getLogger(__name__)
+
+# 結果を書き戻す bulk_update の単位
+RESULT_UPDATE_BATCH_SIZE = 100
+
+# 再登録の対象にする（リクエスト自体は正しい）バッチ結果
+RESUBMITTABLE_RESULT_TYPES = {'canceled', 'expired'}
+
+
+class BatchError(Exception):
+    """Message Batches APIの呼び出しエラー"""
+
+
+def _custom_id(file_upload):
+    return f"upload-{file_upload.pk}"
+
+
+def _upload_pk(custom_id):
+    return int(custom_id.split('-', 1)[1])
+
+
+def pending_uploads():
+    """バッチ処理の対象のFileUpload
+
+    未処理で、バッチに登録されておらず、処理ジョブ待ち・処理中でなく、
+    登録用のリクエストの作成に繰り返し失敗していないもの。
+    """
+    return FileUpload.objects.filter(
+        is_processed=False,
+        claude_batch__isnull=True,
+        batch_prepare_failures__lt=settings.CLAUDE_BATCH_MAX_PREPARE_FAILURES
+    ).exclude(
+        processing_jobs__status__in=['queued', 'running']
+    ).defer('file_data', 'claude_response').order_by('created_at', 'pk')
+
+
+def _request_size(batch_request):
+    # requests がリクエスト本文に使う形式（ASCIIのJSON）でのサイズ
+    return len(json.dumps(batch_request))
+
+
+def _create_batch(batch_requests, upload_ids):
+    response = get_claude_client().create_batch(batch_requests)
+    if response.status_code != 200:
+        raise BatchError(f'バッチの登録に失敗しました。ステータスコード: {response.status_code} {response.text}')
+    batch_data = response.json()
+
+    with transaction.atomic():
+        batch = ClaudeBatch.objects.create(
+            batch_id=batch_data['id'],
+            request_count=len(batch_requests)
+        )
+        # 読み出した後に処理された・別のバッチに登録されたものは含めない
+        FileUpload.objects.filter(
+            pk__in=upload_ids, is_processed=False, claude_batch__isnull=True
+        ).update(claude_batch=batch, updated_at=timezone.now())
+
+    logger.info("Claudeバッチ %s を登録しました（%s件）", batch.batch_id, len(batch_requests))
+    return batch
+
+
+def submit_batch(max_requests=None, max_bytes=None):
+    """未処理のFileUploadをまとめてMessage Batches APIに登録する
+
+    処理結果の再利用・ルールベース抽出で完了するものはその場で処理し、
+    Claude APIが必要なものだけをバッチに含める。
+    1バッチの件数が max_requests、リクエストの合計サイズが max_bytes に達したら次のバッチに分ける。
+    (作成したClaudeBatchのリスト, 件数の集計) を返す。
+    """
+    max_requests = max_requests or settings.CLAUDE_BATCH_MAX_REQUESTS
+    max_bytes = max_bytes or settings.CLAUDE_BATCH_MAX_BYTES
+    summary = {'submitted': 0, 'completed_locally': 0, 'skipped': 0}
+
+    batches = []
+    batch_requests = []
+    upload_ids = []
+    batch_bytes = 0
+    for file_upload in pending_uploads().iterator(chunk_size=max_requests):
+        payload, result = prepare_claude_request(file_upload)
+        if result:
+            response_data, response_status = result
+            if response_status < 400:
+                summary['completed_locally'] += 1
+            else:
+                summary['skipped'] += 1
+                # 失敗回数を記録し、上限に達したものは次回以降の対象から外す
+                FileUpload.objects.filter(pk=file_upload.pk).update(
+                    batch_prepare_failures=F('batch_prepare_failures') + 1, updated_at=timezone.now()
+                )
+                logger.warning(
+                    "FileUpload#%s: バッチに登録できませんでした（%s回目）: %s",
+                    file_upload.pk, file_upload.batch_prepare_failures + 1, response_data.get('error')
+                )
+            continue
+
+        batch_request = {'custom_id': _custom_id(file_upload), 'params': payload}
+        size = _request_size(batch_request)
+        if batch_requests and (len(batch_requests) >= max_requests or batch_bytes + size > max_bytes):
+            batches.append(_create_batch(batch_requests, upload_ids))
+            batch_requests, upload_ids, batch_bytes = [], [], 0
+        batch_requests.append(batch_request)
+        upload_ids.append(file_upload.pk)
+        batch_bytes += size
+        summary['submitted'] += 1
+
+    if batch_requests:
+        batches.append(_create_batch(batch_requests, upload_ids))
+    return batches, summary
+
+
+def _flush(file_uploads):
+    """書き戻す結果を保存する（その間に他の処理で処理済みになったものは除く）"""
+    if not file_uploads:
+        return
+    with transaction.atomic():
+        # 行ロックして未処理のままか確認する（ロックは短いこのトランザクションの間だけ保持する）
+        unprocessed = set(
+            FileUpload.objects.select_for_update().filter(
+                pk__in=[file_upload.pk for file_upload in file_uploads], is_processed=False
+            ).values_list('pk', flat=True)
+        )
+        FileUpload.objects.bulk_update(
+            [file_upload for file_upload in file_uploads if file_upload.pk in unprocessed],
+            [
+                'claude_response', 'extracted_data', 'is_processed', 'processing_source', 'claude_batch',
+                'input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens', 'updated_at'
+            ],
+            batch_size=RESULT_UPDATE_BATCH_SIZE
+        )
+
+
+def apply_batch_results(batch, results):
+    """バッチの結果を対応するFileUploadにまとめて書き戻す
+
+    他の処理で既に処理済みになったものは、その結果（抽出データ・トークン数など）を上書きしない。
+    """
+    uploads = {
+        file_upload.pk: file_upload
+        for file_upload in batch.file_uploads.filter(is_processed=False).defer('file_data', 'claude_response')
+    }
+    succeeded = 0
+    errored = 0
+    pending_updates = []
+    now = timezone.now()
+
+    for result in results:
+        file_upload = uploads.get(_upload_pk(result['custom_id']))
+        if file_upload is None:
+            continue
+
+        result_type = result['result']['type']
+        if result_type == 'succeeded':
+            try:
+                apply_claude_response(file_upload, result['result']['message'], processing_source='claude_batch')
+                succeeded += 1
+            except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                errored += 1
+        else:
+            errored += 1
+            if result_type in RESUBMITTABLE_RESULT_TYPES:
+                # 期限切れ・キャンセルは次のバッチで再登録する
+                file_upload.claude_batch = None
+            else:
+                file_upload.claude_response = result['result'].get('error')
+            logger.warning("FileUpload#%s: バッチ処理に失敗しました（%s）", file_upload.pk, result_type)
+
+        file_upload.updated_at = now
+        pending_updates.append(file_upload)
+        if len(pending_updates) >= RESULT_UPDATE_BATCH_SIZE:
+            _flush(pending_updates)
+            pending_updates = []
+
+    _flush(pending_updates)
+
+    batch.status = 'ended'
+    batch.succeeded_count = succeeded
+    batch.errored_count = errored
+    batch.ended_at = timezone.now()
+    batch.save(update_fields=['status', 'succeeded_count', 'errored_count', 'ended_at', 'updated_at'])
+    logger.info("Claudeバッチ %s: 成功 %s件 / 失敗 %s件", batch.batch_id, succeeded, errored)
+    return batch
+
+
+def poll_batches():
+    """処理中のバッチの状況を確認し、完了したものの結果を書き戻す
+
+    まだ処理中のバッチ数を返す。
+    """
+    client = get_claude_client()
+    in_progress = 0
+
+    for batch in ClaudeBatch.objects.filter(status='in_progress').order_by('created_at'):
+        response = client.get_batch(batch.batch_id)
+        if response.status_code != 200:
+            raise BatchError(f'バッチ {batch.batch_id} の状況取得に失敗しました。ステータスコード: {response.status_code}')
+        batch_data = response.json()
+
+        if batch_data.get('processing_status') != 'ended':
+            in_progress += 1
+            continue
+
+        # 結果の取得中はトランザクションを保持しない（書き戻しは RESULT_UPDATE_BATCH_SIZE 件ごとにコミットする）。
+        # 途中で失敗した場合もバッチは in_progress のままで、次回は未処理のものだけを書き戻す
+        apply_batch_results(batch, client.iter_batch_results(batch_data['results_url']))
+
+    return in_progress
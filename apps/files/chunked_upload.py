@@ -0,0 +1,108 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+from .models import FileUpload, UploadSession
+from .storage import CHUNK_SIZE, get_blob_store
+
+
+class ChunkError(Exception):
+    """分割アップロードのチャンク処理エラー"""
+
+
+def session_part_path(session):
+    """受信中データを書き込む一時ファイルのパス"""
+    return Path(settings.CHUNKED_UPLOAD_ROOT) / f"{session.id}.part"
+
+
+def write_chunk(session, stream, offset, length):
+    """チャンクを一時ファイルの offset 位置に書き込み、受信済みサイズを返す
+
+    session は select_for_update でロック済みであること。
+    リクエストボディはチャンク単位で読み出すため、チャンク全体をメモリに載せない。
+    """
+    if offset != session.received_size:
+        raise ChunkError(f'オフセットが一致しません。（期待値: {session.received_size}）')
+    if length <= 0:
+        raise ChunkError('チャンクが空です。')
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise ChunkError(f'チャンクサイズは{settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE}バイト以下にしてください。')
+    if offset + length > session.total_size:
+        raise ChunkError('合計サイズを超えるデータが送信されました。')
+
+    part_path = session_part_path(session)
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+
+    written = 0
+    with open(part_path, 'r+b' if part_path.exists() else 'wb') as part_file:
+        part_file.seek(offset)
+        while written < length:
+            chunk = stream.read(min(CHUNK_SIZE, length - written))
+            if not chunk:
+                break
+            part_file.write(chunk)
+            written += len(chunk)
+        # 途中で切断された場合に備え、書き込めた位置までで切り詰める
+        part_file.truncate(offset + written)
+
+    if written != length:
+        raise ChunkError('チャンクの受信が途中で終了しました。')
+
+    session.received_size = offset + written
+    session.save(update_fields=['received_size', 'updated_at'])
+    return session.received_size
+
+
+def finalize_session(session, expected_sha256=None):
+    """受信済みデータをBLOBストアに保存してFileUploadを作成する"""
+    if session.received_size != session.total_size:
+        raise ChunkError(f'アップロードが完了していません。（{session.received_size}/{session.total_size}バイト）')
+
+    part_path = session_part_path(session)
+    if not part_path.exists():
+        raise ChunkError('受信データが見つかりません。')
+
+    # 保存時にストリーミングでSHA-256を計算する（ファイル全体をメモリに載せない）
+    content_hash, file_size = get_blob_store().save_file(str(part_path), content_type=session.mime_type)
+
+    if expected_sha256 and content_hash != expected_sha256.lower():
+        # 破損したデータは破棄し、最初から送り直してもらう
+        if not FileUpload.objects.filter(content_hash=content_hash).exists():
+            get_blob_store().delete(content_hash)
+        session.received_size = 0
+        session.save(update_fields=['received_size', 'updated_at'])
+        raise ChunkError('SHA-256が一致しません。最初からアップロードし直してください。')
+
+    file_upload = FileUpload.objects.create(
+        uploader=session.uploader,
+        content_hash=content_hash,
+        original_name=session.original_name,
+        file_type=session.file_type,
+        file_size=file_size,
+        mime_type=session.mime_type
+    )
+
+    session.status = 'completed'
+    session.file_upload = file_upload
+    session.save(update_fields=['status', 'file_upload', 'updated_at'])
+    return file_upload
+
+
+def discard_session(session):
+    """セッションと受信中データを削除する"""
+    part_path = session_part_path(session)
+    if part_path.exists():
+        os.unlink(part_path)
+    session.delete()
+
+
+def cleanup_expired_sessions():
+    """期限切れの未完了セッションを削除し、削除件数を返す"""
+    threshold = timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRY_HOURS)
+    expired_sessions = UploadSession.objects.filter(status='uploading', updated_at__lt=threshold)
+    count = 0
+    for session in expired_sessions.iterator():
+        discard_session(session)
+        count += 1
+    return count
@@ -0,0 +1,315 @@
+import json
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# 再試行するステータスコード（レート制限・一時的なサーバーエラー・過負荷）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(Exception):
+    """Claude APIの障害が続いているため呼び出しを一時停止している"""
+
+
+class StreamError(Exception):
+    """ストリーミングレスポンスが途中で失敗した・形式が正しくない"""
+
+
+class CircuitBreaker:
+    """連続失敗回数で開閉するサーキットブレーカー
+
+    failure_threshold 回続けて失敗すると開き、reset_timeout 秒間は呼び出しを即座に失敗させる。
+    経過後は1回だけ試行を許可し（半開）、成功すれば閉じる。
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_progress:
+                raise CircuitOpenError('Claude APIへの呼び出しを一時停止しています。')
+            self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Claude API: %s回連続で失敗したため呼び出しを一時停止します", self._failures)
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+
+class ClaudeClient:
+    """Claude Messages APIのクライアント（プロセス内で共有）
+
+    Keep-Aliveの接続プールを再利用し、接続・読み取りタイムアウト、
+    429/5xxでのジッター付き指数バックオフ再試行、同時実行数の上限、
+    サーキットブレーカーを備える。呼び出しごとにレイテンシとトークン使用量をログに出す。
+    """
+
+    def __init__(self, api_url, api_key, connect_timeout=5, read_timeout=120, max_retries=2,
+                 backoff=1.0, backoff_max=20.0, max_concurrency=4,
+                 failure_threshold=5, reset_timeout=30):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'x-api-key': api_key,
+            'anthropic-version': '2023-06-01'
+        })
+
+    def _retry_delay(self, attempt, response=None):
+        """再試行までの待機秒数（retry-afterヘッダーがあればそれに従う）"""
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        # フルジッター: 0 〜 backoff * 2^attempt の一様乱数
+        return random.uniform(0, min(self.backoff * (2 ** attempt), self.backoff_max))
+
+    def _log_call(self, response, started_at, attempt):
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        logger.info(
+            "Claude API: status=%s latency=%.0fms attempt=%s",
+            response.status_code, latency_ms, attempt + 1
+        )
+
+    def _hold_until_closed(self, response):
+        """レスポンスを閉じるまで同時実行数の枠を保持する（ストリーミング用）"""
+        close = response.close
+        released = False
+
+        def close_and_release():
+            nonlocal released
+            try:
+                close()
+            finally:
+                if not released:
+                    released = True
+                    self._semaphore.release()
+
+        response.close = close_and_release
+        return response
+
+    def _send(self, send, url, hold=False, **kwargs):
+        """リクエストを送信し、最終的なレスポンス（requests.Response）を返す
+
+        再試行しても429/5xxの場合はそのレスポンスを返し、通信エラーの場合は例外を送出する。
+        サーキットブレーカーが開いている場合は CircuitOpenError を送出する。
+        hold=True（ストリーミング）の場合、成功したレスポンスを閉じるまで同時実行数の枠を保持する。
+        """
+        self.breaker.before_call()
+
+        # 成功・失敗を判定できないまま例外で抜けた場合も失敗として記録する
+        # （半開状態の試行中フラグが残り、ブレーカーが開いたままになるのを防ぐ）
+        succeeded = False
+        try:
+            attempt = 0
+            while True:
+                started_at = time.perf_counter()
+                self._semaphore.acquire()
+                try:
+                    response = send(url, timeout=self.timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._semaphore.release()
+                    logger.warning(
+                        "Claude API: 通信エラー latency=%.0fms attempt=%s: %s",
+                        (time.perf_counter() - started_at) * 1000, attempt + 1, e
+                    )
+                    if attempt < self.max_retries:
+                        time.sleep(self._retry_delay(attempt))
+                        attempt += 1
+                        continue
+                    raise
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+
+                self._log_call(response, started_at, attempt)
+
+                if hold and response.status_code == 200:
+                    succeeded = True
+                    return self._hold_until_closed(response)
+                if hold:
+                    # エラーのレスポンスは本文を読み切ってから枠を返す
+                    response.content
+                    response.close()
+                self._semaphore.release()
+
+                if response.status_code in RETRY_STATUS_CODES:
+                    if attempt < self.max_retries:
+                        time.sleep(self._retry_delay(attempt, response))
+                        attempt += 1
+                        continue
+                    return response
+                succeeded = True
+                return response
+        finally:
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def create_message(self, payload):
+        """Messages APIを呼び出す（本文は read_message で読む）"""
+        return self._send(self.session.post, self.api_url, json=payload)
+
+    def stream_message(self, payload):
+        """Messages APIをストリーミング（SSE）で呼び出す
+
+        本文を読み出す前のレスポンスを返す。本文は read_message_stream で読む。
+        同時実行数の枠はレスポンスを閉じるまで保持する。
+        """
+        return self._send(
+            self.session.post, self.api_url,
+            hold=True, json={**payload, 'stream': True}, stream=True
+        )
+
+    def create_batch(self, batch_requests):
+        """Message Batches APIにリクエスト（custom_id と params の組）をまとめて登録する"""
+        return self._send(self.session.post, settings.CLAUDE_BATCH_API_URL, json={'requests': batch_requests})
+
+    def get_batch(self, batch_id):
+        """バッチの処理状況を取得する"""
+        return self._send(self.session.get, f"{settings.CLAUDE_BATCH_API_URL}/{batch_id}")
+
+    def iter_batch_results(self, results_url):
+        """バッチの結果（JSONL）を1件ずつ読み出す（全体をメモリに載せない）"""
+        response = self._send(self.session.get, results_url, hold=True, stream=True)
+        response.raise_for_status()
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+def _log_usage(message, streaming=False):
+    usage = message.get('usage') or {}
+    logger.info(
+        "Claude API%s: input_tokens=%s output_tokens=%s "
+        "cache_read_input_tokens=%s cache_creation_input_tokens=%s",
+        '（ストリーミング）' if streaming else '',
+        usage.get('input_tokens'), usage.get('output_tokens'),
+        usage.get('cache_read_input_tokens'), usage.get('cache_creation_input_tokens')
+    )
+
+
+def read_message(response):
+    """Messages APIのレスポンスを解析し、トークン使用量をログに出してメッセージを返す
+
+    解析できない場合は ValueError を送出する。
+    """
+    message = response.json()
+    if isinstance(message, dict):
+        _log_usage(message)
+    return message
+
+
+def read_message_stream(response, on_text=None):
+    """ストリーミングレスポンスを読み、通常のMessages APIと同じ形のメッセージを組み立てる
+
+    テキストの差分を受け取るたびに on_text(差分) を呼び出す。
+    """
+    message = None
+    texts = []
+    try:
+        with response:
+            for line in response.iter_lines():
+                if not line.startswith(b'data:'):
+                    continue  # 空行・event: 行
+                event = json.loads(line[5:])
+                event_type = event.get('type')
+                if event_type == 'message_start':
+                    message = event['message']
+                elif event_type == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+                    texts.append(event['delta']['text'])
+                    if on_text:
+                        on_text(event['delta']['text'])
+                elif event_type == 'message_delta' and message is not None:
+                    message['stop_reason'] = event['delta'].get('stop_reason')
+                    message.setdefault('usage', {}).update(event.get('usage') or {})
+                elif event_type == 'error':
+                    raise StreamError((event.get('error') or {}).get('message') or 'ストリーミング中にエラーが発生しました。')
+    except (requests.RequestException, ValueError, KeyError) as e:
+        raise StreamError(str(e))
+
+    if message is None:
+        raise StreamError('ストリーミングレスポンスにメッセージが含まれていません。')
+    message['content'] = [{'type': 'text', 'text': ''.join(texts)}]
+
+    _log_usage(message, streaming=True)
+    return message
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_claude_client():
+    """設定に応じたClaudeクライアントを返す（プロセス内で共有）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ClaudeClient(
+                api_url=settings.CLAUDE_API_URL,
+                api_key=settings.CLAUDE_API_KEY,
+                connect_timeout=settings.CLAUDE_API_CONNECT_TIMEOUT,
+                read_timeout=settings.CLAUDE_API_READ_TIMEOUT,
+                max_retries=settings.CLAUDE_API_MAX_RETRIES,
+                backoff=settings.CLAUDE_API_RETRY_BACKOFF,
+                backoff_max=settings.CLAUDE_API_RETRY_BACKOFF_MAX,
+                max_concurrency=settings.CLAUDE_API_MAX_CONCURRENCY,
+                failure_threshold=settings.CLAUDE_API_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.CLAUDE_API_CIRCUIT_RESET_TIMEOUT
+            )
+        return _client
+
+
+@receiver(setting_changed)
+def reset_claude_client(setting, **kwargs):
+    """テストなどで設定が変更された場合にクライアントを作り直す"""
+    global _client
+    if setting.startswith('CLAUDE_API_'):
+        with _client_lock:
+            _client = None
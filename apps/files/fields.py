@@ -0,0 +1,50 @@
+import base64
+import json
+import zlib
+from django.conf import settings
+from django.db import models
+
+# 圧縮した値であることを示すキー
+COMPRESSED_MARKER = '__compressed__'
+
+
+def compress_json(value, encoder=None):
+    """一定サイズ以上のJSON値をzlibで圧縮し {"__compressed__": "zlib", "data": "<Base64>"} の形にする"""
+    if value is None:
+        return value
+    encoded = json.dumps(value, ensure_ascii=False, cls=encoder).encode('utf-8')
+    if len(encoded) < settings.CLAUDE_RESPONSE_COMPRESSION_MIN_BYTES:
+        return value
+    data = base64.b64encode(zlib.compress(encoded, 9)).decode('ascii')
+    if len(data) >= len(encoded):
+        return value
+    return {COMPRESSED_MARKER: 'zlib', 'data': data}
+
+
+def is_compressed_json(value):
+    return isinstance(value, dict) and value.get(COMPRESSED_MARKER) == 'zlib' and 'data' in value
+
+
+def decompress_json(value):
+    """compress_json で圧縮した値を元に戻す（圧縮されていない値はそのまま返す）"""
+    if not is_compressed_json(value):
+        return value
+    return json.loads(zlib.decompress(base64.b64decode(value['data'])).decode('utf-8'))
+
+
+class CompressedJSONField(models.JSONField):
+    """大きな値をzlibで圧縮して保存するJSONField
+
+    読み込み時に展開するため、アプリケーションからは通常のJSONFieldと同じように扱える。
+    圧縮前に保存された値（通常のJSON）もそのまま読み込める。
+    値の中身を条件にした検索（キーの検索など）は圧縮された値には使えない。
+    """
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if hasattr(value, 'as_sql'):
+            return value
+        return compress_json(value, self.encoder)
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_json(super().from_db_value(value, expression, connection))
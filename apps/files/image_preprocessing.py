@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+def flatten_to_rgb(image):
+    """透過のある画像（RGBA/LA/透過色付きのPなど）を白背景に合成してRGBにする
+
+    そのままRGBに変換すると透過部分が黒になり、文字が読み取れなくなるため。
+    """
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel('A'))
+        return flattened
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def preprocess_image(data):
+    """Claudeに送る画像を前処理し (画像データ, MIMEタイプ) を返す
+
+    EXIFの向き情報に従って回転し、長辺を IMAGE_MAX_LONG_EDGE 以下に縮小、
+    必要に応じてグレースケール化してから IMAGE_JPEG_QUALITY のJPEGに再エンコードする。
+    """
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((settings.IMAGE_MAX_LONG_EDGE, settings.IMAGE_MAX_LONG_EDGE), Image.LANCZOS)
+
+        image = flatten_to_rgb(image)
+        if settings.IMAGE_GRAYSCALE:
+            image = image.convert('L')
+
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=settings.IMAGE_JPEG_QUALITY, optimize=True)
+        return output.getvalue(), 'image/jpeg'
+
+
+def _cache_path(content_hash):
+    """前処理結果のキャッシュパス（前処理設定が変われば別のキーになる）"""
+    # 末尾は前処理の版（透過部分を白背景に合成する前のキャッシュを使わないため）
+    signature = f"{settings.IMAGE_MAX_LONG_EDGE}-{int(settings.IMAGE_GRAYSCALE)}-{settings.IMAGE_JPEG_QUALITY}-2"
+    key = hashlib.sha256(f"{content_hash}:{signature}".encode()).hexdigest()
+    return Path(settings.IMAGE_PREPROCESS_CACHE_ROOT) / key[:2] / f"{key}.jpg"
+
+
+def preprocess_image_cached(data, media_type, content_hash=None):
+    """コンテンツハッシュごとにキャッシュして画像を前処理する
+
+    前処理できない画像（Pillowで開けない場合など）は元のデータをそのまま返す。
+    """
+    if not settings.IMAGE_PREPROCESS_ENABLED:
+        return data, media_type
+
+    content_hash = content_hash or hashlib.sha256(data).hexdigest()
+    cache_path = _cache_path(content_hash)
+
+    if cache_path.exists():
+        processed = cache_path.read_bytes()
+        logger.info(
+            "画像前処理（キャッシュ）: %sバイト → %sバイト (%s)",
+            len(data), len(processed), content_hash[:12]
+        )
+        return processed, 'image/jpeg'
+
+    try:
+        processed, processed_media_type = preprocess_image(data)
+    except Exception as e:
+        logger.warning("画像前処理に失敗したため元の画像を使用します: %s", e)
+        return data, media_type
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent)
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(processed)
+    os.replace(tmp_path, cache_path)
+
+    logger.info(
+        "画像前処理: %sバイト → %sバイト (%s)",
+        len(data), len(processed), content_hash[:12]
+    )
+    return processed, processed_media_type
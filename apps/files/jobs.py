@@ -0,0 +1,151 @@
+import logging
+import os
+import socket
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from .models import FileUpload, ProcessingJob
+from .processing import BATCH_IN_PROGRESS_MESSAGE, run_exclusive_processing
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB_STATUSES = ['queued', 'running']
+
+
+def default_worker_id():
+    """ワーカー識別子（ホスト名:PID）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class UploadInBatchError(Exception):
+    """バッチ処理に登録済みのファイルのため、ジョブを登録できない"""
+
+
+def enqueue_processing_job(file_upload, user):
+    """帳票処理ジョブを登録する（同じファイルの未完了ジョブがあればそれを返す）
+
+    バッチ処理に登録済みのファイルは二重にClaude APIを呼び出さないよう UploadInBatchError を送出する。
+    """
+    with transaction.atomic():
+        # バッチへの登録（_create_batch）と同時に行われないよう、FileUploadの行をロックして確認する
+        claude_batch_id = FileUpload.objects.select_for_update().filter(
+            pk=file_upload.pk
+        ).values_list('claude_batch_id', flat=True).first()
+        if claude_batch_id:
+            raise UploadInBatchError(BATCH_IN_PROGRESS_MESSAGE)
+
+        existing_job = ProcessingJob.objects.select_for_update().filter(
+            file_upload=file_upload,
+            status__in=ACTIVE_JOB_STATUSES
+        ).first()
+        if existing_job:
+            return existing_job, False
+
+        job = ProcessingJob.objects.create(
+            file_upload=file_upload,
+            requested_by=user,
+            max_attempts=settings.PROCESSING_JOB_MAX_ATTEMPTS
+        )
+        return job, True
+
+
+def claim_next_job(worker_id=None):
+    """実行可能なジョブを1件取得して実行中にする
+
+    SELECT ... FOR UPDATE SKIP LOCKED で取得するため、複数ワーカーが同時に
+    動いていても同じジョブを二重に処理しない。
+    同じ内容のファイルを処理中のジョブがある場合は後回しにし、その結果を再利用できるようにする。
+    """
+    worker_id = worker_id or default_worker_id()
+    now = timezone.now()
+    running_hashes = ProcessingJob.objects.filter(status='running').exclude(
+        file_upload__content_hash=''
+    ).values('file_upload__content_hash')
+
+    with transaction.atomic():
+        job = ProcessingJob.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+            status='queued',
+            run_after__lte=now
+        ).exclude(
+            file_upload__content_hash__in=running_hashes
+        ).order_by('created_at').first()
+
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.worker_id = worker_id
+        job.started_at = now
+        job.finished_at = None
+        job.save(update_fields=['status', 'attempts', 'worker_id', 'started_at', 'finished_at', 'updated_at'])
+        return job
+
+
+def run_job(job):
+    """取得済みのジョブを実行し、結果を保存する
+
+    FileUploadに処理中の印を付けてから処理するため、同じファイルのジョブ・同期処理と重複しない。
+    既に処理済みの場合はClaude APIを呼ばずに成功とし、他の処理が処理中の場合は時間をおいて再実行する。
+    """
+    try:
+        response_data, response_status = run_exclusive_processing(job.file_upload_id)
+    except Exception as e:
+        logger.exception("処理ジョブ %s で予期しないエラーが発生しました", job.pk)
+        response_data = {'error': f'処理中にエラーが発生しました: {str(e)}'}
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    job.result = response_data
+    job.result_status = response_status
+    job.finished_at = timezone.now()
+
+    if status.is_success(response_status):
+        job.status = 'succeeded'
+        job.error_message = ''
+    elif response_status == status.HTTP_409_CONFLICT:
+        # 他の処理の結果を待つ（試行回数には数えない）
+        job.status = 'queued'
+        job.attempts -= 1
+        job.run_after = timezone.now() + timedelta(seconds=settings.PROCESSING_JOB_RETRY_DELAY)
+        job.error_message = response_data.get('error', '')
+    elif status.is_server_error(response_status) and job.attempts < job.max_attempts:
+        # 一時的なエラー（API障害など）は時間をおいて再実行
+        backoff = settings.PROCESSING_JOB_RETRY_DELAY * (2 ** (job.attempts - 1))
+        job.status = 'queued'
+        job.run_after = timezone.now() + timedelta(seconds=backoff)
+        job.error_message = response_data.get('error', '')
+    else:
+        job.status = 'failed'
+        job.error_message = response_data.get('error', '')
+
+    job.save()
+    logger.info(
+        "処理ジョブ %s: status=%s attempts=%s result_status=%s",
+        job.pk, job.status, job.attempts, response_status
+    )
+    return job
+
+
+def run_job_in_thread(job):
+    """ワーカーのスレッドでジョブを実行する（スレッドごとのDB接続を後始末する）"""
+    close_old_connections()
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+def requeue_stale_jobs(stale_after):
+    """ワーカー停止などで running のまま残ったジョブを待機中に戻す"""
+    now = timezone.now()
+    stale_jobs = ProcessingJob.objects.filter(
+        status='running',
+        started_at__lt=now - timedelta(seconds=stale_after)
+    )
+    stale_jobs.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, error_message='ワーカーが応答しなくなったため処理を中断しました。'
+    )
+    return stale_jobs.update(status='queued', run_after=now, worker_id='')
@@ -0,0 +1,279 @@
+import re
+import unicodedata
+from datetime import date, datetime
+from django.conf import settings
+from .manifest_import import COLUMN_ALIASES, REQUIRED_FIELDS
+
+# Claudeの抽出結果と同じ項目
+EXTRACTED_FIELDS = [
+    'sender_name', 'sender_phone', 'sender_address',
+    'recipient_name', 'recipient_phone', 'recipient_address',
+    'item_name', 'item_quantity', 'delivery_date', 'delivery_time',
+    'special_instructions', 'request_amount',
+]
+
+# 項目を直接表すラベル（マニフェストの列名に加えて帳票でよく使われる表記）
+_EXTRA_LABELS = {
+    'sender_name': ['ご依頼主名', 'ご依頼主', '発送元', '送り主', '荷送人', '荷送人名'],
+    'sender_phone': ['ご依頼主電話番号', '発送元電話番号', '荷送人電話番号'],
+    'sender_address': ['ご依頼主住所', '発送元住所', '荷送人住所'],
+    'recipient_name': ['届け先', '届け先名', 'お届け先氏名', '配送先', '配送先名', '送り先', '荷受人', '荷受人名'],
+    'recipient_phone': ['届け先電話番号', '配送先電話番号', '荷受人電話番号'],
+    'recipient_address': ['届け先住所', '送り先住所', '荷受人住所'],
+    'item_name': ['荷物', '品物', '内容品', '品目'],
+    'item_quantity': ['口数'],
+    'delivery_date': ['お届け希望日', '配達希望日', '希望日', '納品日'],
+    'delivery_time': ['配送希望時間帯', 'お届け希望時間', '希望時間帯', '時間指定', '配達時間'],
+    'special_instructions': ['特記事項', '注意事項'],
+    'request_amount': ['運賃', '料金', '代金'],
+}
+FIELD_LABELS = {
+    field: COLUMN_ALIASES.get(field, []) + _EXTRA_LABELS.get(field, [])
+    for field in EXTRACTED_FIELDS
+}
+
+# 差出人・届け先のブロック見出しと、ブロック内で使われる汎用ラベル
+SECTION_LABELS = {
+    'sender': ['差出人', 'ご依頼主', '依頼主', '発送元', '送り主', '荷送人'],
+    'recipient': ['お届け先', '届け先', '受取人', '配送先', '送り先', '荷受人'],
+}
+GENERIC_LABELS = {
+    'name': ['氏名', '名前', 'お名前', '名称', '会社名'],
+    'phone': ['電話番号', '電話', 'tel', '連絡先'],
+    'address': ['住所', 'ご住所', '所在地'],
+}
+
+PHONE_RE = re.compile(r'0\d{1,4}-?\d{1,4}-?\d{3,4}')
+POSTAL_CODE_RE = re.compile(r'〒?\s*(\d{3}-\d{4})')
+DATE_RE = re.compile(r'(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*日?')
+AMOUNT_RE = re.compile(r'¥?\s*(\d[\d,]*)(?:\.\d+)?\s*円?')
+QUANTITY_RE = re.compile(r'(\d+)')
+PREFECTURE_RE = re.compile(r'(東京都|北海道|(?:京都|大阪)府|.{2,3}県)')
+
+# ラベルと値の区切り（表の " | " を含む）
+SEPARATOR_RE = re.compile(r'\s*[:|\t]\s*|\s+')
+
+# スコアの目安
+SCORE_LABELED = 0.95      # 項目名ラベル＋値の形式が正しい
+SCORE_SECTION = 0.85      # 差出人・届け先ブロック内の汎用ラベル
+SCORE_UNVERIFIED = 0.75   # ラベルはあるが形式を確認できない（住所に都道府県が無いなど）
+SCORE_INFERRED = 0.6      # ラベル無しで正規表現のみから推定
+SCORE_INVALID = 0.3       # ラベルはあるが値の形式が正しくない
+SCORE_DEFAULT = 0.5       # 既定値を補った
+
+
+def _normalize(text):
+    """全角英数字・記号を半角に揃える"""
+    return unicodedata.normalize('NFKC', str(text)).strip()
+
+
+def _label_key(label):
+    return re.sub(r'[\s【】\[\]（）()「」・]', '', label).lower()
+
+
+_LABEL_TO_FIELD = {
+    _label_key(label): field
+    for field, labels in FIELD_LABELS.items()
+    for label in labels
+}
+_SECTION_KEYS = {
+    _label_key(label): section
+    for section, labels in SECTION_LABELS.items()
+    for label in labels
+}
+_GENERIC_KEYS = {
+    _label_key(label): kind
+    for kind, labels in GENERIC_LABELS.items()
+    for label in labels
+}
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    match = DATE_RE.search(value)
+    if not match:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+    except ValueError:
+        return None
+
+
+def score_value(field, value, base_score):
+    """値を項目ごとの形式で正規化し (値, スコア) を返す"""
+    if not isinstance(value, (date, datetime)):
+        value = _normalize(value) if value is not None else ''
+    if value == '':
+        return None, 0.0
+
+    if field.endswith('_phone'):
+        match = PHONE_RE.search(value.replace(' ', ''))
+        return (match.group(0), base_score) if match else (value, SCORE_INVALID)
+
+    if field == 'delivery_date':
+        parsed = _parse_date(value)
+        return (parsed, base_score) if parsed else (value, SCORE_INVALID)
+
+    if field == 'request_amount':
+        match = AMOUNT_RE.fullmatch(value)
+        return (int(match.group(1).replace(',', '')), base_score) if match else (value, SCORE_INVALID)
+
+    if field == 'item_quantity':
+        match = QUANTITY_RE.search(value)
+        return (int(match.group(1)), base_score) if match else (value, SCORE_INVALID)
+
+    if field.endswith('_address'):
+        has_location = POSTAL_CODE_RE.search(value) or PREFECTURE_RE.search(value)
+        return value, base_score if has_location else min(base_score, SCORE_UNVERIFIED)
+
+    return value, base_score
+
+
+class _Collector:
+    """項目ごとに最もスコアの高い値を保持する"""
+
+    def __init__(self):
+        self.values = {}
+        self.scores = {}
+
+    def add(self, field, value, base_score):
+        value, score = score_value(field, value, base_score)
+        if value is not None and score > self.scores.get(field, 0.0):
+            self.values[field] = value
+            self.scores[field] = score
+
+
+def _split_label(line):
+    """行を (ラベル, 値) に分割する（ラベルとして解釈できなければ None）"""
+    parts = SEPARATOR_RE.split(line, maxsplit=1)
+    label = _label_key(parts[0])
+    value = parts[1].strip() if len(parts) > 1 else ''
+    if label in _LABEL_TO_FIELD or label in _SECTION_KEYS or label in _GENERIC_KEYS:
+        return label, value
+    return None
+
+
+def _iter_pairs(line):
+    """表の行（"a | b | c | d"）はセルの組ごと、それ以外は行全体を (ラベル, 値) として返す"""
+    if ' | ' in line:
+        cells = [cell.strip() for cell in line.split(' | ')]
+        for index in range(len(cells) - 1):
+            label = _label_key(cells[index])
+            if label in _LABEL_TO_FIELD or label in _GENERIC_KEYS:
+                yield label, cells[index + 1]
+        return
+    pair = _split_label(line)
+    if pair:
+        yield pair
+
+
+def extract_from_text(text):
+    """ラベル付きテキスト（PDFのテキスト・表）から項目を抽出する"""
+    collector = _Collector()
+    section = None
+    pending = None  # 値が次の行に書かれているラベル
+
+    lines = [_normalize(line) for line in text.splitlines()]
+    for line in lines:
+        if not line or line.startswith('---'):
+            continue
+
+        pairs = list(_iter_pairs(line))
+        if not pairs:
+            if pending:
+                field, score, prefix = pending
+                if field.endswith('_address') and POSTAL_CODE_RE.fullmatch(line):
+                    # 郵便番号だけの行の次に住所が続く場合
+                    pending = (field, score, line)
+                    continue
+                collector.add(field, f"{prefix} {line}".strip(), score)
+                pending = None
+            continue
+        pending = None
+
+        for label, value in pairs:
+            if label in _SECTION_KEYS:
+                nested = _split_label(value) if value else None
+                if not value or (nested and nested[0] in _GENERIC_KEYS):
+                    # 「差出人」「お届け先」などのブロック見出し（「お届け先 住所: ...」のように続く場合も含む）
+                    section = _SECTION_KEYS[label]
+                    if not nested:
+                        continue
+                    label, value = nested
+
+            if label in _GENERIC_KEYS:
+                if not section:
+                    continue
+                field = f"{section}_{_GENERIC_KEYS[label]}"
+                score = SCORE_SECTION
+            else:
+                field = _LABEL_TO_FIELD.get(label)
+                if not field:
+                    continue
+                score = SCORE_LABELED
+
+            if value:
+                collector.add(field, value, score)
+            else:
+                pending = (field, score, '')
+
+    # ラベルが見つからなかった日付は、本文中に1つだけあれば推定で採用する
+    if 'delivery_date' not in collector.values:
+        dates = {_parse_date(match.group(0)) for match in DATE_RE.finditer('\n'.join(lines))} - {None}
+        if len(dates) == 1:
+            collector.add('delivery_date', dates.pop(), SCORE_INFERRED)
+
+    return collector
+
+
+def extract_from_records(headers, records):
+    """CSV/Excelの表形式データから、最初の行の項目を抽出する"""
+    collector = _Collector()
+    if not records:
+        return collector
+
+    first_record = records[0]
+    for header in headers:
+        field = _LABEL_TO_FIELD.get(_label_key(_normalize(header)))
+        if field:
+            value = first_record.get(header)
+            if value is not None and value == value:  # NaN を除外
+                collector.add(field, value, SCORE_LABELED)
+    return collector
+
+
+def extract_locally(processed_content):
+    """process_file_content の結果からルールベースで項目を抽出する
+
+    (抽出データ, 項目ごとのスコア) を返す。対象外の形式の場合は None を返す。
+    抽出データの形式はClaudeの抽出結果と同じ。
+    """
+    content_type = processed_content['type']
+    if content_type == 'text':
+        collector = extract_from_text(processed_content['content'])
+    elif content_type in ['excel', 'csv']:
+        content = processed_content['content']
+        collector = extract_from_records(content['headers'], content['data'])
+    else:
+        return None
+
+    extracted_data = {field: collector.values.get(field, '') for field in EXTRACTED_FIELDS}
+    field_scores = {field: round(collector.scores.get(field, 0.0), 2) for field in EXTRACTED_FIELDS}
+
+    # 数量・金額は配送依頼の作成で使える既定値を補う
+    if extracted_data['item_quantity'] == '' or field_scores['item_quantity'] < settings.LOCAL_EXTRACTION_MIN_CONFIDENCE:
+        extracted_data['item_quantity'] = 1
+        field_scores['item_quantity'] = SCORE_DEFAULT
+    if extracted_data['request_amount'] == '':
+        extracted_data['request_amount'] = None
+
+    return extracted_data, field_scores
+
+
+def is_confident(field_scores):
+    """必須項目がすべて信頼度のしきい値以上か（満たさない場合はClaudeで処理する）"""
+    threshold = settings.LOCAL_EXTRACTION_MIN_CONFIDENCE
+    return all(field_scores.get(field, 0.0) >= threshold for field in REQUIRED_FIELDS)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from apps.files.chunked_upload import cleanup_expired_sessions
+
+
+class Command(BaseCommand):
+    help = '期限切れ（CHUNKED_UPLOAD_EXPIRY_HOURS）の未完了分割アップロードを削除する'
+
+    def handle(self, *args, **options):
+        count = cleanup_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f"{count}件のアップロードセッションを削除しました。"))
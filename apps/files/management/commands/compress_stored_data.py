@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.files.fields import COMPRESSED_MARKER
+from apps.files.models import FileUpload
+from apps.files.storage import get_blob_store
+
+
+class Command(BaseCommand):
+    help = '圧縮せずに保存されているBLOBとClaude APIのレスポンス（claude_response）をバッチ単位で圧縮する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='1バッチで処理する件数')
+        parser.add_argument('--skip-blobs', action='store_true', help='BLOBを圧縮しない')
+        parser.add_argument('--skip-responses', action='store_true', help='claude_responseを圧縮しない')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if not options['skip_responses']:
+            self.compress_responses(batch_size)
+        if not options['skip_blobs']:
+            self.compress_blobs(batch_size)
+
+    def compress_responses(self, batch_size):
+        # 保存し直すと CompressedJSONField が一定サイズ以上の値を圧縮する
+        pending = FileUpload.objects.filter(claude_response__isnull=False).exclude(
+            claude_response__has_key=COMPRESSED_MARKER
+        )
+        total = pending.count()
+        self.stdout.write(f"claude_response 対象: {total}件")
+
+        processed = 0
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).order_by('pk').only('pk', 'claude_response')[:batch_size])
+            if not batch:
+                break
+            FileUpload.objects.bulk_update(batch, ['claude_response'])
+            processed += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"{processed}/{total}件を処理しました。")
+
+        compressed = FileUpload.objects.filter(claude_response__has_key=COMPRESSED_MARKER).count()
+        self.stdout.write(self.style.SUCCESS(f"claude_response 圧縮済み: {compressed}件"))
+
+    def compress_blobs(self, batch_size):
+        store = get_blob_store()
+        pending = FileUpload.objects.exclude(content_hash='').filter(
+            mime_type__in=settings.BLOB_COMPRESSION_CONTENT_TYPES
+        ).values_list('content_hash', 'mime_type').order_by('content_hash').distinct()
+
+        compressed = 0
+        checked = 0
+        for content_hash, mime_type in pending.iterator(chunk_size=batch_size):
+            checked += 1
+            try:
+                if store.compress(content_hash, content_type=mime_type):
+                    compressed += 1
+            except Exception as e:
+                self.stderr.write(f"BLOB {content_hash}: 圧縮に失敗しました: {e}")
+            if checked % batch_size == 0:
+                self.stdout.write(f"{checked}件のBLOBを確認しました。")
+
+        self.stdout.write(self.style.SUCCESS(f"BLOB 圧縮: {compressed}件（確認: {checked}件）"))
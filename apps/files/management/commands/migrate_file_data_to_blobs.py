@@ -0,0 +1,62 @@
+import base64
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.files.models import FileUpload
+from apps.files.storage import get_blob_store
+
+
+class Command(BaseCommand):
+    help = '旧形式（Base64のfile_data）で保存されたファイルをBLOBストアへバッチ単位で移行する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='1バッチで移行する件数')
+        parser.add_argument('--limit', type=int, default=0, help='移行する最大件数（0は無制限）')
+        parser.add_argument('--dry-run', action='store_true', help='対象件数の表示のみ行う')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+
+        pending = FileUpload.objects.filter(file_data__isnull=False).exclude(file_data='')
+        total = pending.count()
+        self.stdout.write(f"移行対象: {total}件")
+        if options['dry_run'] or total == 0:
+            return
+
+        store = get_blob_store()
+        migrated = 0
+        failed = 0
+        last_pk = 0
+
+        while True:
+            # file_data以外の大きな列は読み込まない
+            batch = list(
+                pending.filter(pk__gt=last_pk).order_by('pk').only('pk', 'file_data', 'mime_type')[:batch_size]
+            )
+            if not batch:
+                break
+
+            with transaction.atomic():
+                for file_upload in batch:
+                    last_pk = file_upload.pk
+                    try:
+                        content = base64.b64decode(file_upload.file_data)
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"FileUpload#{file_upload.pk}: Base64デコードに失敗しました: {e}")
+                        continue
+
+                    content_hash, file_size = store.save([content], content_type=file_upload.mime_type)
+                    FileUpload.objects.filter(pk=file_upload.pk).update(
+                        content_hash=content_hash,
+                        file_size=file_size,
+                        file_data=None
+                    )
+                    migrated += 1
+
+            self.stdout.write(f"{migrated}/{total}件を移行しました。")
+
+            if limit and migrated >= limit:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"移行完了: {migrated}件（失敗: {failed}件）"))
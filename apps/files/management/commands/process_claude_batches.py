@@ -0,0 +1,54 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from apps.files.batches import BatchError, poll_batches, submit_batch
+
+
+class Command(BaseCommand):
+    help = '未処理の帳票をMessage Batches APIでまとめて処理する（登録・完了確認・結果の書き戻し）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submit-only', action='store_true', help='バッチの登録のみ行う')
+        parser.add_argument('--poll-only', action='store_true', help='処理中バッチの完了確認のみ行う')
+        parser.add_argument(
+            '--max-requests', type=int, default=settings.CLAUDE_BATCH_MAX_REQUESTS,
+            help='1バッチに含める最大件数'
+        )
+        parser.add_argument(
+            '--max-bytes', type=int, default=settings.CLAUDE_BATCH_MAX_BYTES,
+            help='1バッチのリクエストの合計サイズの上限（バイト）'
+        )
+        parser.add_argument('--wait', action='store_true', help='処理中のバッチがすべて完了するまで待つ')
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.CLAUDE_BATCH_POLL_INTERVAL,
+            help='--wait 指定時の完了確認の間隔（秒）'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if not options['poll_only']:
+                batches, summary = submit_batch(options['max_requests'], options['max_bytes'])
+                if summary['completed_locally']:
+                    self.stdout.write(f"{summary['completed_locally']}件は再利用・ルールベース抽出で処理しました。")
+                if summary['skipped']:
+                    self.stdout.write(self.style.WARNING(f"{summary['skipped']}件は処理できないためスキップしました。"))
+                for batch in batches:
+                    self.stdout.write(f"バッチ {batch.batch_id} を登録しました（{batch.request_count}件）。")
+                if not batches:
+                    self.stdout.write("登録対象のファイルはありません。")
+
+            if options['submit_only']:
+                return
+
+            while True:
+                close_old_connections()
+                in_progress = poll_batches()
+                if not in_progress or not options['wait']:
+                    break
+                self.stdout.write(f"処理中のバッチ: {in_progress}件")
+                time.sleep(options['poll_interval'])
+        except BatchError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"完了確認が終わりました（処理中のバッチ: {in_progress}件）。"))
@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.files.jobs import claim_next_job, run_job_in_thread, requeue_stale_jobs, default_worker_id
+
+
+class Command(BaseCommand):
+    help = '帳票処理ジョブ（Claude API処理）をバックグラウンドで実行するワーカー'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='待機中のジョブを処理したら終了する')
+        parser.add_argument('--max-jobs', type=int, default=0, help='処理するジョブの上限（0は無制限）')
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.PROCESSING_JOB_CONCURRENCY,
+            help='同時に処理するジョブ数（CLAUDE_API_MAX_CONCURRENCY が上限）'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.PROCESSING_JOB_POLL_INTERVAL,
+            help='ジョブが無い場合の待機秒数'
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=settings.PROCESSING_JOB_STALE_AFTER,
+            help='running のまま残ったジョブを再投入するまでの秒数'
+        )
+
+    def handle(self, *args, **options):
+        worker_id = default_worker_id()
+        max_jobs = options['max_jobs']
+        # Claude APIの同時リクエスト数を超えて取得しても待つだけなので、それを上限とする
+        concurrency = max(1, min(options['concurrency'], settings.CLAUDE_API_MAX_CONCURRENCY))
+        claimed = 0
+        processed = 0
+        in_flight = set()
+
+        self.stdout.write(f"ワーカー {worker_id} を起動しました（同時処理数: {concurrency}）。")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                close_old_connections()
+
+                requeued = requeue_stale_jobs(options['stale_after'])
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f"{requeued}件の停止ジョブを再投入しました。"))
+
+                # 空いている分だけジョブを取得する
+                while len(in_flight) < concurrency and not (max_jobs and claimed >= max_jobs):
+                    job = claim_next_job(worker_id)
+                    if job is None:
+                        break
+                    claimed += 1
+                    in_flight.add(executor.submit(run_job_in_thread, job))
+
+                if not in_flight:
+                    if options['once'] or (max_jobs and claimed >= max_jobs):
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, in_flight = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = future.result()
+                    processed += 1
+                    self.stdout.write(f"Job#{job.pk} (FileUpload#{job.file_upload_id}): {job.status}")
+
+        self.stdout.write(self.style.SUCCESS(f"{processed}件のジョブを処理しました。"))
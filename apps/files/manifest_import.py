@@ -0,0 +1,310 @@
+import codecs
+import itertools
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import pandas as pd
+from apps.delivery.models import DeliveryRequest
+from .models import FileUpload
+from .storage import CHUNK_SIZE, iter_chunks, open_upload_content
+
+logger = logging.getLogger(__name__)
+
+# 配送依頼のフィールドと、マニフェストの列名として受け付ける表記
+COLUMN_ALIASES = {
+    'title': ['title', '案件名', '件名'],
+    'sender_name': ['sender_name', '差出人名', '差出人', '依頼主名', '依頼主'],
+    'sender_phone': ['sender_phone', '差出人電話番号', '差出人電話', '依頼主電話番号'],
+    'sender_address': ['sender_address', '差出人住所', '依頼主住所'],
+    'recipient_name': ['recipient_name', '受取人名', '受取人', 'お届け先名', 'お届け先'],
+    'recipient_phone': ['recipient_phone', '受取人電話番号', '受取人電話', 'お届け先電話番号'],
+    'recipient_address': ['recipient_address', '配送先住所', '受取人住所', 'お届け先住所'],
+    'item_name': ['item_name', '荷物名', '品名', '商品名'],
+    'item_quantity': ['item_quantity', '数量', '個数'],
+    'item_size': ['item_size', 'サイズ'],
+    'delivery_date': ['delivery_date', '配送希望日', '配送日', 'お届け日'],
+    'delivery_time': ['delivery_time', '配送希望時間', '時間帯', 'お届け時間'],
+    'special_instructions': ['special_instructions', '特別な指示', '備考', '配送指示'],
+    'request_amount': ['request_amount', '依頼金額', '金額'],
+}
+
+REQUIRED_FIELDS = [
+    'sender_name', 'sender_phone', 'sender_address',
+    'recipient_name', 'recipient_phone', 'recipient_address',
+    'item_name', 'delivery_date',
+]
+
+DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y年%m月%d日']
+
+# エンコーディング判定に使う先頭部分のサイズ
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+class ManifestError(Exception):
+    """マニフェスト全体を取り込めない場合のエラー"""
+
+
+class ManifestAlreadyImportedError(ManifestError):
+    """同じファイルのマニフェストを取り込み済み"""
+
+
+def sniff_encoding(sample):
+    """CSVの先頭部分からエンコーディングを判定する（UTF-8として読めなければShift_JIS）"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        # サンプル末尾で切れたマルチバイト文字はエラーにしない（final=False）
+        decoder.decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+
+def _normalize_header(header):
+    return str(header).strip().lower().replace(' ', '_') if header is not None else ''
+
+
+def map_columns(headers):
+    """列名から配送依頼フィールドへの対応（{列番号: フィールド名}）を作る"""
+    alias_to_field = {
+        _normalize_header(alias): field
+        for field, aliases in COLUMN_ALIASES.items()
+        for alias in aliases
+    }
+    mapping = {}
+    for index, header in enumerate(headers):
+        field = alias_to_field.get(_normalize_header(header))
+        if field and field not in mapping.values():
+            mapping[index] = field
+
+    missing = [field for field in REQUIRED_FIELDS if field not in mapping.values()]
+    if missing:
+        raise ManifestError(f"必須の列がありません: {', '.join(missing)}")
+    return mapping
+
+
+@contextmanager
+def read_csv_rows(file_upload, chunk_size):
+    """CSVをチャンク単位で読み出し (ヘッダー, 行のイテレータ) を返す"""
+    with open_upload_content(file_upload) as f:
+        encoding = sniff_encoding(f.read(ENCODING_SAMPLE_SIZE))
+
+    with open_upload_content(file_upload) as f:
+        try:
+            reader = pd.read_csv(
+                f, encoding=encoding, chunksize=chunk_size,
+                dtype=str, keep_default_na=False, skip_blank_lines=False, skipinitialspace=True
+            )
+            first_chunk = next(reader, None)
+        except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            raise ManifestError(f"CSV読み取りエラー: {str(e)}")
+        if first_chunk is None:
+            raise ManifestError('データ行がありません。')
+
+        def rows():
+            try:
+                for chunk in itertools.chain([first_chunk], reader):
+                    yield from chunk.itertuples(index=False, name=None)
+            except (UnicodeDecodeError, pd.errors.ParserError) as e:
+                raise ManifestError(f"CSV読み取りエラー: {str(e)}")
+
+        yield list(first_chunk.columns), rows()
+
+
+def _seekable_copy(fileobj):
+    """openpyxlはシーク可能なファイルを必要とするため、S3等のストリームは一時ファイルに書き出す"""
+    if hasattr(fileobj, 'seekable') and fileobj.seekable():
+        return fileobj
+    spooled = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE * 8)
+    for chunk in iter_chunks(fileobj):
+        spooled.write(chunk)
+    fileobj.close()
+    spooled.seek(0)
+    return spooled
+
+
+@contextmanager
+def read_excel_rows(file_upload):
+    """Excel（.xlsx）を read_only モードで1行ずつ読み出し (ヘッダー, 行のイテレータ) を返す"""
+    import openpyxl
+
+    with _seekable_copy(open_upload_content(file_upload)) as f:
+        try:
+            workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        except Exception as e:
+            raise ManifestError(f"Excel読み取りエラー: {str(e)}")
+
+        try:
+            row_iter = workbook.active.iter_rows(values_only=True)
+            headers = next(row_iter, None)
+            if headers is None:
+                raise ManifestError('データ行がありません。')
+            yield list(headers), row_iter
+        finally:
+            workbook.close()
+
+
+def _clean_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _clean_text(value)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError('日付の形式が正しくありません。（例: 2024-12-25）')
+
+
+def _parse_quantity(value):
+    text = _clean_text(value)
+    if not text:
+        return 1
+    try:
+        quantity = int(Decimal(text.replace(',', '')))
+    except (InvalidOperation, ValueError, OverflowError):
+        raise ValueError('数値を入力してください。')
+    if quantity < 1:
+        raise ValueError('1以上の数値を入力してください。')
+    return quantity
+
+
+def _parse_amount(value):
+    text = _clean_text(value).replace(',', '').replace('¥', '').replace('円', '')
+    if not text:
+        return None
+    try:
+        amount = Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError('数値を入力してください。')
+    if amount.copy_abs() >= Decimal(10) ** 8:
+        raise ValueError('金額が大きすぎます。')
+    return amount
+
+
+_FIELD_PARSERS = {
+    'delivery_date': _parse_date,
+    'item_quantity': _parse_quantity,
+    'request_amount': _parse_amount,
+}
+
+
+def build_delivery_request(values, requester):
+    """1行分の値から配送依頼を作成する（保存はしない）
+
+    (DeliveryRequest, None) または (None, {フィールド名: エラーメッセージ}) を返す。
+    """
+    data = {}
+    errors = {}
+    for field, value in values.items():
+        parser = _FIELD_PARSERS.get(field)
+        try:
+            data[field] = parser(value) if parser else _clean_text(value)
+        except ValueError as e:
+            errors[field] = str(e)
+
+    for field in REQUIRED_FIELDS:
+        if field not in errors and not data.get(field):
+            errors[field] = 'この項目は必須です。'
+
+    if not data.get('title'):
+        data['title'] = data.get('item_name', '')
+
+    for field, value in data.items():
+        max_length = DeliveryRequest._meta.get_field(field).max_length
+        if max_length and isinstance(value, str) and len(value) > max_length and field not in errors:
+            errors[field] = f'{max_length}文字以下にしてください。'
+
+    if errors:
+        return None, errors
+    return DeliveryRequest(requester=requester, **data), None
+
+
+def import_manifest(file_upload, requester, batch_size=None):
+    """CSV/Excelのマニフェストを行単位で読み込み、配送依頼を一括作成する
+
+    行はチャンク単位で読み出し、batch_size 件ごとに bulk_create する。
+    不正な行は取り込まずに行番号（ヘッダーを1行目とする）とエラー内容を返す。
+    取り込み済みのファイルは ManifestAlreadyImportedError を送出する（1件も作成できなかった場合は再取り込み可能）。
+    """
+    batch_size = batch_size or settings.MANIFEST_IMPORT_BATCH_SIZE
+    extension = Path(file_upload.original_name).suffix.lower()
+
+    if extension == '.csv':
+        reader = read_csv_rows(file_upload, chunk_size=batch_size)
+    elif extension == '.xlsx':
+        reader = read_excel_rows(file_upload)
+    else:
+        raise ManifestError(f"未対応のファイル形式です: {extension}（CSVまたはxlsxを指定してください）")
+
+    total_rows = 0
+    created = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    with reader as (headers, rows), transaction.atomic():
+        # 同時に取り込まれないよう行をロックしてから取り込み済みか確認する
+        imported_at = FileUpload.objects.select_for_update().values_list(
+            'manifest_imported_at', flat=True
+        ).get(pk=file_upload.pk)
+        if imported_at:
+            raise ManifestAlreadyImportedError(
+                f"このファイルは取り込み済みです（{timezone.localtime(imported_at):%Y-%m-%d %H:%M}）。"
+            )
+        mapping = map_columns(headers)
+
+        for row_number, row in enumerate(rows, start=2):
+            if not any(_clean_text(value) for value in row):
+                continue  # 空行
+            total_rows += 1
+
+            values = {field: row[index] if index < len(row) else None for index, field in mapping.items()}
+            delivery_request, row_errors = build_delivery_request(values, requester)
+            if row_errors:
+                failed += 1
+                if len(errors) < settings.MANIFEST_IMPORT_MAX_ERRORS:
+                    errors.append({'row': row_number, 'errors': row_errors})
+                continue
+
+            batch.append(delivery_request)
+            if len(batch) >= batch_size:
+                DeliveryRequest.objects.bulk_create(batch, batch_size=batch_size)
+                created += len(batch)
+                batch = []
+
+        if batch:
+            DeliveryRequest.objects.bulk_create(batch, batch_size=batch_size)
+            created += len(batch)
+
+        if created:
+            file_upload.manifest_imported_at = timezone.now()
+            FileUpload.objects.filter(pk=file_upload.pk).update(manifest_imported_at=file_upload.manifest_imported_at)
+
+    logger.info(
+        "マニフェスト取り込み: FileUpload#%s %s行（作成: %s, エラー: %s）",
+        file_upload.pk, total_rows, created, failed
+    )
+
+    return {
+        'total_rows': total_rows,
+        'created': created,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors)
+    }
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0003_fileupload_file_data_alter_fileupload_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '処理中'), ('succeeded', '完了'), ('failed', '失敗')], default='queued', max_length=20, verbose_name='ステータス')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='試行回数')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='最大試行回数')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='実行可能日時')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='処理結果')),
+                ('result_status', models.PositiveIntegerField(blank=True, null=True, verbose_name='処理結果ステータスコード')),
+                ('error_message', models.TextField(blank=True, verbose_name='エラーメッセージ')),
+                ('worker_id', models.CharField(blank=True, max_length=100, verbose_name='ワーカーID')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('file_upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processing_jobs', to='files.fileupload', verbose_name='対象ファイル')),
+                ('requested_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processing_jobs', to=settings.AUTH_USER_MODEL, verbose_name='依頼者')),
+            ],
+            options={
+                'verbose_name': '帳票処理ジョブ',
+                'verbose_name_plural': '帳票処理ジョブ',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after', 'created_at'], name='files_job_claim_idx')],
+            },
+        ),
+    ]
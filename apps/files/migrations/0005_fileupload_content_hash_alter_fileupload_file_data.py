@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='コンテンツハッシュ（SHA-256）'),
+        ),
+        migrations.AlterField(
+            model_name='fileupload',
+            name='file_data',
+            field=models.TextField(blank=True, null=True, verbose_name='ファイルデータ（Base64・旧）'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0005_fileupload_content_hash_alter_fileupload_file_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_name', models.CharField(max_length=255, verbose_name='元のファイル名')),
+                ('file_type', models.CharField(choices=[('delivery_document', '配送帳票'), ('receipt', '受領書'), ('other', 'その他')], default='delivery_document', max_length=20, verbose_name='ファイルタイプ')),
+                ('mime_type', models.CharField(max_length=100, verbose_name='MIMEタイプ')),
+                ('total_size', models.PositiveBigIntegerField(verbose_name='合計サイズ（バイト）')),
+                ('received_size', models.PositiveBigIntegerField(default=0, verbose_name='受信済みサイズ（バイト）')),
+                ('status', models.CharField(choices=[('uploading', 'アップロード中'), ('completed', '完了')], default='uploading', max_length=20, verbose_name='ステータス')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('file_upload', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='files.fileupload', verbose_name='作成されたファイル')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL, verbose_name='アップロード者')),
+            ],
+            options={
+                'verbose_name': '分割アップロードセッション',
+                'verbose_name_plural': '分割アップロードセッション',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='processing_source',
+            field=models.CharField(blank=True, choices=[('claude', 'Claude API'), ('cache', '処理済み結果の再利用')], max_length=20, verbose_name='処理結果の取得元'),
+        ),
+        migrations.AlterField(
+            model_name='fileupload',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='コンテンツハッシュ（SHA-256）'),
+        ),
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(fields=['content_hash', 'is_processed'], name='files_upload_hash_proc_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_fileupload_processing_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='field_scores',
+            field=models.JSONField(blank=True, null=True, verbose_name='項目ごとの信頼度'),
+        ),
+        migrations.AlterField(
+            model_name='fileupload',
+            name='processing_source',
+            field=models.CharField(blank=True, choices=[('claude', 'Claude API'), ('cache', '処理済み結果の再利用'), ('local', 'ルールベース抽出')], max_length=20, verbose_name='処理結果の取得元'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0008_fileupload_field_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaudeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=100, unique=True, verbose_name='バッチID')),
+                ('status', models.CharField(choices=[('in_progress', '処理中'), ('ended', '完了')], default='in_progress', max_length=20, verbose_name='ステータス')),
+                ('request_count', models.PositiveIntegerField(default=0, verbose_name='リクエスト数')),
+                ('succeeded_count', models.PositiveIntegerField(default=0, verbose_name='成功数')),
+                ('errored_count', models.PositiveIntegerField(default=0, verbose_name='失敗数')),
+                ('ended_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'Claude処理バッチ',
+                'verbose_name_plural': 'Claude処理バッチ',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='fileupload',
+            name='processing_source',
+            field=models.CharField(blank=True, choices=[('claude', 'Claude API'), ('cache', '処理済み結果の再利用'), ('local', 'ルールベース抽出'), ('claude_batch', 'Claude API（バッチ）')], max_length=20, verbose_name='処理結果の取得元'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='claude_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='file_uploads', to='files.claudebatch', verbose_name='Claude処理バッチ'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_claudebatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='cache_creation_input_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='キャッシュ書き込みトークン数'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='cache_read_input_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='キャッシュ読み込みトークン数'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='input_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='入力トークン数'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='output_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='出力トークン数'),
+        ),
+    ]
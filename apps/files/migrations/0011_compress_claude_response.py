@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:06
+
+import apps.files.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_fileupload_token_usage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileupload',
+            name='claude_response',
+            field=apps.files.fields.CompressedJSONField(blank=True, null=True, verbose_name='Claude API レスポンス'),
+        ),
+    ]
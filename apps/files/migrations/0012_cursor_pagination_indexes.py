@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:15
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 稼働中のテーブルへの書き込みを止めないよう CREATE INDEX CONCURRENTLY で作成する
+    # （トランザクション内では実行できないため atomic = False）
+    atomic = False
+
+    dependencies = [
+        ('files', '0011_compress_claude_response'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='fileupload',
+            index=models.Index(fields=['uploader', '-created_at', '-id'], name='files_upload_owner_cursor_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fileupload',
+            index=models.Index(fields=['-created_at', '-id'], name='files_upload_cursor_idx'),
+        ),
+    ]
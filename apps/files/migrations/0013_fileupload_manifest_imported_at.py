@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0012_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='manifest_imported_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='マニフェスト取り込み日時'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0013_fileupload_manifest_imported_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='batch_prepare_failures',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='バッチ登録の失敗回数'),
+        ),
+    ]
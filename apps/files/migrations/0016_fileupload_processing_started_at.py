@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0015_streamticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='処理開始日時'),
+        ),
+    ]
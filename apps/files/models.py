@@ -1,5 +1,8 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from .fields import CompressedJSONField
 
 User = get_user_model()
 
@@ -13,8 +16,10 @@ class FileUpload(models.Model):
     ]
 
     uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_files', verbose_name='アップロード者')
-    # ファイルデータをBase64でテキストフィールドに保存（最大10MB想定）
-    file_data = models.TextField('ファイルデータ（Base64）', blank=True, null=True)
+    # ファイル本体はBLOBストアに保存し、ここではSHA-256（BLOBキー）のみ保持する
+    content_hash = models.CharField('コンテンツハッシュ（SHA-256）', max_length=64, blank=True)
+    # 旧形式：ファイルデータをBase64でテキストフィールドに保存（migrate_file_data_to_blobs で移行後に削除）
+    file_data = models.TextField('ファイルデータ（Base64・旧）', blank=True, null=True)
     # 既存のfileフィールドは互換性のため残す（後で削除）
     file = models.FileField('ファイル（旧）', upload_to='uploads/%Y/%m/%d/', blank=True, null=True)
     original_name = models.CharField('元のファイル名', max_length=255)
@@ -23,10 +28,40 @@ class FileUpload(models.Model):
     mime_type = models.CharField('MIMEタイプ', max_length=100)
     
     # Claude API関連
+    PROCESSING_SOURCE_CHOICES = [
+        ('claude', 'Claude API'),
+        ('cache', '処理済み結果の再利用'),
+        ('local', 'ルールベース抽出'),
+        ('claude_batch', 'Claude API（バッチ）'),
+    ]
+
     is_processed = models.BooleanField('Claude処理済み', default=False)
-    claude_response = models.JSONField('Claude API レスポンス', null=True, blank=True)
+    processing_source = models.CharField('処理結果の取得元', max_length=20, choices=PROCESSING_SOURCE_CHOICES, blank=True)
+    # 処理中のリクエスト・ジョブが処理を開始した日時（処理の二重実行の防止、処理が終わると空に戻す）
+    processing_started_at = models.DateTimeField('処理開始日時', null=True, blank=True)
+    claude_response = CompressedJSONField('Claude API レスポンス', null=True, blank=True)
     extracted_data = models.JSONField('抽出データ', null=True, blank=True)
+    field_scores = models.JSONField('項目ごとの信頼度', null=True, blank=True)
+
+    # Claude APIのトークン使用量（プロンプトキャッシュの効果測定用）
+    input_tokens = models.PositiveIntegerField('入力トークン数', null=True, blank=True)
+    output_tokens = models.PositiveIntegerField('出力トークン数', null=True, blank=True)
+    cache_read_input_tokens = models.PositiveIntegerField('キャッシュ読み込みトークン数', null=True, blank=True)
+    cache_creation_input_tokens = models.PositiveIntegerField('キャッシュ書き込みトークン数', null=True, blank=True)
+    claude_batch = models.ForeignKey(
+        'ClaudeBatch',
+        on_delete=models.SET_NULL,
+        related_name='file_uploads',
+        null=True,
+        blank=True,
+        verbose_name='Claude処理バッチ'
+    )
+    # バッチ登録用のリクエストを作れなかった回数（上限に達したものはバッチの対象外）
+    batch_prepare_failures = models.PositiveSmallIntegerField('バッチ登録の失敗回数', default=0)
     
+    # マニフェスト（CSV/Excel）から配送依頼を取り込んだ日時（二重取り込みの防止）
+    manifest_imported_at = models.DateTimeField('マニフェスト取り込み日時', null=True, blank=True)
+
     # 配送案件との関連（オプション）
     delivery_request = models.ForeignKey(
         'delivery.DeliveryRequest', 
@@ -44,6 +79,137 @@ class FileUpload(models.Model):
         verbose_name = 'ファイルアップロード'
         verbose_name_plural = 'ファイルアップロード'
         ordering = ['-created_at']
+        indexes = [
+            # 同一内容の処理済みファイル検索（処理結果の再利用）用
+            models.Index(fields=['content_hash', 'is_processed'], name='files_upload_hash_proc_idx'),
+            # 一覧のカーソルページネーション（created_at, id の降順）
+            models.Index(fields=['uploader', '-created_at', '-id'], name='files_upload_owner_cursor_idx'),
+            models.Index(fields=['-created_at', '-id'], name='files_upload_cursor_idx'),
+        ]
 
     def __str__(self):
         return f"{self.original_name} - {self.uploader.username}"
+
+
+class ProcessingJob(models.Model):
+    """帳票処理ジョブ（Claude API処理のバックグラウンド実行）"""
+    STATUS_CHOICES = [
+        ('queued', '待機中'),
+        ('running', '処理中'),
+        ('succeeded', '完了'),
+        ('failed', '失敗'),
+    ]
+
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='processing_jobs', verbose_name='対象ファイル')
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='processing_jobs', verbose_name='依頼者')
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='queued')
+
+    # リトライ制御
+    attempts = models.PositiveIntegerField('試行回数', default=0)
+    max_attempts = models.PositiveIntegerField('最大試行回数', default=3)
+    run_after = models.DateTimeField('実行可能日時', default=timezone.now)
+
+    # 実行結果
+    result = models.JSONField('処理結果', null=True, blank=True)
+    result_status = models.PositiveIntegerField('処理結果ステータスコード', null=True, blank=True)
+    error_message = models.TextField('エラーメッセージ', blank=True)
+    worker_id = models.CharField('ワーカーID', max_length=100, blank=True)
+
+    started_at = models.DateTimeField('開始日時', null=True, blank=True)
+    finished_at = models.DateTimeField('終了日時', null=True, blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '帳票処理ジョブ'
+        verbose_name_plural = '帳票処理ジョブ'
+        ordering = ['-created_at']
+        indexes = [
+            # ワーカーの取得クエリ（status='queued' AND run_after <= now ORDER BY created_at）用
+            models.Index(fields=['status', 'run_after', 'created_at'], name='files_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job#{self.pk} {self.file_upload.original_name} ({self.status})"
+
+
+class ClaudeBatch(models.Model):
+    """Message Batches APIでまとめて登録したClaude処理バッチ"""
+    STATUS_CHOICES = [
+        ('in_progress', '処理中'),
+        ('ended', '完了'),
+    ]
+
+    batch_id = models.CharField('バッチID', max_length=100, unique=True)
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    request_count = models.PositiveIntegerField('リクエスト数', default=0)
+    succeeded_count = models.PositiveIntegerField('成功数', default=0)
+    errored_count = models.PositiveIntegerField('失敗数', default=0)
+
+    ended_at = models.DateTimeField('終了日時', null=True, blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Claude処理バッチ'
+        verbose_name_plural = 'Claude処理バッチ'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.batch_id} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """分割アップロードセッション（大きなファイルのレジューム可能なアップロード）"""
+    STATUS_CHOICES = [
+        ('uploading', 'アップロード中'),
+        ('completed', '完了'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='アップロード者')
+    original_name = models.CharField('元のファイル名', max_length=255)
+    file_type = models.CharField('ファイルタイプ', max_length=20, choices=FileUpload.FILE_TYPE_CHOICES, default='delivery_document')
+    mime_type = models.CharField('MIMEタイプ', max_length=100)
+    total_size = models.PositiveBigIntegerField('合計サイズ（バイト）')
+    received_size = models.PositiveBigIntegerField('受信済みサイズ（バイト）', default=0)
+    status = models.CharField('ステータス', max_length=20, choices=STATUS_CHOICES, default='uploading')
+    file_upload = models.OneToOneField(
+        FileUpload,
+        on_delete=models.SET_NULL,
+        related_name='upload_session',
+        null=True,
+        blank=True,
+        verbose_name='作成されたファイル'
+    )
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '分割アップロードセッション'
+        verbose_name_plural = '分割アップロードセッション'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.original_name} ({self.received_size}/{self.total_size})"
+
+
+class StreamTicket(models.Model):
+    """進捗ストリーム（SSE）の接続用チケット（短時間・1回限り有効）
+
+    EventSourceはヘッダーを付けられないため、JWTの代わりにURLに付ける。
+    チケットそのものは保存せず、ハッシュ値のみを保存する。
+    """
+    key_hash = models.CharField('チケットのハッシュ値', max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stream_tickets', verbose_name='ユーザー')
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='stream_tickets', verbose_name='対象ファイル')
+    expires_at = models.DateTimeField('有効期限')
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+
+    class Meta:
+        verbose_name = '進捗ストリームのチケット'
+        verbose_name_plural = '進捗ストリームのチケット'
+
+    def __str__(self):
+        return f"{self.file_upload_id} ({self.user_id})"
@@ -0,0 +1,285 @@
+import base64
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fitz  # PyMuPDF
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# テキストがこの文字数未満の場合は画像ベース（スキャン）PDFと判定する
+IMAGE_BASED_TEXT_THRESHOLD = 50
+
+# 画像の描画に使う最小の解像度（これ未満でしか予算に収まらない場合は画像を追加しない）
+MIN_RENDER_DPI = 36
+
+
+def _extract_page(page, page_number):
+    """1ページ分のテキスト・表・画像候補を1パスで収集する"""
+    started_at = time.perf_counter()
+
+    page_text = page.get_text().strip()
+
+    tables = []
+    try:
+        found_tables = page.find_tables().tables
+    except Exception:
+        found_tables = []
+    for table_num, table in enumerate(found_tables):
+        try:
+            table_data = table.extract()
+        except Exception:
+            continue
+        if table_data:
+            tables.append({
+                'page': page_number,
+                'table': table_num + 1,
+                'data': table_data
+            })
+
+    # 画像は参照（xref）とサイズのみ記録し、変換は画像ベースPDFと判定された場合だけ行う
+    image_candidates = [
+        {'page': page_number, 'index': img_index, 'xref': img[0], 'width': img[2], 'height': img[3]}
+        for img_index, img in enumerate(page.get_images())
+    ]
+
+    return {
+        'page': page_number,
+        'text': page_text,
+        'tables': tables,
+        'image_candidates': image_candidates,
+        'seconds': round(time.perf_counter() - started_at, 4)
+    }
+
+
+def _extract_page_range(path, start, stop):
+    """ページ範囲 [start, stop) を抽出する（プロセスプールのワーカーで実行）"""
+    with fitz.open(path, filetype='pdf') as doc:
+        return [_extract_page(doc[page_index], page_index + 1) for page_index in range(start, stop)]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """ページ並列処理用のプロセスプール（プロセス内で共有、ワーカー数は PDF_EXTRACTION_WORKERS）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Djangoプロセス（DB接続・スレッド）をforkしないようspawnで起動する
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _extract_pages_parallel(data, page_count):
+    """ページをプロセスプールに分割して並列抽出し、ページ順に結合する
+
+    PDFのバイト列は一時ファイルに1回だけ書き出し、ワーカーにはそのパスとページ範囲だけを渡す
+    （分割ごとにバイト列をpickleしてプロセス間で送らない）。
+    """
+    workers = settings.PDF_EXTRACTION_WORKERS
+    # 重いページへの偏りを均すため、ワーカー数の2倍程度に分割する
+    batch_count = min(page_count, workers * 2)
+    batch_size = -(-page_count // batch_count)
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        executor = _get_executor()
+        futures = [
+            executor.submit(_extract_page_range, tmp_path, start, min(start + batch_size, page_count))
+            for start in range(0, page_count, batch_size)
+        ]
+        pages = [page for future in futures for page in future.result()]
+    finally:
+        os.unlink(tmp_path)
+    return sorted(pages, key=lambda page: page['page'])
+
+
+def _use_parallel(page_count):
+    """並列処理を使うか（小さなドキュメントはプロセス間通信のコストの方が大きいためインライン処理）"""
+    return (
+        settings.PDF_EXTRACTION_WORKERS > 1
+        and page_count >= settings.PDF_PARALLEL_MIN_PAGES
+    )
+
+
+def _pixmap_to_image(pix, page_number, index, source):
+    """PixmapをPNG（Base64）の画像データに変換"""
+    # CMYK画像はRGBに変換
+    if pix.n - pix.alpha >= 4:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return {
+        'page': page_number,
+        'index': index,
+        'data': base64.b64encode(pix.tobytes('png')).decode('utf-8'),
+        'format': 'png',
+        'source': source,
+        'width': pix.width,
+        'height': pix.height
+    }
+
+
+def _fit_zoom(rect, zoom, max_pixels):
+    """rect を zoom 倍で描画した画像が max_pixels 以下になるよう倍率を下げて返す"""
+    area = rect.width * rect.height
+    if area <= 0:
+        return 0
+    zoom = min(zoom, (max_pixels / area) ** 0.5)
+    # 描画サイズは整数に切り上げられるため、実際のサイズで確認する
+    while zoom > 0:
+        irect = (rect * fitz.Matrix(zoom, zoom)).irect
+        if irect.width * irect.height <= max_pixels:
+            break
+        zoom *= 0.99
+    return zoom
+
+
+def iter_page_images(doc, pages, max_pages=None, min_area=None, dpi=None, pixel_budget=None):
+    """画像ベースPDFの各ページから、Claudeに送る画像を1枚ずつ遅延生成する
+
+    ページごとに面積 min_area 以上の埋め込み画像のうち最大のものを選び、
+    使える埋め込み画像が無いページは dpi 指定でページをラスタライズする。
+    max_pages ページで打ち切り、生成する画像の合計ピクセル数が pixel_budget を超えないようにする。
+    予算を超える埋め込み画像は元の解像度でデコードせず、ページ上の位置を予算内の倍率で描画する。
+    最小の解像度（MIN_RENDER_DPI）でも予算に収まらなくなったら終了する。
+    """
+    max_pages = settings.PDF_IMAGE_MAX_PAGES if max_pages is None else max_pages
+    min_area = settings.PDF_IMAGE_MIN_AREA if min_area is None else min_area
+    dpi = settings.PDF_RASTER_DPI if dpi is None else dpi
+    remaining_pixels = settings.PDF_IMAGE_PIXEL_BUDGET if pixel_budget is None else pixel_budget
+
+    for page_info in pages[:max_pages]:
+        if remaining_pixels <= 0:
+            break
+
+        page_number = page_info['page']
+        page = doc[page_number - 1]
+        candidates = [
+            candidate for candidate in page_info['image_candidates']
+            if candidate['width'] * candidate['height'] >= min_area
+        ]
+
+        if candidates:
+            # 最も大きい埋め込み画像を使用
+            candidate = max(candidates, key=lambda c: c['width'] * c['height'])
+            if candidate['width'] * candidate['height'] <= remaining_pixels:
+                # 予算内であれば元の解像度のままデコードする（デコードはこの1枚のみ）
+                image = _pixmap_to_image(fitz.Pixmap(doc, candidate['xref']), page_number, candidate['index'], 'embedded')
+            else:
+                # 画像の配置範囲を、元の解像度を上限に予算内の倍率で描画する
+                image_rects = page.get_image_rects(candidate['xref'])
+                clip = image_rects[0] & page.rect if image_rects else page.rect
+                zoom = _fit_zoom(clip, candidate['width'] / max(clip.width, 1), remaining_pixels)
+                if zoom * 72 < MIN_RENDER_DPI:
+                    break
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+                image = _pixmap_to_image(pix, page_number, candidate['index'], 'embedded')
+        else:
+            # 埋め込み画像が無い（ベクター描画など）ページはラスタライズ
+            zoom = _fit_zoom(page.rect, dpi / 72, remaining_pixels)
+            if zoom * 72 < MIN_RENDER_DPI:
+                break
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            image = _pixmap_to_image(pix, page_number, None, 'raster')
+
+        remaining_pixels -= image['width'] * image['height']
+        yield image
+
+
+def _build_text(pages, tables):
+    """ページテキストと表を結合したテキストを作成"""
+    parts = []
+    for page in pages:
+        if page['text']:
+            parts.append(f"--- ページ {page['page']} ---\n{page['text']}\n\n")
+
+    # 表がある場合は、表の内容も文字列として追加
+    if tables:
+        parts.append("\n\n--- 抽出された表 ---\n")
+        for table_info in tables:
+            parts.append(f"\nページ{table_info['page']} 表{table_info['table']}:\n")
+            for row in table_info['data']:
+                if row:  # 空行をスキップ
+                    parts.append(" | ".join(str(cell) if cell else "" for cell in row) + "\n")
+
+    return ''.join(parts).strip()
+
+
+def extract_pdf(data):
+    """PDFのバイト列からテキスト・表・画像を抽出する（画像ベースPDFの判定含む）
+
+    ドキュメントはメモリ上で1回だけ開き、各ページを1パスで処理する。
+    ページ数が PDF_PARALLEL_MIN_PAGES 以上の場合はページをプロセスプールに
+    分割して並列に処理する。
+    type（text_based_pdf / image_based_pdf）・text・tables・images などの辞書を返し、
+    ページごとの処理時間（page_timings）を含む。読み取れない場合はエラーメッセージの文字列を返す。
+    """
+    try:
+        started_at = time.perf_counter()
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            pages = None
+            parallel = _use_parallel(len(doc))
+            if parallel:
+                try:
+                    pages = _extract_pages_parallel(data, len(doc))
+                except BrokenProcessPool:
+                    logger.warning("PDF並列抽出のプロセスプールが停止したため、インラインで処理します")
+                    _reset_executor()
+                    parallel = False
+            if pages is None:
+                pages = [_extract_page(page, page_index + 1) for page_index, page in enumerate(doc)]
+
+            tables = [table for page in pages for table in page['tables']]
+            total_text_length = sum(len(page['text']) for page in pages)
+            page_timings = [{'page': page['page'], 'seconds': page['seconds']} for page in pages]
+            is_image_based = total_text_length < IMAGE_BASED_TEXT_THRESHOLD
+
+            images = []
+            if is_image_based:
+                images = list(iter_page_images(doc, pages))
+
+        logger.info(
+            "PDF抽出: %sページ %.3f秒（並列: %s, 画像ベース: %s）",
+            len(pages), time.perf_counter() - started_at, parallel, is_image_based
+        )
+
+        if images:
+            # 画像ベースPDFの場合は表の内容をテキストに含めない（従来と同じ）
+            return {
+                'type': 'image_based_pdf',
+                'images': images,
+                'text': _build_text(pages, []),
+                'tables': tables,
+                'has_tables': len(tables) > 0,
+                'page_timings': page_timings
+            }
+
+        return {
+            'type': 'text_based_pdf',
+            'text': _build_text(pages, tables),
+            'tables': tables,
+            'has_tables': len(tables) > 0,
+            'is_image_based': is_image_based,
+            'page_timings': page_timings
+        }
+    except Exception as e:
+        return f"PDF読み取りエラー: {str(e)}"
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+import fitz
+from PIL import Image, ImageOps
+from .image_preprocessing import flatten_to_rgb
+from .storage import has_upload_content, open_upload_content
+
+logger = logging.getLogger(__name__)
+
+# プレビューのサイズ（長辺のピクセル数）
+PREVIEW_SIZES = {
+    'small': 160,
+    'medium': 480,
+    'large': 1024,
+}
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+
+class PreviewError(Exception):
+    """プレビューを作成できない（未対応の形式・存在しないページなど）"""
+
+
+def _extension(file_upload):
+    return Path(file_upload.original_name).suffix.lower()
+
+
+def is_previewable(file_upload):
+    return _extension(file_upload) in IMAGE_EXTENSIONS + ['.pdf']
+
+
+def _to_jpeg(image, long_edge):
+    image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+    image = flatten_to_rgb(image)  # 透過部分は白背景にする
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=settings.PREVIEW_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def render_preview(data, extension, long_edge, page=1):
+    """画像・PDFの指定ページを長辺 long_edge 以下のJPEGに描画する"""
+    if extension == '.pdf':
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            if not 1 <= page <= len(doc):
+                raise PreviewError(f'ページが存在しません: {page}')
+            pdf_page = doc[page - 1]
+            # 必要な解像度だけで描画する（ページ全体を高解像度で描画しない）
+            zoom = long_edge / max(pdf_page.rect.width, pdf_page.rect.height)
+            pix = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+            return _to_jpeg(image, long_edge)
+
+    if extension in IMAGE_EXTENSIONS:
+        if page != 1:
+            raise PreviewError(f'ページが存在しません: {page}')
+        with Image.open(BytesIO(data)) as original:
+            original.draft('RGB', (long_edge, long_edge))  # JPEGは縮小しながら読み込む
+            return _to_jpeg(ImageOps.exif_transpose(original), long_edge)
+
+    raise PreviewError(f'プレビューに対応していないファイル形式です: {extension}')
+
+
+def preview_cache_path(content_hash, size, page=1):
+    """プレビューのキャッシュパス（コンテンツハッシュ・サイズ・ページごと）"""
+    return Path(settings.PREVIEW_CACHE_ROOT) / content_hash[:2] / f"{content_hash}-{size}-p{page}.jpg"
+
+
+def get_preview(file_upload, size, page=1):
+    """プレビュー（JPEG）のキャッシュパスを返す（無ければ描画してキャッシュする）"""
+    if size not in PREVIEW_SIZES:
+        raise PreviewError(f"サイズは {', '.join(PREVIEW_SIZES)} のいずれかを指定してください。")
+    if not is_previewable(file_upload):
+        raise PreviewError(f'プレビューに対応していないファイル形式です: {_extension(file_upload)}')
+    if not has_upload_content(file_upload):
+        raise PreviewError('ファイルデータが存在しません。')
+
+    data = None
+    content_hash = file_upload.content_hash
+    if not content_hash:
+        # 旧形式（file_data / file）は内容からキーを作る
+        with open_upload_content(file_upload) as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+
+    cache_path = preview_cache_path(content_hash, size, page)
+    if cache_path.exists():
+        return cache_path
+
+    if data is None:
+        with open_upload_content(file_upload) as f:
+            data = f.read()
+    try:
+        preview = render_preview(data, _extension(file_upload), PREVIEW_SIZES[size], page)
+    except PreviewError:
+        raise
+    except Exception as e:
+        raise PreviewError(f'プレビューの作成に失敗しました: {str(e)}')
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent)
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(preview)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def generate_previews(file_upload):
+    """1ページ目のプレビューを全サイズ作成する"""
+    for size in PREVIEW_SIZES:
+        try:
+            get_preview(file_upload, size)
+        except PreviewError as e:
+            logger.warning("FileUpload#%s: プレビューを作成できませんでした: %s", file_upload.pk, e)
+            return
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """プレビュー作成用のスレッドプール（プロセス内で共有）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PREVIEW_WORKERS, thread_name_prefix='preview')
+        return _executor
+
+
+def schedule_preview_generation(file_upload):
+    """アップロードの確定後にバックグラウンドでプレビューを作成する"""
+    if not settings.PREVIEW_PREGENERATE or not is_previewable(file_upload):
+        return
+    transaction.on_commit(lambda: _get_executor().submit(generate_previews, file_upload))
@@ -0,0 +1,570 @@
+import json
+import base64
+import hashlib
+import logging
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+from rest_framework import status
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+import pandas as pd
+from PIL import Image
+from .models import FileUpload
+from . import prompts
+from .claude_client import CircuitOpenError, StreamError, get_claude_client, read_message, read_message_stream
+from .image_preprocessing import preprocess_image_cached
+from .local_extraction import extract_locally, is_confident
+from .manifest_import import ENCODING_SAMPLE_SIZE, sniff_encoding
+from .pdf_extraction import extract_pdf
+from .storage import has_upload_content, open_upload_content
+
+logger = logging.getLogger(__name__)
+
+
+def _notify(progress, stage, **data):
+    """進捗コールバック（指定されている場合のみ）に処理段階を通知する"""
+    if progress:
+        progress(stage, data)
+
+
+def get_file_extension(filename):
+    """ファイル拡張子を取得"""
+    return Path(filename).suffix.lower()
+
+
+def extract_data_from_excel(file_path):
+    """Excelファイルからデータを抽出"""
+    try:
+        df = pd.read_excel(file_path, engine='openpyxl')
+        # データフレームを辞書形式に変換
+        data = df.to_dict('records')
+        return {
+            'headers': df.columns.tolist(),
+            'data': data,
+            'summary': f"{len(df)}行 × {len(df.columns)}列のデータ"
+        }
+    except Exception as e:
+        return f"Excel読み取りエラー: {str(e)}"
+
+
+def extract_data_from_csv(file_path):
+    """CSVファイル（パスまたはファイルオブジェクト）からデータを抽出"""
+    try:
+        # エンコーディングは先頭部分で1回だけ判定する（UTF-8で読めない場合はShift_JIS）
+        if hasattr(file_path, 'read'):
+            encoding = sniff_encoding(file_path.read(ENCODING_SAMPLE_SIZE))
+            file_path.seek(0)
+        else:
+            with open(file_path, 'rb') as f:
+                encoding = sniff_encoding(f.read(ENCODING_SAMPLE_SIZE))
+        df = pd.read_csv(file_path, encoding=encoding)
+        data = df.to_dict('records')
+        return {
+            'headers': df.columns.tolist(),
+            'data': data,
+            'summary': f"{len(df)}行 × {len(df.columns)}列のデータ"
+        }
+    except Exception as e:
+        return f"CSV読み取りエラー: {str(e)}"
+
+
+def _preprocess_pdf_images(images):
+    """PDFから取り出した画像（Base64のPNG）をClaude送信用に前処理する"""
+    processed_images = []
+    for image in images:
+        data, media_type = preprocess_image_cached(base64.b64decode(image['data']), 'image/png')
+        processed_image = {
+            **image,
+            'data': base64.b64encode(data).decode('utf-8'),
+            'media_type': media_type
+        }
+        # 縮小後のサイズ（ヘッダーのみ読み込む）
+        try:
+            with Image.open(BytesIO(data)) as pil_image:
+                processed_image['width'], processed_image['height'] = pil_image.size
+        except Exception:
+            pass
+        processed_images.append(processed_image)
+    return processed_images
+
+
+def estimate_image_tokens(image):
+    """画像1枚の入力トークン数の目安（Claudeの目安: 幅×高さ÷750）"""
+    return int(image.get('width', 0) * image.get('height', 0) / 750)
+
+
+def select_request_images(images, max_images=None, byte_budget=None, token_budget=None):
+    """1回のClaudeリクエストに含めるページ画像を選ぶ
+
+    ページ順に並べ、同じ内容の画像（重複ページ）を除外したうえで、
+    枚数 max_images・合計バイト数 byte_budget・推定トークン数 token_budget の
+    いずれかを超える手前までを先頭から採用する。
+    """
+    max_images = settings.CLAUDE_MAX_IMAGES_PER_REQUEST if max_images is None else max_images
+    byte_budget = settings.CLAUDE_IMAGE_BYTE_BUDGET if byte_budget is None else byte_budget
+    token_budget = settings.CLAUDE_IMAGE_TOKEN_BUDGET if token_budget is None else token_budget
+
+    ordered = sorted(images, key=lambda image: (image['page'], image.get('index') or 0))
+
+    selected = []
+    seen_hashes = set()
+    total_bytes = 0
+    total_tokens = 0
+    for image in ordered:
+        image_hash = hashlib.sha256(image['data'].encode('utf-8')).hexdigest()
+        if image_hash in seen_hashes:
+            continue
+        if len(selected) >= max_images:
+            break
+
+        image_bytes = len(image['data'])
+        image_tokens = estimate_image_tokens(image)
+        # 1枚目は予算を超えても送る（何も送らないよりは良い）
+        if selected and (total_bytes + image_bytes > byte_budget or total_tokens + image_tokens > token_budget):
+            break
+
+        seen_hashes.add(image_hash)
+        selected.append(image)
+        total_bytes += image_bytes
+        total_tokens += image_tokens
+
+    return selected
+
+
+def _pdf_result_to_content(pdf_result):
+    """extract_pdf の結果をClaude処理用のコンテンツに変換"""
+    if not isinstance(pdf_result, dict):
+        return {
+            'type': 'error',
+            'message': pdf_result
+        }
+
+    # 画像ベースPDFの場合
+    if pdf_result.get('type') == 'image_based_pdf':
+        return {
+            'type': 'image_based_pdf',
+            'images': _preprocess_pdf_images(pdf_result.get('images', [])),
+            'content': pdf_result['text'],
+            'tables': pdf_result.get('tables', []),
+            'has_tables': pdf_result.get('has_tables', False)
+        }
+    # 通常のテキストベースPDFの場合
+    return {
+        'type': 'text',
+        'content': pdf_result['text'],
+        'tables': pdf_result.get('tables', []),
+        'has_tables': pdf_result.get('has_tables', False)
+    }
+
+
+def process_file_content(file_upload, progress=None):
+    """ファイル形式に応じてコンテンツを処理
+
+    progress を指定すると、読み込み（decoded）・PDFの解析（pages_parsed）の完了を通知する。
+    """
+    file_extension = get_file_extension(file_upload.original_name)
+
+    if not has_upload_content(file_upload):
+        return {
+            'type': 'error',
+            'message': f"ファイルデータが見つかりません: content_hash={bool(file_upload.content_hash)}, file_data={bool(file_upload.file_data)}, file={bool(file_upload.file)}"
+        }
+
+    # 画像ファイル（JPEG, PNG）の場合
+    if file_extension in ['.jpg', '.jpeg', '.png']:
+        try:
+            with open_upload_content(file_upload) as f:
+                image_data = f.read()
+            _notify(progress, 'decoded', bytes=len(image_data))
+
+            # 縮小・再エンコードしてから送信する（結果はコンテンツハッシュごとにキャッシュ）
+            image_data, media_type = preprocess_image_cached(
+                image_data, file_upload.mime_type, content_hash=file_upload.content_hash or None
+            )
+
+            return {
+                'type': 'image',
+                'base64': base64.b64encode(image_data).decode('utf-8'),
+                'media_type': media_type
+            }
+        except Exception as e:
+            return {'type': 'error', 'message': f"画像処理エラー: {str(e)}"}
+
+    # PDFファイルの場合（一時ファイルを作らずメモリ上で処理）
+    elif file_extension == '.pdf':
+        try:
+            with open_upload_content(file_upload) as f:
+                pdf_data = f.read()
+            _notify(progress, 'decoded', bytes=len(pdf_data))
+            pdf_result = extract_pdf(pdf_data)
+            if isinstance(pdf_result, dict):
+                _notify(
+                    progress, 'pages_parsed',
+                    pages=len(pdf_result.get('page_timings', [])),
+                    image_based=pdf_result.get('type') == 'image_based_pdf'
+                )
+            return _pdf_result_to_content(pdf_result)
+        except Exception as e:
+            return {
+                'type': 'error',
+                'message': f"PDF処理エラー: {str(e)}"
+            }
+
+    # Excel/CSVファイルの場合
+    elif file_extension in ['.xlsx', '.xls', '.csv']:
+        with open_upload_content(file_upload) as f:
+            data = BytesIO(f.read())
+        _notify(progress, 'decoded', bytes=len(data.getbuffer()))
+        if file_extension == '.csv':
+            content_type, table_data = 'csv', extract_data_from_csv(data)
+        else:
+            content_type, table_data = 'excel', extract_data_from_excel(data)
+        if not isinstance(table_data, dict):
+            return {'type': 'error', 'message': table_data}
+        return {
+            'type': content_type,
+            'content': table_data
+        }
+
+    return {
+        'type': 'error',
+        'message': f"未対応のファイル形式です: {file_extension}"
+    }
+
+
+def visible_uploads(user):
+    """ユーザーが参照可能なFileUploadのクエリセット（シードユーザーは全件）"""
+    if user.user_type == 'seed':
+        return FileUpload.objects.all()
+    return FileUpload.objects.filter(uploader=user)
+
+
+def find_cached_result(file_upload):
+    """同じコンテンツハッシュを持つ処理済みファイルを探す（アップロード者が参照可能な範囲のみ）"""
+    if not file_upload.content_hash:
+        return None
+
+    return visible_uploads(file_upload.uploader).filter(
+        content_hash=file_upload.content_hash,
+        is_processed=True,
+        extracted_data__isnull=False
+    ).exclude(pk=file_upload.pk).only(
+        'id', 'claude_response', 'extracted_data', 'field_scores'
+    ).order_by('-updated_at').first()
+
+
+def prepare_claude_request(file_upload, progress=None):
+    """Claude APIに送る前の処理を行い、(リクエスト, 処理結果) を返す
+
+    処理結果の再利用・ルールベース抽出で完了した場合やエラーの場合は
+    (None, (レスポンスデータ, HTTPステータス)) を、Claude APIでの処理が必要な場合は
+    (Messages APIのリクエスト, None) を返す。
+    progress を指定すると処理段階ごとに progress(段階, データ) を呼び出す。
+    """
+    # 同じ内容のファイルが処理済みであれば、その結果を再利用する（API呼び出しを省略）
+    cached_upload = find_cached_result(file_upload)
+    if cached_upload:
+        file_upload.claude_response = cached_upload.claude_response
+        file_upload.extracted_data = cached_upload.extracted_data
+        file_upload.field_scores = cached_upload.field_scores
+        file_upload.is_processed = True
+        file_upload.processing_source = 'cache'
+        if not save_processing_result(file_upload):
+            return None, already_processed_result(file_upload.pk)
+        _notify(progress, 'saved', processing_source='cache')
+        logger.info(
+            "FileUpload#%s: FileUpload#%s の処理結果を再利用しました（キャッシュヒット）",
+            file_upload.pk, cached_upload.pk
+        )
+        return None, ({
+            'message': '同じ内容のファイルの処理結果を再利用しました。',
+            'extracted_data': cached_upload.extracted_data,
+            'cached': True,
+            'source_upload_id': cached_upload.pk
+        }, status.HTTP_200_OK)
+
+    # Claude APIキーの確認
+    if not settings.CLAUDE_API_KEY:
+        return None, ({'error': 'Claude APIキーが設定されていません。'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    try:
+        # ファイル形式に応じてコンテンツを処理
+        processed_content = process_file_content(file_upload, progress)
+
+        if processed_content['type'] == 'error':
+            return None, ({
+                'error': processed_content['message']
+            }, status.HTTP_400_BAD_REQUEST)
+
+        # ラベル付きの帳票はルールベースで抽出し、必須項目が揃えばClaude APIを呼ばない
+        local_result = None
+        if settings.LOCAL_EXTRACTION_ENABLED:
+            try:
+                local_result = extract_locally(processed_content)
+            except Exception:
+                # 想定外のレイアウトで失敗した場合はClaude APIで処理する
+                logger.exception("FileUpload#%s: ルールベース抽出に失敗したためClaude APIで処理します", file_upload.pk)
+        if local_result:
+            extracted_data, field_scores = local_result
+            if is_confident(field_scores):
+                file_upload.extracted_data = extracted_data
+                file_upload.field_scores = field_scores
+                file_upload.is_processed = True
+                file_upload.processing_source = 'local'
+                if not save_processing_result(file_upload):
+                    return None, already_processed_result(file_upload.pk)
+                _notify(progress, 'parsed', extracted_data=extracted_data)
+                _notify(progress, 'saved', processing_source='local')
+                logger.info("FileUpload#%s: ルールベース抽出で処理しました（Claude API呼び出しなし）", file_upload.pk)
+                return None, ({
+                    'message': 'ルールベース抽出で処理が完了しました。',
+                    'extracted_data': extracted_data,
+                    'field_scores': field_scores,
+                    'cached': False
+                }, status.HTTP_200_OK)
+            logger.info("FileUpload#%s: ルールベース抽出の信頼度が不足しているためClaude APIで処理します", file_upload.pk)
+
+        # ファイル形式に応じて文書ごとの内容を作成（共通の指示は prompts.system_prompt）
+        if processed_content['type'] == 'image':
+            # 画像ファイルの場合
+            content = prompts.image_content(processed_content['media_type'], processed_content['base64'])
+            _notify(progress, 'images_selected', total=1, selected=1)
+
+        elif processed_content['type'] == 'image_based_pdf':
+            # 画像ベースPDFの場合
+            images = processed_content.get('images', [])
+            if not images:
+                return None, ({
+                    'error': 'PDF内に画像が見つかりませんでした。'
+                }, status.HTTP_400_BAD_REQUEST)
+
+            # 複数ページの画像を1回のリクエストでまとめて送る
+            request_images = select_request_images(images)
+            logger.info(
+                "画像ベースPDF: %s枚中%s枚を送信（ページ: %s）",
+                len(images), len(request_images), [image['page'] for image in request_images]
+            )
+            _notify(
+                progress, 'images_selected',
+                total=len(images), selected=len(request_images),
+                pages=[image['page'] for image in request_images]
+            )
+            content = prompts.scanned_pdf_content(request_images)
+
+        elif processed_content['type'] == 'text':
+            # PDFテキストの場合
+            content = prompts.text_content(processed_content['content'], processed_content.get('has_tables', False))
+
+        elif processed_content['type'] in ['excel', 'csv']:
+            # Excel/CSVファイルの場合
+            content = prompts.table_content(processed_content['content'])
+
+        payload = prompts.build_payload(content)
+
+    except Exception as e:
+        return None, ({
+            'error': f'処理中にエラーが発生しました: {str(e)}'
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return payload, None
+
+
+def parse_claude_message(claude_response):
+    """Messages APIのレスポンスから抽出データ（JSON）を取り出す"""
+    content = claude_response['content'][0]['text']
+    # JSONブロックを抽出（```json ... ``` の中身）
+    if '```json' in content:
+        json_start = content.find('```json') + 7
+        json_end = content.find('```', json_start)
+        json_str = content[json_start:json_end].strip()
+    else:
+        json_str = content.strip()
+    return json.loads(json_str)
+
+
+def apply_claude_response(file_upload, claude_response, processing_source='claude'):
+    """Claudeのレスポンス（抽出データ・トークン使用量）をFileUploadに反映する（保存はしない）
+
+    抽出データを返す。解析できない場合は claude_response のみ反映して例外を送出する。
+    """
+    file_upload.claude_response = claude_response
+    usage = claude_response.get('usage') or {}
+    file_upload.input_tokens = usage.get('input_tokens')
+    file_upload.output_tokens = usage.get('output_tokens')
+    file_upload.cache_read_input_tokens = usage.get('cache_read_input_tokens')
+    file_upload.cache_creation_input_tokens = usage.get('cache_creation_input_tokens')
+    extracted_data = parse_claude_message(claude_response)
+    file_upload.extracted_data = extracted_data
+    file_upload.is_processed = True
+    file_upload.processing_source = processing_source
+    return extracted_data
+
+
+def run_claude_processing(file_upload, progress=None):
+    """Claude APIで帳票を処理し、(レスポンスデータ, HTTPステータス) を返す
+
+    同期API（process_with_claude）とバックグラウンドワーカーの両方から呼び出される。
+    progress を指定した場合（進捗ストリーム）はClaude APIをストリーミングで呼び出し、
+    生成されたテキストを tokens として逐次通知する。
+    """
+    payload, result = prepare_claude_request(file_upload, progress)
+    if result:
+        return result
+
+    try:
+        client = get_claude_client()
+        if progress:
+            _notify(progress, 'request_sent', model=payload['model'])
+            response = client.stream_message(payload)
+        else:
+            response = client.create_message(payload)
+    except CircuitOpenError:
+        return ({
+            'error': 'Claude APIが一時的に利用できません。しばらくしてから再度お試しください。'
+        }, status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return ({
+            'error': f'処理中にエラーが発生しました: {str(e)}'
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if response.status_code != 200:
+        return ({
+            'error': f'Claude API呼び出しに失敗しました。ステータスコード: {response.status_code}',
+            'details': response.text
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # レスポンスからJSONデータを抽出
+    try:
+        if progress:
+            claude_response = read_message_stream(
+                response, on_text=lambda text: _notify(progress, 'tokens', text=text)
+            )
+        else:
+            claude_response = read_message(response)
+    except (ValueError, StreamError) as e:
+        return ({
+            'error': 'Claude APIのレスポンスの解析に失敗しました。',
+            # ストリーミングの場合は本文を読み終えているためエラー内容を返す
+            'details': str(e) if progress else response.text
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    try:
+        extracted_data = apply_claude_response(file_upload, claude_response)
+    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+        save_processing_result(file_upload)
+        return ({
+            'error': 'Claude APIのレスポンスの解析に失敗しました。',
+            'raw_response': claude_response
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+    _notify(progress, 'parsed', extracted_data=extracted_data)
+
+    # データベースに保存（処理中に別の処理（バッチなど）で処理済みになった場合は上書きしない）
+    if not save_processing_result(file_upload):
+        return already_processed_result(file_upload.pk)
+    _notify(progress, 'saved', processing_source=file_upload.processing_source)
+    logger.info("FileUpload#%s: Claude APIで処理しました（キャッシュミス）", file_upload.pk)
+
+    return ({
+        'message': 'Claude APIで処理が完了しました。',
+        'extracted_data': extracted_data,
+        'cached': False
+    }, status.HTTP_200_OK)
+
+
+# 処理結果として保存する列
+RESULT_FIELDS = [
+    'claude_response', 'extracted_data', 'field_scores', 'is_processed', 'processing_source',
+    'input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens',
+]
+
+BATCH_IN_PROGRESS_MESSAGE = 'このファイルはバッチ処理中です。'
+
+
+def save_processing_result(file_upload):
+    """処理結果を未処理の場合のみ保存し、保存できたかを返す（UPDATE ... WHERE is_processed = false）
+
+    あわせて処理中の印（processing_started_at）を外す。
+    """
+    updated = FileUpload.objects.filter(pk=file_upload.pk, is_processed=False).update(
+        **{field: getattr(file_upload, field) for field in RESULT_FIELDS},
+        processing_started_at=None,
+        updated_at=timezone.now()
+    )
+    return updated == 1
+
+
+def already_processed_result(pk):
+    """処理済みのFileUploadの (レスポンスデータ, HTTPステータス)"""
+    extracted_data = FileUpload.objects.filter(pk=pk).values_list('extracted_data', flat=True).first()
+    return ({
+        'message': '既に処理済みです。',
+        'extracted_data': extracted_data,
+        'already_processed': True
+    }, status.HTTP_200_OK)
+
+
+def _claim_expired_before():
+    return timezone.now() - timedelta(seconds=settings.FILE_PROCESSING_CLAIM_TIMEOUT)
+
+
+def is_being_processed(file_upload):
+    """別のリクエスト・ジョブが処理中か"""
+    started_at = file_upload.processing_started_at
+    return started_at is not None and started_at >= _claim_expired_before()
+
+
+def claim_upload(pk):
+    """FileUploadに処理中の印を付け、付けた日時を返す（付けられない場合は None）
+
+    未処理で、バッチ処理に登録されておらず、他の処理が処理中でない（または処理開始から
+    FILE_PROCESSING_CLAIM_TIMEOUT 秒を過ぎた）場合のみ条件付きUPDATEで印を付ける。
+    UPDATEはその場でコミットされるため、Claude APIの呼び出し中に行ロック・トランザクションを保持しない。
+    """
+    claimed_at = timezone.now()
+    claimed = FileUpload.objects.filter(pk=pk, is_processed=False, claude_batch__isnull=True).filter(
+        Q(processing_started_at__isnull=True) | Q(processing_started_at__lt=_claim_expired_before())
+    ).update(processing_started_at=claimed_at)
+    return claimed_at if claimed else None
+
+
+def release_upload(pk, claimed_at):
+    """claim_upload で付けた処理中の印を外す（既に外れている・他の処理が付け直した場合は何もしない）"""
+    FileUpload.objects.filter(pk=pk, processing_started_at=claimed_at).update(processing_started_at=None)
+
+
+def run_exclusive_processing(pk, progress=None):
+    """FileUploadに処理中の印を付け、未処理の場合のみ run_claude_processing を呼び出す
+
+    同じファイルを複数のリクエスト・ジョブが同時に処理して、Claude APIを二重に呼び出すのを防ぐ。
+    処理済みの場合はClaude APIを呼ばずに200を、他の処理が処理中・バッチ処理中の場合は409を返す。
+    """
+    claimed_at = claim_upload(pk)
+    if claimed_at is None:
+        state = FileUpload.objects.filter(pk=pk).values('is_processed', 'claude_batch_id').first()
+        if state is None:
+            return ({'error': 'ファイルが見つかりません。'}, status.HTTP_404_NOT_FOUND)
+        if state['is_processed']:
+            return already_processed_result(pk)
+        if state['claude_batch_id']:
+            return ({'error': BATCH_IN_PROGRESS_MESSAGE}, status.HTTP_409_CONFLICT)
+        return ({'error': 'このファイルは処理中です。'}, status.HTTP_409_CONFLICT)
+
+    try:
+        return run_claude_processing(FileUpload.objects.get(pk=pk), progress=progress)
+    finally:
+        release_upload(pk, claimed_at)
+
+
+def run_claude_processing_in_thread(file_upload, progress=None):
+    """ワーカースレッドから run_exclusive_processing を呼び出す（スレッドのDB接続は処理の前後で整理する）
+
+    処理中の場合は待たずに409を返す。
+    """
+    close_old_connections()
+    try:
+        return run_exclusive_processing(file_upload.pk, progress=progress)
+    finally:
+        close_old_connections()
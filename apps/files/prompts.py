@@ -0,0 +1,168 @@
+import json
+
+# 帳票読み取りに使うモデル
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+MAX_TOKENS = 1000
+
+# 全リクエスト共通の指示（システムプロンプト）
+# 文書ごとに変わる内容はユーザーメッセージ側に置き、この部分はプロンプトキャッシュの対象にする。
+# キャッシュはプレフィックスが一定の長さ（Sonnetでは1024トークン）以上の場合のみ有効になるため、
+# 抽出のルールは変えずに、項目・帳票の種類の説明（参考情報）で長さを満たしている。
+EXTRACTION_INSTRUCTIONS = """
+Please extract the following information and return it in JSON format:
+
+{
+  "sender_name": "Sender's name",
+  "sender_phone": "Sender's phone number",
+  "sender_address": "Sender's address",
+  "recipient_name": "Recipient's name",
+  "recipient_phone": "Recipient's phone number",
+  "recipient_address": "Delivery address",
+  "item_name": "Item name",
+  "item_quantity": "Quantity (numeric value)",
+  "delivery_date": "Preferred delivery date (YYYY-MM-DD format)",
+  "delivery_time": "Preferred delivery time",
+  "special_instructions": "Special instructions",
+  "request_amount": "Request amount (numeric value, extract monetary value if present)"
+}
+
+For items that cannot be read, please use empty strings.
+
+Reference: documents and fields
+
+The documents are Japanese delivery instruction documents and delivery-related files, such as 配送依頼書, 送り状, 伝票, 納品書 and 出荷指示書.
+Each request contains one document, given as an image, as the page images of a scanned PDF, as text extracted from a PDF, or as rows extracted from an Excel/CSV file.
+The notes below describe what each field of the JSON above refers to and the labels under which it usually appears on these documents.
+They describe the fields only; the instructions above and in the request apply as written.
+
+Document types:
+
+- 配送依頼書 (delivery request form): a form a shipper fills in to ask a carrier to deliver goods.
+  It usually has separate blocks for the sender, the recipient, the goods and the requested delivery date and time.
+- 送り状 (waybill): the label or slip attached to a parcel.
+  It usually has a block for the recipient (お届け先) at the top and a block for the sender (ご依頼主) below it, with the goods and the delivery date beside them.
+- 伝票 (slip): a general term for carrier slips and internal shipping slips. The layout is similar to a waybill.
+- 納品書 (delivery note): a document sent with the goods that lists the items delivered, usually in a table with quantities and amounts.
+- 出荷指示書 (shipping instruction): an internal instruction from a warehouse or sales department describing what to ship, where, and when.
+
+Fields:
+
+- sender_name: the person or company that sends the parcel.
+  Usually labeled 差出人, ご依頼主, 依頼主, 発送元, 送り主, 荷送人 or 出荷元.
+- sender_phone: the telephone number of the sender, usually written next to or below the sender's name or address (電話, TEL, 電話番号).
+- sender_address: the address of the sender, usually in the same block as the sender's name (住所, 所在地).
+- recipient_name: the person or company that receives the parcel.
+  Usually labeled お届け先, 届け先, 受取人, 配送先, 送り先, 荷受人 or 納品先.
+- recipient_phone: the telephone number of the recipient, usually written in the same block as the recipient's name.
+- recipient_address: the address the parcel is delivered to, usually in the same block as the recipient's name.
+  A Japanese address usually consists of a postal code (〒), prefecture, city, street address, and a building name or room number.
+- item_name: the goods being delivered.
+  Usually labeled 品名, 荷物名, 品物, 商品名, 内容品 or 品目.
+- item_quantity: the number of pieces being delivered.
+  Usually labeled 数量, 個数 or 口数.
+- delivery_date: the date on which the delivery is requested.
+  Usually labeled 配送希望日, お届け希望日, 配達希望日, 納品日 or 指定日.
+- delivery_time: the time or time slot in which the delivery is requested, such as 14:00-16:00, 午前中 or 19時以降.
+  Usually labeled 時間帯, 希望時間, お届け時間 or 配達時間.
+- special_instructions: notes for the driver about handling or delivering the parcel.
+  Usually labeled 備考, 特記事項, 注意事項, 配送指示 or 取扱注意.
+- request_amount: the amount of money requested for the delivery.
+  Usually labeled 依頼金額, 運賃, 料金, 代金, 送料 or 合計.
+
+On printed forms the labels are usually in a fixed box or table cell, with the value in the neighbouring cell or on the next line.
+On handwritten forms the same labels are usually printed on the form and the values are filled in by hand.
+In Excel/CSV files the labels usually appear as column headers, and each row holds the values for one delivery.
+""".strip()
+
+
+def system_prompt():
+    """共通指示のシステムプロンプト（プロンプトキャッシュの対象）"""
+    return [
+        {
+            "type": "text",
+            "text": EXTRACTION_INSTRUCTIONS,
+            "cache_control": {"type": "ephemeral"}
+        }
+    ]
+
+
+def _image_block(media_type, data):
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": data
+        }
+    }
+
+
+def image_content(media_type, data):
+    """画像ファイル用のユーザーメッセージ"""
+    return [
+        {
+            "type": "text",
+            "text": "This is a Japanese delivery instruction document or delivery-related image. "
+                    "The document may be rotated or handwritten."
+        },
+        _image_block(media_type, data)
+    ]
+
+
+def scanned_pdf_content(images):
+    """画像ベースPDF用のユーザーメッセージ（ページ番号付きの複数画像）"""
+    content = [
+        {
+            "type": "text",
+            "text": "This is a scanned PDF containing Japanese delivery instruction documents. "
+                    "Each image is one page of the same document, labeled with its page number. "
+                    "Combine the information from all pages into a single result. "
+                    "The images may contain rotated or handwritten text. Please analyze all provided images carefully."
+        }
+    ]
+    for image in images:
+        content.append({"type": "text", "text": f"Page {image['page']}:"})
+        content.append(_image_block(image.get('media_type', 'image/png'), image['data']))
+    return content
+
+
+def text_content(text, has_tables=False):
+    """PDFテキスト用のユーザーメッセージ"""
+    table_info = " This includes tabular data." if has_tables else ""
+    return [
+        {
+            "type": "text",
+            "text": f"The following is text extracted from a Japanese delivery instruction document or PDF.{table_info}\n"
+                    "If there is table data, please extract information from it as well.\n\n"
+                    f"Text content:\n{text}"
+        }
+    ]
+
+
+def table_content(table_data):
+    """Excel/CSV用のユーザーメッセージ"""
+    data_str = json.dumps(table_data, ensure_ascii=False, indent=2, default=str)
+    return [
+        {
+            "type": "text",
+            "text": "The following is data extracted from a Japanese delivery-related Excel/CSV file. "
+                    "Please analyze the delivery information.\n"
+                    "If there are multiple delivery requests, please extract information from the first one.\n\n"
+                    f"Data content:\n{data_str}"
+        }
+    ]
+
+
+def build_payload(content):
+    """Messages APIのリクエストを作成する（共通指示＋文書ごとの内容）"""
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": MAX_TOKENS,
+        "system": system_prompt(),
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
@@ -1,5 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import FileUpload
+from .models import FileUpload, ProcessingJob, UploadSession
 
 
 class UploaderSerializer(serializers.Serializer):
@@ -20,7 +21,7 @@ class FileUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileUpload
         fields = '__all__'
-        read_only_fields = ['uploader', 'original_name', 'file_size', 'mime_type', 'is_processed', 'claude_response', 'extracted_data']
+        read_only_fields = ['uploader', 'content_hash', 'original_name', 'file_size', 'mime_type', 'is_processed', 'processing_source', 'claude_response', 'extracted_data', 'field_scores']
 
     def get_file_url(self, obj):
         request = self.context.get('request')
@@ -37,4 +38,56 @@ class FileUploadSerializer(serializers.ModelSerializer):
         validated_data['file_size'] = file_obj.size
         validated_data['mime_type'] = getattr(file_obj, 'content_type', 'application/octet-stream')
         
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+
+class FileUploadListSerializer(FileUploadSerializer):
+    """ファイルアップロード一覧用シリアライザー
+
+    ファイルデータ（Base64）とClaude APIの生レスポンスは、context['include'] で
+    指定された場合のみ含める（既定は詳細APIでのみ返す）。
+    """
+    HEAVY_FIELDS = ['file_data', 'claude_response']
+
+    def get_field_names(self, declared_fields, info):
+        include = self.context.get('include', ())
+        return [
+            name for name in super().get_field_names(declared_fields, info)
+            if name not in self.HEAVY_FIELDS or name in include
+        ]
+
+
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    """帳票処理ジョブシリアライザー"""
+
+    class Meta:
+        model = ProcessingJob
+        fields = [
+            'id', 'file_upload', 'status', 'attempts', 'max_attempts', 'result', 'result_status',
+            'error_message', 'run_after', 'started_at', 'finished_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """分割アップロードセッションシリアライザー"""
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'original_name', 'file_type', 'mime_type', 'total_size', 'received_size',
+            'status', 'file_upload', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'received_size', 'status', 'file_upload', 'created_at', 'updated_at']
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('ファイルサイズが不正です。')
+        if value > settings.FILE_UPLOAD_MAX_SIZE:
+            max_mb = settings.FILE_UPLOAD_MAX_SIZE // (1024 * 1024)
+            raise serializers.ValidationError(f'ファイルサイズは{max_mb}MB以下にしてください。')
+        return value
+
+    def create(self, validated_data):
+        validated_data['uploader'] = self.context['request'].user
+        return super().create(validated_data)
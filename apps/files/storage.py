@@ -0,0 +1,391 @@
+import base64
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# ストリーム読み書き時のチャンクサイズ
+CHUNK_SIZE = 1024 * 1024
+
+# 圧縮して保存したBLOBのキーの接尾辞（キーは圧縮前の内容のSHA-256のまま）
+COMPRESSED_SUFFIX = '.gz'
+
+
+def iter_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """ファイルオブジェクトをチャンク単位で読み出す"""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def should_compress(content_type):
+    """圧縮して保存する形式か（画像・xlsxなど圧縮済みの形式は対象外）"""
+    return settings.BLOB_COMPRESSION_ENABLED and content_type in settings.BLOB_COMPRESSION_CONTENT_TYPES
+
+
+def gzip_compress(src, dst):
+    """src（ファイルオブジェクト）をgzip形式でdstにストリーミングで書き込み、書き込み後のサイズを返す"""
+    with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=settings.BLOB_COMPRESSION_LEVEL, mtime=0) as gz:
+        shutil.copyfileobj(src, gz, CHUNK_SIZE)
+    return dst.tell()
+
+
+def is_worth_compressing(original_size, compressed_size):
+    """圧縮後のサイズが十分小さいか（スキャンPDFなどはほとんど縮まないため元のまま保存する）"""
+    return compressed_size <= original_size * settings.BLOB_COMPRESSION_MAX_RATIO
+
+
+def open_gzip(fileobj, offset=0):
+    """gzipのBLOBを展開しながら読み出す（offsetまでは読み捨てる）"""
+    f = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if offset:
+        f.seek(offset)
+    return f
+
+
+class BlobStore:
+    """コンテンツアドレス型（SHA-256をキーとする）BLOBストアの基底クラス
+
+    content_type が圧縮対象の形式（BLOB_COMPRESSION_CONTENT_TYPES）の場合はgzipで圧縮して保存し、
+    読み出し時に展開する。キー・サイズは圧縮前の内容のもの。
+    """
+
+    def save(self, chunks, content_type=None):
+        """バイト列のイテラブルを保存し (キー, サイズ) を返す"""
+        raise NotImplementedError
+
+    def save_file(self, path, content_type=None):
+        """ローカルファイルを保存し (キー, サイズ) を返す（元ファイルは削除される）"""
+        try:
+            with open(path, 'rb') as f:
+                return self.save(iter_chunks(f), content_type=content_type)
+        finally:
+            os.unlink(path)
+
+    def open(self, key, offset=0):
+        """保存済みBLOBをバイナリのファイルオブジェクトとして開く（offsetバイト目から読み出す）"""
+        raise NotImplementedError
+
+    def compress(self, key, content_type=None):
+        """圧縮せずに保存されているBLOBを圧縮して保存し直す（圧縮した場合はTrue）"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def path(self, key):
+        """ローカルファイルパス（ローカル保存でない場合はNone）"""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """ローカルファイルシステム上のBLOBストア
+
+    <root>/ab/cd/abcd... の形式でSHA-256ごとに1ファイルとして保存する。
+    同一内容のファイルは同じパスになるため自動的に重複排除される。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _blob_path(self, key):
+        return self.root / key[:2] / key[2:4] / key
+
+    def _compressed_path(self, key):
+        return self._blob_path(key).with_name(key + COMPRESSED_SUFFIX)
+
+    def _place(self, src_path, key, content_type):
+        """一時ファイルをキーの位置に配置する（圧縮対象の形式で小さくなる場合は圧縮して配置）"""
+        if self.exists(key):
+            os.unlink(src_path)
+            return
+        blob_path = self._blob_path(key)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if should_compress(content_type) and self._compress_file(src_path, self._compressed_path(key)):
+            os.unlink(src_path)
+        else:
+            shutil.move(src_path, blob_path)
+
+    def _compress_file(self, src_path, dst_path):
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with open(src_path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                compressed_size = gzip_compress(src, dst)
+            if not is_worth_compressing(os.path.getsize(src_path), compressed_size):
+                os.unlink(tmp_path)
+                return False
+            os.replace(tmp_path, dst_path)
+            return True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def save(self, chunks, content_type=None):
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp_file.write(chunk)
+
+            key = digest.hexdigest()
+            self._place(tmp_path, key, content_type)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return key, size
+
+    def save_file(self, path, content_type=None):
+        # 内容を読み出してハッシュを計算し、コピーせずにリネームで配置する
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter_chunks(f):
+                digest.update(chunk)
+        size = os.path.getsize(path)
+
+        key = digest.hexdigest()
+        self._place(path, key, content_type)
+        return key, size
+
+    def open(self, key, offset=0):
+        compressed_path = self._compressed_path(key)
+        if compressed_path.exists():
+            return open_gzip(open(compressed_path, 'rb'), offset)
+        f = open(self._blob_path(key), 'rb')
+        if offset:
+            f.seek(offset)
+        return f
+
+    def exists(self, key):
+        return self._blob_path(key).exists() or self._compressed_path(key).exists()
+
+    def size(self, key):
+        compressed_path = self._compressed_path(key)
+        if compressed_path.exists():
+            # gzipの末尾4バイトに圧縮前のサイズ（2^32の剰余）が記録されている
+            with open(compressed_path, 'rb') as f:
+                f.seek(-4, os.SEEK_END)
+                return int.from_bytes(f.read(4), 'little')
+        return self._blob_path(key).stat().st_size
+
+    def delete(self, key):
+        for blob_path in [self._blob_path(key), self._compressed_path(key)]:
+            if blob_path.exists():
+                blob_path.unlink()
+
+    def path(self, key):
+        # 圧縮して保存している場合はそのまま配信できるファイルが無い
+        blob_path = self._blob_path(key)
+        return str(blob_path) if blob_path.exists() else None
+
+    def compress(self, key, content_type=None):
+        blob_path = self._blob_path(key)
+        compressed_path = self._compressed_path(key)
+        if not should_compress(content_type) or compressed_path.exists() or not blob_path.exists():
+            return False
+        if not self._compress_file(blob_path, compressed_path):
+            return False
+        blob_path.unlink()
+        return True
+
+
+class S3BlobStore(BlobStore):
+    """S3互換ストレージ（AWS S3 / MinIO など）上のBLOBストア
+
+    endpoint_url を指定するとMinIOなどのS3互換サーバーに接続する。
+    boto3 が必要（BLOB_STORAGE_BACKEND='s3' の場合のみ）。
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, access_key_id=None,
+                 secret_access_key=None, region_name=None, client=None):
+        if not bucket:
+            raise ImproperlyConfigured('BLOB_STORAGE_S3_BUCKET が設定されていません。')
+
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImproperlyConfigured('S3BlobStore を使用するには boto3 をインストールしてください。')
+            client = boto3.client(
+                's3',
+                endpoint_url=endpoint_url,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                region_name=region_name
+            )
+
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _object_exists(self, object_key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=object_key)
+            return True
+        except Exception:
+            return False
+
+    def _upload_compressed(self, tmp_file, key, size):
+        """一時ファイルを圧縮し、十分小さくなった場合のみアップロードする"""
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as compressed_file:
+            tmp_file.seek(0)
+            if not is_worth_compressing(size, gzip_compress(tmp_file, compressed_file)):
+                return False
+            compressed_file.seek(0)
+            self.client.upload_fileobj(compressed_file, self.bucket, self._object_key(key + COMPRESSED_SUFFIX))
+            return True
+
+    def save(self, chunks, content_type=None):
+        # キー（SHA-256）が確定するまでディスクに一時保存してからアップロードする
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as tmp_file:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                tmp_file.write(chunk)
+
+            key = digest.hexdigest()
+            if not self.exists(key) and not (should_compress(content_type) and self._upload_compressed(tmp_file, key, size)):
+                tmp_file.seek(0)
+                self.client.upload_fileobj(tmp_file, self.bucket, self._object_key(key))
+
+        return key, size
+
+    def open(self, key, offset=0):
+        compressed_key = self._object_key(key + COMPRESSED_SUFFIX)
+        if self._object_exists(compressed_key):
+            response = self.client.get_object(Bucket=self.bucket, Key=compressed_key)
+            return open_gzip(response['Body'], offset)
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if offset:
+            params['Range'] = f'bytes={offset}-'
+        response = self.client.get_object(**params)
+        return response['Body']
+
+    def exists(self, key):
+        return (
+            self._object_exists(self._object_key(key))
+            or self._object_exists(self._object_key(key + COMPRESSED_SUFFIX))
+        )
+
+    def size(self, key):
+        compressed_key = self._object_key(key + COMPRESSED_SUFFIX)
+        if self._object_exists(compressed_key):
+            # gzipの末尾4バイトに圧縮前のサイズ（2^32の剰余）が記録されている
+            response = self.client.get_object(Bucket=self.bucket, Key=compressed_key, Range='bytes=-4')
+            return int.from_bytes(response['Body'].read(), 'little')
+        response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        return response['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key + COMPRESSED_SUFFIX))
+
+    def compress(self, key, content_type=None):
+        object_key = self._object_key(key)
+        if (not should_compress(content_type) or not self._object_exists(object_key)
+                or self._object_exists(self._object_key(key + COMPRESSED_SUFFIX))):
+            return False
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as tmp_file:
+            body = self.client.get_object(Bucket=self.bucket, Key=object_key)['Body']
+            for chunk in iter_chunks(body):
+                tmp_file.write(chunk)
+            if not self._upload_compressed(tmp_file, key, tmp_file.tell()):
+                return False
+        self.client.delete_object(Bucket=self.bucket, Key=object_key)
+        return True
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """設定に応じたBLOBストアを返す（プロセス内で共有）"""
+    global _blob_store
+    if _blob_store is None:
+        backend = settings.BLOB_STORAGE_BACKEND
+        if backend == 'local':
+            _blob_store = LocalBlobStore(settings.BLOB_STORAGE_ROOT)
+        elif backend == 's3':
+            _blob_store = S3BlobStore(
+                bucket=settings.BLOB_STORAGE_S3_BUCKET,
+                prefix=settings.BLOB_STORAGE_S3_PREFIX,
+                endpoint_url=settings.BLOB_STORAGE_S3_ENDPOINT_URL,
+                access_key_id=settings.BLOB_STORAGE_S3_ACCESS_KEY_ID,
+                secret_access_key=settings.BLOB_STORAGE_S3_SECRET_ACCESS_KEY,
+                region_name=settings.BLOB_STORAGE_S3_REGION
+            )
+        else:
+            raise ImproperlyConfigured(f'不明なBLOB_STORAGE_BACKENDです: {backend}')
+    return _blob_store
+
+
+@receiver(setting_changed)
+def reset_blob_store(setting, **kwargs):
+    """テストなどで設定が変更された場合にBLOBストアを作り直す"""
+    global _blob_store
+    if setting.startswith('BLOB_STORAGE_'):
+        _blob_store = None
+
+
+def has_upload_content(file_upload):
+    """FileUploadにファイル本体が存在するか"""
+    return bool(file_upload.content_hash or file_upload.file_data or file_upload.file)
+
+
+def open_upload_content(file_upload, offset=0):
+    """FileUploadのファイル本体をバイナリのファイルオブジェクトとして開く
+
+    BLOBストア（content_hash）→ 旧形式のBase64（file_data）→ 旧形式のFileField の順に参照する。
+    offset を指定するとそのバイト位置から読み出す。
+    """
+    if file_upload.content_hash:
+        return get_blob_store().open(file_upload.content_hash, offset=offset)
+    if file_upload.file_data:
+        f = io.BytesIO(base64.b64decode(file_upload.file_data))
+    elif file_upload.file:
+        f = open(file_upload.file.path, 'rb')
+    else:
+        raise FileNotFoundError(f'ファイルデータが存在しません: FileUpload#{file_upload.pk}')
+    if offset:
+        f.seek(offset)
+    return f
+
+
+def upload_content_path(file_upload):
+    """FileUploadのファイル本体のローカルパス（ローカルに無い場合はNone）"""
+    if file_upload.content_hash:
+        return get_blob_store().path(file_upload.content_hash)
+    if not file_upload.file_data and file_upload.file:
+        return file_upload.file.path
+    return None
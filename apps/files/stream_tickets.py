@@ -0,0 +1,38 @@
+import hashlib
+import secrets
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import StreamTicket
+
+
+def _hash(ticket):
+    return hashlib.sha256(ticket.encode('utf-8')).hexdigest()
+
+
+def issue_stream_ticket(user, file_upload):
+    """進捗ストリームの接続用チケットを発行する（期限切れのチケットはこのとき削除する）"""
+    now = timezone.now()
+    StreamTicket.objects.filter(expires_at__lte=now).delete()
+    ticket = secrets.token_urlsafe(32)
+    StreamTicket.objects.create(
+        key_hash=_hash(ticket),
+        user=user,
+        file_upload=file_upload,
+        expires_at=now + timedelta(seconds=settings.STREAM_TICKET_TTL)
+    )
+    return ticket
+
+
+def redeem_stream_ticket(ticket, file_upload_id):
+    """チケットを使用済みにし、発行先のユーザーを返す（無効・期限切れ・使用済みの場合は None）"""
+    with transaction.atomic():
+        stream_ticket = StreamTicket.objects.select_for_update().select_related('user').filter(
+            key_hash=_hash(ticket), file_upload_id=file_upload_id, expires_at__gt=timezone.now()
+        ).first()
+        if stream_ticket is None:
+            return None
+        stream_ticket.delete()
+    user = stream_ticket.user
+    return user if user.is_active else None
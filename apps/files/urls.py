@@ -4,7 +4,19 @@ from . import views
 urlpatterns = [
     path('uploads/', views.FileUploadListCreateView.as_view(), name='file-upload-list'),
     path('uploads/<int:pk>/', views.FileUploadDetailView.as_view(), name='file-upload-detail'),
+    path('uploads/stats/', views.processing_stats, name='processing-stats'),
+    path('uploads/process-bulk/', views.process_bulk, name='process-bulk'),
+    path('uploads/chunked/', views.create_upload_session, name='upload-session-create'),
+    path('uploads/chunked/<uuid:pk>/', views.upload_session_detail, name='upload-session-detail'),
+    path('uploads/chunked/<uuid:pk>/finalize/', views.finalize_upload_session, name='upload-session-finalize'),
     path('uploads/<int:pk>/download/', views.download_file, name='download-file'),
+    path('uploads/<int:pk>/preview/', views.preview_file, name='preview-file'),
     path('uploads/<int:pk>/process/', views.process_with_claude, name='process-with-claude'),
+    path('uploads/<int:pk>/process-async/', views.process_with_claude_async, name='process-with-claude-async'),
+    path('uploads/<int:pk>/process-stream/', views.process_with_claude_stream, name='process-with-claude-stream'),
+    path('uploads/<int:pk>/process-stream/ticket/', views.create_stream_ticket, name='process-stream-ticket'),
+    path('jobs/', views.processing_job_list, name='processing-job-list'),
+    path('jobs/<int:pk>/', views.processing_job_detail, name='processing-job-detail'),
     path('uploads/<int:pk>/create-delivery/', views.create_delivery_from_file, name='create-delivery-from-file'),
+    path('uploads/<int:pk>/import-manifest/', views.import_manifest_from_file, name='import-manifest'),
 ]
\ No newline at end of file
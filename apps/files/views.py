@@ -1,335 +1,102 @@
+import asyncio
 import json
-import base64
-import requests
-from pathlib import Path
+import os
+from asgiref.sync import sync_to_async
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 from django.conf import settings
-from django.http import HttpResponse
-import pdfplumber
-import pandas as pd
-import fitz  # PyMuPDF
-from .models import FileUpload
-from .serializers import FileUploadSerializer
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from config.pagination import StandardPagination
+from .models import FileUpload, ProcessingJob, UploadSession
+from .serializers import FileUploadListSerializer, FileUploadSerializer, ProcessingJobSerializer, UploadSessionSerializer
+from .processing import (
+    BATCH_IN_PROGRESS_MESSAGE,
+    is_being_processed, run_claude_processing_in_thread, run_exclusive_processing, visible_uploads
+)
+from .stream_tickets import issue_stream_ticket, redeem_stream_ticket
+from .jobs import UploadInBatchError, enqueue_processing_job
+from .manifest_import import ManifestAlreadyImportedError, ManifestError, import_manifest
+from .previews import PreviewError, get_preview, schedule_preview_generation
+from .chunked_upload import ChunkError, write_chunk, finalize_session, discard_session
+from .storage import CHUNK_SIZE, get_blob_store, has_upload_content, open_upload_content, upload_content_path
 
 
-def get_file_extension(filename):
-    """ファイル拡張子を取得"""
-    return Path(filename).suffix.lower()
-
-
-def extract_images_from_pdf(file_path):
-    """PDFから画像を抽出"""
-    try:
-        doc = fitz.open(file_path)
-        images = []
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            image_list = page.get_images()
-            
-            for img_index, img in enumerate(image_list):
-                # 画像を抽出
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
-                
-                # CMYK画像はRGBに変換
-                if pix.n - pix.alpha < 4:
-                    img_data = pix.tobytes("png")
-                    images.append({
-                        'page': page_num + 1,
-                        'index': img_index,
-                        'data': base64.b64encode(img_data).decode('utf-8'),
-                        'format': 'png'
-                    })
-                else:
-                    pix1 = fitz.Pixmap(fitz.csRGB, pix)
-                    img_data = pix1.tobytes("png")
-                    images.append({
-                        'page': page_num + 1,
-                        'index': img_index,
-                        'data': base64.b64encode(img_data).decode('utf-8'),
-                        'format': 'png'
-                    })
-                    pix1 = None
-                
-                pix = None
-        
-        doc.close()
-        return images
-    except Exception as e:
-        return f"PDF画像抽出エラー: {str(e)}"
-
-
-def extract_text_from_pdf(file_path):
-    """PDFからテキストと表を抽出（画像ベースPDFの判定含む）"""
-    try:
-        text_content = ""
-        tables_content = []
-        is_image_based = False
-
-        with pdfplumber.open(file_path) as pdf:
-            total_text_length = 0
-            
-            for page_num, page in enumerate(pdf.pages):
-                # テキストを抽出
-                page_text = page.extract_text()
-                if page_text:
-                    text_content += f"--- ページ {page_num + 1} ---\n"
-                    text_content += page_text + "\n\n"
-                    total_text_length += len(page_text.strip())
-
-                # 表を抽出
-                tables = page.find_tables()
-                for table_num, table in enumerate(tables):
-                    try:
-                        table_data = table.extract()
-                        if table_data:
-                            tables_content.append({
-                                'page': page_num + 1,
-                                'table': table_num + 1,
-                                'data': table_data
-                            })
-                    except Exception:
-                        continue
-
-            # 画像ベースPDFかどうかを判定（テキストが極端に少ない場合）
-            if total_text_length < 50:  # 閾値: 50文字未満の場合は画像ベースと判定
-                is_image_based = True
-                # 画像を抽出
-                extracted_images = extract_images_from_pdf(file_path)
-                if isinstance(extracted_images, list) and len(extracted_images) > 0:
-                    return {
-                        'type': 'image_based_pdf',
-                        'images': extracted_images,
-                        'text': text_content.strip(),
-                        'tables': tables_content,
-                        'has_tables': len(tables_content) > 0
-                    }
-
-        # 結果を整理
-        result = {
-            'type': 'text_based_pdf',
-            'text': text_content.strip(),
-            'tables': tables_content,
-            'has_tables': len(tables_content) > 0,
-            'is_image_based': is_image_based
-        }
-
-        # 表がある場合は、表の内容も文字列として追加
-        if tables_content:
-            result['text'] += "\n\n--- 抽出された表 ---\n"
-            for table_info in tables_content:
-                result['text'] += f"\nページ{table_info['page']} 表{table_info['table']}:\n"
-                for row in table_info['data']:
-                    if row:  # 空行をスキップ
-                        result['text'] += " | ".join(str(cell)
-                                                     if cell else "" for cell in row) + "\n"
-
-        return result
-    except Exception as e:
-        return f"PDF読み取りエラー: {str(e)}"
-
-
-def extract_data_from_excel(file_path):
-    """Excelファイルからデータを抽出"""
-    try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        # データフレームを辞書形式に変換
-        data = df.to_dict('records')
-        return {
-            'headers': df.columns.tolist(),
-            'data': data,
-            'summary': f"{len(df)}行 × {len(df.columns)}列のデータ"
-        }
-    except Exception as e:
-        return f"Excel読み取りエラー: {str(e)}"
-
-
-def extract_data_from_csv(file_path):
-    """CSVファイルからデータを抽出"""
-    try:
-        df = pd.read_csv(file_path, encoding='utf-8')
-        data = df.to_dict('records')
-        return {
-            'headers': df.columns.tolist(),
-            'data': data,
-            'summary': f"{len(df)}行 × {len(df.columns)}列のデータ"
-        }
-    except UnicodeDecodeError:
-        # UTF-8で読めない場合はShift_JISを試す
-        try:
-            df = pd.read_csv(file_path, encoding='shift_jis')
-            data = df.to_dict('records')
-            return {
-                'headers': df.columns.tolist(),
-                'data': data,
-                'summary': f"{len(df)}行 × {len(df.columns)}列のデータ"
-            }
-        except Exception as e:
-            return f"CSV読み取りエラー: {str(e)}"
-    except Exception as e:
-        return f"CSV読み取りエラー: {str(e)}"
-
+class FileUploadListCreateView(generics.ListCreateAPIView):
+    """ファイルアップロード一覧・作成API
 
-def process_file_content(file_upload):
-    """ファイル形式に応じてコンテンツを処理"""
-    file_extension = get_file_extension(file_upload.original_name)
-    
-    # DB保存形式（file_data）から読み込み
-    if file_upload.file_data:
-        # Base64デコードしてファイルコンテンツを取得
-        file_content = base64.b64decode(file_upload.file_data)
-        
-        # 画像ファイル（JPEG, PNG）の場合
-        if file_extension in ['.jpg', '.jpeg', '.png']:
-            return {
-                'type': 'image',
-                'base64': file_upload.file_data,  # すでにBase64エンコード済み
-                'media_type': file_upload.mime_type
-            }
-        
-        # PDFファイルの場合（DB保存）
-        elif file_extension == '.pdf':
-            try:
-                # 一時ファイルとして保存してPDF処理
-                import tempfile
-                import os
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                    temp_file.write(file_content)
-                    temp_file_path = temp_file.name
-                
-                try:
-                    pdf_result = extract_text_from_pdf(temp_file_path)
-                    if isinstance(pdf_result, dict):
-                        # 画像ベースPDFの場合
-                        if pdf_result.get('type') == 'image_based_pdf':
-                            return {
-                                'type': 'image_based_pdf',
-                                'images': pdf_result.get('images', []),
-                                'content': pdf_result['text'],
-                                'tables': pdf_result.get('tables', []),
-                                'has_tables': pdf_result.get('has_tables', False)
-                            }
-                        # 通常のテキストベースPDFの場合
-                        else:
-                            return {
-                                'type': 'text',
-                                'content': pdf_result['text'],
-                                'tables': pdf_result.get('tables', []),
-                                'has_tables': pdf_result.get('has_tables', False)
-                            }
-                    else:
-                        return {
-                            'type': 'error',
-                            'message': pdf_result
-                        }
-                finally:
-                    # 一時ファイルを削除
-                    if os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
-            except Exception as e:
-                return {
-                    'type': 'error',
-                    'message': f"PDF処理エラー: {str(e)}"
-                }
-    
-    # 旧形式（FileField）からの読み込み（互換性のため）
-    elif file_upload.file:
-        file_path = file_upload.file.path
-        
-        # 画像ファイル（JPEG, PNG）の場合
-        if file_extension in ['.jpg', '.jpeg', '.png']:
-            try:
-                # 画像をBase64エンコード
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
-                    file_base64 = base64.b64encode(file_content).decode('utf-8')
-
-                return {
-                    'type': 'image',
-                    'base64': file_base64,
-                    'media_type': file_upload.mime_type
-                }
-            except Exception as e:
-                return {'type': 'error', 'message': f"画像処理エラー: {str(e)}"}
-
-        # PDFファイルの場合（FileField）
-        elif file_extension == '.pdf':
-            pdf_result = extract_text_from_pdf(file_path)
-            if isinstance(pdf_result, dict):
-                # 画像ベースPDFの場合
-                if pdf_result.get('type') == 'image_based_pdf':
-                    return {
-                        'type': 'image_based_pdf',
-                        'images': pdf_result.get('images', []),
-                        'content': pdf_result['text'],
-                        'tables': pdf_result.get('tables', []),
-                        'has_tables': pdf_result.get('has_tables', False)
-                    }
-                # 通常のテキストベースPDFの場合
-                else:
-                    return {
-                        'type': 'text',
-                        'content': pdf_result['text'],
-                        'tables': pdf_result.get('tables', []),
-                        'has_tables': pdf_result.get('has_tables', False)
-                    }
-            else:
-                return {
-                    'type': 'error',
-                    'message': pdf_result
-                }
+    一覧ではファイルデータ・Claude APIの生レスポンスを読み込まない。
+    必要な場合は ?include=file_data,claude_response で指定する。
+    ?pagination=cursor でカーソルページネーションになる。
+    """
+    serializer_class = FileUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = StandardPagination
 
-    else:
-        return {
-            'type': 'error',
-            'message': f"ファイルデータが見つかりません: file_data={bool(file_upload.file_data)}, file={bool(file_upload.file)}"
-        }
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return FileUploadListSerializer
+        return FileUploadSerializer
 
+    def get_included_fields(self):
+        """?include= で指定された、一覧に追加で含める項目"""
+        requested = self.request.query_params.get('include', '').split(',')
+        return [name for name in FileUploadListSerializer.HEAVY_FIELDS if name in requested]
 
-class FileUploadListCreateView(generics.ListCreateAPIView):
-    """ファイルアップロード一覧・作成API"""
-    serializer_class = FileUploadSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['include'] = self.get_included_fields()
+        return context
 
     def get_queryset(self):
         # シードユーザーは全ファイルを表示可能
         if self.request.user.user_type == 'seed':
             # all_files=trueクエリパラメータがある場合は全ファイルを返す
             if self.request.query_params.get('all_files') == 'true':
-                return FileUpload.objects.all().order_by('-created_at')
+                queryset = FileUpload.objects.all().order_by('-created_at')
             else:
-                return FileUpload.objects.filter(uploader=self.request.user)
+                queryset = FileUpload.objects.filter(uploader=self.request.user)
         else:
             # 通常ユーザーは自分のファイルのみ
-            return FileUpload.objects.filter(uploader=self.request.user)
+            queryset = FileUpload.objects.filter(uploader=self.request.user)
+
+        # 一覧に含めない大きな列はDBから読み込まない
+        included = self.get_included_fields()
+        deferred = [name for name in FileUploadListSerializer.HEAVY_FIELDS if name not in included]
+        return queryset.select_related('uploader').defer(*deferred)
     
     def create(self, request, *args, **kwargs):
-        """ファイルアップロード処理（DB保存）"""
+        """ファイルアップロード処理（BLOBストア保存）"""
         file = request.FILES.get('file')
         if not file:
             return Response({'error': 'ファイルが指定されていません。'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # ファイルサイズチェック（10MB制限）
-        if file.size > 10 * 1024 * 1024:  # 10MB
-            return Response({'error': 'ファイルサイズは10MB以下にしてください。'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # ファイルをBase64エンコード
-        file_content = file.read()
-        file_base64 = base64.b64encode(file_content).decode('utf-8')
+        # ファイルサイズチェック（FILE_UPLOAD_MAX_SIZE、既定10MB）
+        if file.size > settings.FILE_UPLOAD_MAX_SIZE:
+            max_mb = settings.FILE_UPLOAD_MAX_SIZE // (1024 * 1024)
+            return Response({'error': f'ファイルサイズは{max_mb}MB以下にしてください。'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # ファイル本体はBLOBストアにチャンク単位で保存し、参照（SHA-256）のみDBに保存
+        content_hash, file_size = get_blob_store().save(file.chunks(), content_type=file.content_type)
+
         # FileUploadオブジェクト作成
         file_upload = FileUpload.objects.create(
             uploader=request.user,
-            file_data=file_base64,
+            content_hash=content_hash,
             original_name=file.name,
             file_type=request.POST.get('file_type', 'delivery_document'),
-            file_size=file.size,
+            file_size=file_size,
             mime_type=file.content_type or 'application/octet-stream'
         )
+        schedule_preview_generation(file_upload)
         
         serializer = self.get_serializer(file_upload)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -344,6 +111,98 @@ class FileUploadDetailView(generics.RetrieveDestroyAPIView):
         return FileUpload.objects.filter(uploader=self.request.user)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_upload_session(request):
+    """分割アップロード開始API"""
+    serializer = UploadSessionSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    session = serializer.save()
+
+    data = serializer.data
+    data['chunk_size'] = settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE
+    data['upload_url'] = request.build_absolute_uri(reverse('upload-session-detail', kwargs={'pk': session.id}))
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def upload_session_detail(request, pk):
+    """分割アップロードAPI（GET: 受信状況の確認 / PUT: チャンク送信 / DELETE: 中止）
+
+    PUTはリクエストボディにチャンクのバイト列をそのまま送り、
+    書き込み位置を ?offset= または Upload-Offset ヘッダーで指定する。
+    """
+    if request.method == 'GET':
+        try:
+            session = UploadSession.objects.get(pk=pk, uploader=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'アップロードセッションが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSessionSerializer(session).data)
+
+    with transaction.atomic():
+        try:
+            session = UploadSession.objects.select_for_update().get(pk=pk, uploader=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'アップロードセッションが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+        if session.status != 'uploading':
+            return Response({'error': 'このアップロードは完了しています。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'DELETE':
+            discard_session(session)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        try:
+            offset = int(request.query_params.get('offset', request.META.get('HTTP_UPLOAD_OFFSET', '')))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'offsetが不正です。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            received_size = write_chunk(session, request.stream, offset, length)
+        except ChunkError as e:
+            # オフセット不一致の場合はクライアントが再開位置を知れるよう現在位置を返す
+            return Response({
+                'error': str(e),
+                'received_size': session.received_size
+            }, status=status.HTTP_409_CONFLICT if offset != session.received_size else status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'id': session.id,
+        'received_size': received_size,
+        'total_size': session.total_size
+    })
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def finalize_upload_session(request, pk):
+    """分割アップロード完了API（受信データを結合してFileUploadを作成）"""
+    with transaction.atomic():
+        try:
+            session = UploadSession.objects.select_for_update().get(pk=pk, uploader=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'アップロードセッションが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+        if session.status == 'completed':
+            # 完了済みの場合は作成済みのファイルを返す（完了リクエストの再送に対応）
+            serializer = FileUploadSerializer(session.file_upload, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        try:
+            file_upload = finalize_session(session, expected_sha256=request.data.get('sha256'))
+        except ChunkError as e:
+            return Response({
+                'error': str(e),
+                'received_size': session.received_size
+            }, status=status.HTTP_400_BAD_REQUEST)
+        schedule_preview_generation(file_upload)
+
+    serializer = FileUploadSerializer(file_upload, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def process_with_claude(request, pk):
@@ -360,266 +219,343 @@ def process_with_claude(request, pk):
     if not settings.CLAUDE_API_KEY:
         return Response({'error': 'Claude APIキーが設定されていません。'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    try:
-        # ファイル形式に応じてコンテンツを処理
-        processed_content = process_file_content(file_upload)
+    # 同じファイルをジョブ・他のリクエスト・バッチ処理が処理中の場合は409を返す
+    response_data, response_status = run_exclusive_processing(file_upload.pk)
+    return Response(response_data, status=response_status)
+
 
-        if processed_content['type'] == 'error':
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def process_bulk(request):
+    """複数の帳票の処理ジョブをまとめて登録するAPI（処理はワーカーが同時実行数を制限して行う）
+
+    upload_ids（FileUploadのIDのリスト）または all_unprocessed=true を指定する。
+    all_unprocessed の場合は古い順に BULK_PROCESS_MAX_UPLOADS 件まで登録し、残りの件数を remaining で返す。
+    """
+    upload_ids = request.data.get('upload_ids')
+    all_unprocessed = str(request.data.get('all_unprocessed', '')).lower() == 'true'
+    remaining = 0
+
+    if all_unprocessed:
+        # バッチ処理に登録済みのものは結果を待つ
+        unprocessed = FileUpload.objects.filter(
+            uploader=request.user, is_processed=False, claude_batch__isnull=True
+        ).defer('file_data', 'claude_response')
+        file_uploads = list(unprocessed.order_by('created_at', 'pk')[:settings.BULK_PROCESS_MAX_UPLOADS])
+        if len(file_uploads) == settings.BULK_PROCESS_MAX_UPLOADS:
+            remaining = unprocessed.count() - len(file_uploads)
+        upload_ids = [file_upload.pk for file_upload in file_uploads]
+    elif isinstance(upload_ids, list) and upload_ids:
+        if len(upload_ids) > settings.BULK_PROCESS_MAX_UPLOADS:
             return Response({
-                'error': processed_content['message']
+                'error': f'一度に処理できるのは{settings.BULK_PROCESS_MAX_UPLOADS}件までです。'
             }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload_ids = list(dict.fromkeys(int(upload_id) for upload_id in upload_ids))
+        except (TypeError, ValueError):
+            return Response({'error': 'upload_idsには数値のIDを指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+        uploads_by_id = FileUpload.objects.filter(uploader=request.user).defer(
+            'file_data', 'claude_response'
+        ).in_bulk(upload_ids)
+        file_uploads = [uploads_by_id[upload_id] for upload_id in upload_ids if upload_id in uploads_by_id]
+    else:
+        return Response({'error': 'upload_ids または all_unprocessed を指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Claude APIリクエスト
-        headers = {
-            'Content-Type': 'application/json',
-            'x-api-key': settings.CLAUDE_API_KEY,
-            'anthropic-version': '2023-06-01'
-        }
+    # Claude APIキーの確認
+    if not settings.CLAUDE_API_KEY:
+        return Response({'error': 'Claude APIキーが設定されていません。'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # ファイル形式に応じたプロンプトを生成
-        if processed_content['type'] == 'image':
-            # 画像ファイルの場合
-            prompt = """
-This is a Japanese delivery instruction document or delivery-related image. Please extract the following information and return it in JSON format:
-
-{
-  "sender_name": "Sender's name",
-  "sender_phone": "Sender's phone number",
-  "sender_address": "Sender's address",
-  "recipient_name": "Recipient's name",
-  "recipient_phone": "Recipient's phone number",
-  "recipient_address": "Delivery address",
-  "item_name": "Item name",
-  "item_quantity": "Quantity (numeric value)",
-  "delivery_date": "Preferred delivery date (YYYY-MM-DD format)",
-  "delivery_time": "Preferred delivery time",
-  "special_instructions": "Special instructions",
-  "request_amount": "Request amount (numeric value, extract monetary value if present)"
-}
-
-The document may be rotated or handwritten. For items that cannot be read, please use empty strings.
-"""
-
-            payload = {
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": 1000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": processed_content['media_type'],
-                                    "data": processed_content['base64']
-                                }
-                            }
-                        ]
-                    }
-                ]
+    results_by_id = {
+        upload_id: {'upload_id': upload_id, 'status': status.HTTP_404_NOT_FOUND, 'queued': False, 'error': 'ファイルが見つかりません。'}
+        for upload_id in upload_ids
+    }
+    # 同じ内容のファイルは先頭の1件より後に登録し、先に処理された結果を再利用できるようにする
+    first_uploads = []
+    duplicate_uploads = []
+    seen_hashes = set()
+    for file_upload in file_uploads:
+        if file_upload.is_processed:
+            results_by_id[file_upload.pk] = {
+                'upload_id': file_upload.pk, 'status': status.HTTP_400_BAD_REQUEST,
+                'queued': False, 'error': '既に処理済みです。'
             }
+        elif file_upload.content_hash and file_upload.content_hash in seen_hashes:
+            duplicate_uploads.append(file_upload)
+        else:
+            seen_hashes.add(file_upload.content_hash)
+            first_uploads.append(file_upload)
 
-        elif processed_content['type'] == 'image_based_pdf':
-            # 画像ベースPDFの場合
-            prompt = """
-This is a scanned PDF containing Japanese delivery instruction documents. Please analyze all the images and extract the following information in JSON format:
-
-{
-  "sender_name": "Sender's name",
-  "sender_phone": "Sender's phone number",
-  "sender_address": "Sender's address",
-  "recipient_name": "Recipient's name",
-  "recipient_phone": "Recipient's phone number",
-  "recipient_address": "Delivery address",
-  "item_name": "Item name",
-  "item_quantity": "Quantity (numeric value)",
-  "delivery_date": "Preferred delivery date (YYYY-MM-DD format)",
-  "delivery_time": "Preferred delivery time",
-  "special_instructions": "Special instructions",
-  "request_amount": "Request amount (numeric value, extract monetary value if present)"
-}
-
-The images may contain rotated or handwritten text. Please analyze all provided images carefully.
-For items that cannot be read, please use empty strings.
-"""
-
-            # 最初の画像を使用（複数ある場合は最大の画像を選択）
-            images = processed_content.get('images', [])
-            if not images:
-                return Response({
-                    'error': 'PDF内に画像が見つかりませんでした。'
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-            # 最初の画像を使用
-            first_image = images[0]
-            
-            payload = {
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": 1000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": first_image['data']
-                                }
-                            }
-                        ]
-                    }
-                ]
+    for file_upload in first_uploads + duplicate_uploads:
+        try:
+            job, created = enqueue_processing_job(file_upload, request.user)
+        except UploadInBatchError as e:
+            results_by_id[file_upload.pk] = {
+                'upload_id': file_upload.pk, 'status': status.HTTP_409_CONFLICT, 'queued': False, 'error': str(e)
             }
+            continue
+        results_by_id[file_upload.pk] = {
+            'upload_id': file_upload.pk,
+            'status': status.HTTP_202_ACCEPTED,
+            'queued': True,
+            'job_id': job.id,
+            'job_status': job.status,
+            'created': created,
+            'status_url': request.build_absolute_uri(reverse('processing-job-detail', kwargs={'pk': job.id}))
+        }
 
-        elif processed_content['type'] == 'text':
-            # PDFテキストの場合
-            has_tables = processed_content.get('has_tables', False)
-            table_info = "This includes tabular data." if has_tables else ""
-
-            prompt = f"""
-The following is text extracted from a Japanese delivery instruction document or PDF. {table_info}Please extract the following information and return it in JSON format:
-
-{{
-  "sender_name": "Sender's name",
-  "sender_phone": "Sender's phone number", 
-  "sender_address": "Sender's address",
-  "recipient_name": "Recipient's name",
-  "recipient_phone": "Recipient's phone number",
-  "recipient_address": "Delivery address",
-  "item_name": "Item name",
-  "item_quantity": "Quantity (numeric value)",
-  "delivery_date": "Preferred delivery date (YYYY-MM-DD format)",
-  "delivery_time": "Preferred delivery time",
-  "special_instructions": "Special instructions",
-  "request_amount": "Request amount (numeric value, extract monetary value if present)"
-}}
-
-If there is table data, please extract information from it as well.
-For items that cannot be read, please use empty strings.
-
-Text content:
-{processed_content['content']}
-"""
-
-            payload = {
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": 1000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ]
-            }
+    # 指定された順に並べる
+    results = [results_by_id[upload_id] for upload_id in upload_ids]
+    queued = sum(1 for result in results if result['queued'])
+    job_ids = [result['job_id'] for result in results if result['queued']]
+    status_url = None
+    if job_ids:
+        status_url = request.build_absolute_uri(
+            f"{reverse('processing-job-list')}?ids={','.join(str(job_id) for job_id in job_ids)}"
+        )
+    return Response({
+        'total': len(results),
+        'queued': queued,
+        'failed': len(results) - queued,
+        'remaining': remaining,
+        'job_ids': job_ids,
+        'status_url': status_url,
+        'results': results
+    }, status=status.HTTP_202_ACCEPTED)
 
-        elif processed_content['type'] in ['excel', 'csv']:
-            # Excel/CSVファイルの場合
-            data_str = json.dumps(
-                processed_content['content'], ensure_ascii=False, indent=2)
-            prompt = f"""
-The following is data extracted from a Japanese delivery-related Excel/CSV file. Please analyze the delivery information and extract the following information in JSON format:
-
-{{
-  "sender_name": "Sender's name",
-  "sender_phone": "Sender's phone number",
-  "sender_address": "Sender's address", 
-  "recipient_name": "Recipient's name",
-  "recipient_phone": "Recipient's phone number",
-  "recipient_address": "Delivery address",
-  "item_name": "Item name",
-  "item_quantity": "Quantity (numeric value)",
-  "delivery_date": "Preferred delivery date (YYYY-MM-DD format)",
-  "delivery_time": "Preferred delivery time",
-  "special_instructions": "Special instructions",
-  "request_amount": "Request amount (numeric value, extract monetary value if present)"
-}}
-
-If there are multiple delivery requests, please extract information from the first one.
-For items that cannot be read, please use empty strings.
-
-Data content:
-{data_str}
-"""
-
-            payload = {
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": 1000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ]
-            }
 
-        response = requests.post(
-            settings.CLAUDE_API_URL, headers=headers, json=payload)
-
-        if response.status_code == 200:
-            claude_response = response.json()
-
-            # レスポンスからJSONデータを抽出
-            try:
-                content = claude_response['content'][0]['text']
-                # JSONブロックを抽出（```json ... ``` の中身）
-                if '```json' in content:
-                    json_start = content.find('```json') + 7
-                    json_end = content.find('```', json_start)
-                    json_str = content[json_start:json_end].strip()
-                else:
-                    json_str = content.strip()
-
-                extracted_data = json.loads(json_str)
-
-                # データベースに保存
-                file_upload.claude_response = claude_response
-                file_upload.extracted_data = extracted_data
-                file_upload.is_processed = True
-                file_upload.save()
-
-                return Response({
-                    'message': 'Claude APIで処理が完了しました。',
-                    'extracted_data': extracted_data
-                })
-
-            except (json.JSONDecodeError, KeyError) as e:
-                file_upload.claude_response = claude_response
-                file_upload.save()
-                return Response({
-                    'error': 'Claude APIのレスポンスの解析に失敗しました。',
-                    'raw_response': claude_response
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        else:
-            return Response({
-                'error': f'Claude API呼び出しに失敗しました。ステータスコード: {response.status_code}',
-                'details': response.text
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def process_with_claude_async(request, pk):
+    """Claude APIでの帳票処理をジョブとして登録するAPI（非同期）"""
+    try:
+        file_upload = FileUpload.objects.get(pk=pk, uploader=request.user)
+    except FileUpload.DoesNotExist:
+        return Response({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    if file_upload.is_processed:
+        return Response({'error': '既に処理済みです。'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Claude APIキーの確認
+    if not settings.CLAUDE_API_KEY:
+        return Response({'error': 'Claude APIキーが設定されていません。'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    try:
+        job, created = enqueue_processing_job(file_upload, request.user)
+    except UploadInBatchError as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
+    return Response({
+        'message': '処理を受け付けました。' if created else '既に処理待ちです。',
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('processing-job-detail', kwargs={'pk': job.id}))
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def _authenticate_stream_request(request, pk):
+    """JWT（Authorizationヘッダー）または ?ticket= の接続用チケットでユーザーを認証する
+
+    EventSourceはヘッダーを付けられないため、stream-ticket/ で発行した1回限りのチケットを使う。
+    URLに残ってもログなどから再利用できないよう、JWTはクエリ文字列では受け付けない。
+    """
+    authenticator = JWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else None
+    if raw_token:
+        try:
+            return authenticator.get_user(authenticator.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    ticket = request.GET.get('ticket')
+    if ticket:
+        return redeem_stream_ticket(ticket, pk)
+    return None
+
+
+def _get_stream_target(request, pk):
+    """進捗ストリームの対象を取得し、(FileUpload, エラーレスポンス) を返す"""
+    user = _authenticate_stream_request(request, pk)
+    if user is None:
+        return None, JsonResponse({'error': '認証情報が正しくありません。'}, status=status.HTTP_401_UNAUTHORIZED)
 
+    try:
+        file_upload = FileUpload.objects.get(pk=pk, uploader=user)
+    except FileUpload.DoesNotExist:
+        return None, JsonResponse({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    if file_upload.is_processed:
+        return None, JsonResponse({'error': '既に処理済みです。'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Claude APIキーの確認
+    if not settings.CLAUDE_API_KEY:
+        return None, JsonResponse({'error': 'Claude APIキーが設定されていません。'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 別のリクエスト・ワーカーが処理中の場合はストリームを開始しない
+    # （処理はワーカースレッドで改めて処理中の印を付けて行うため、その間に処理が始まった場合は error イベントで409を返す）
+    if is_being_processed(file_upload):
+        return None, JsonResponse({'error': 'このファイルは処理中です。'}, status=status.HTTP_409_CONFLICT)
+    if file_upload.claude_batch_id:
+        return None, JsonResponse({'error': BATCH_IN_PROGRESS_MESSAGE}, status=status.HTTP_409_CONFLICT)
+
+    return file_upload, None
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def _processing_events(file_upload):
+    """帳票処理を別スレッドで実行し、処理段階ごとのイベントをSSEとして送る"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def progress(stage, data):
+        loop.call_soon_threadsafe(queue.put_nowait, (stage, data))
+
+    # クライアントが切断しても処理は最後まで行い、結果を保存する
+    task = asyncio.ensure_future(
+        sync_to_async(run_claude_processing_in_thread, thread_sensitive=False)(file_upload, progress)
+    )
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    yield _sse_event('started', {'upload_id': file_upload.pk})
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=settings.SSE_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            yield ': keep-alive\n\n'
+            continue
+        if item is None:
+            break
+        yield _sse_event(*item)
+
+    try:
+        response_data, response_status = task.result()
     except Exception as e:
+        response_data = {'error': f'処理中にエラーが発生しました: {str(e)}'}
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+    yield _sse_event('complete' if response_status < 400 else 'error', {**response_data, 'status': response_status})
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_stream_ticket(request, pk):
+    """進捗ストリームの接続用チケットの発行API（EventSource用、短時間・1回限り有効）"""
+    try:
+        file_upload = FileUpload.objects.get(pk=pk, uploader=request.user)
+    except FileUpload.DoesNotExist:
+        return Response({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    ticket = issue_stream_ticket(request.user, file_upload)
+    stream_url = request.build_absolute_uri(reverse('process-with-claude-stream', kwargs={'pk': file_upload.pk}))
+    return Response({
+        'ticket': ticket,
+        'stream_url': f"{stream_url}?ticket={ticket}",
+        'expires_in': settings.STREAM_TICKET_TTL
+    }, status=status.HTTP_201_CREATED)
+
+
+async def process_with_claude_stream(request, pk):
+    """Claude APIで帳票を処理し、進捗をServer-Sent Eventsで返すAPI（ASGI向けの非同期ビュー）
+
+    decoded / pages_parsed / images_selected / request_sent / tokens / parsed / saved の
+    各段階をイベントとして送り、最後に complete（または error）で処理結果を返す。
+    同じファイルを処理中の場合は409を返す。
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'GETメソッドのみ利用できます。'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    file_upload, error_response = await sync_to_async(_get_stream_target)(request, pk)
+    if error_response:
+        return error_response
+
+    response = StreamingHttpResponse(_processing_events(file_upload), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # プロキシでのバッファリングを無効にする
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def processing_job_list(request):
+    """複数の帳票処理ジョブの状態をまとめて取得するAPI（一括処理のポーリング用）
+
+    ids にジョブIDをカンマ区切りで指定する。ジョブごとの処理結果と、状態ごとの件数を返す。
+    """
+    try:
+        job_ids = list(dict.fromkeys(int(job_id) for job_id in request.query_params.get('ids', '').split(',') if job_id))
+    except ValueError:
+        return Response({'error': 'idsには数値のIDを指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+    if not job_ids:
+        return Response({'error': 'ids を指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(job_ids) > settings.BULK_PROCESS_MAX_UPLOADS:
         return Response({
-            'error': f'処理中にエラーが発生しました: {str(e)}'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            'error': f'一度に取得できるのは{settings.BULK_PROCESS_MAX_UPLOADS}件までです。'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    jobs_by_id = ProcessingJob.objects.filter(requested_by=request.user).in_bulk(job_ids)
+    jobs = [jobs_by_id[job_id] for job_id in job_ids if job_id in jobs_by_id]
+    counts = {job_status: 0 for job_status, _ in ProcessingJob.STATUS_CHOICES}
+    for job in jobs:
+        counts[job.status] += 1
+
+    return Response({
+        'total': len(jobs),
+        'counts': counts,
+        'finished': counts['queued'] == 0 and counts['running'] == 0,
+        'results': ProcessingJobSerializer(jobs, many=True).data
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def processing_job_detail(request, pk):
+    """帳票処理ジョブの状態取得API（ポーリング用）"""
+    try:
+        job = ProcessingJob.objects.get(pk=pk, requested_by=request.user)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': 'ジョブが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = ProcessingJobSerializer(job)
+    return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def processing_stats(request):
+    """帳票処理の統計API（処理結果の再利用・ルールベース抽出によるAPI呼び出し削減数など）"""
+    processed_uploads = visible_uploads(request.user).filter(is_processed=True)
+    counts = {
+        row['processing_source']: row['count']
+        for row in processed_uploads.values('processing_source').annotate(count=Count('id')).order_by()
+    }
+
+    cache_hits = counts.get('cache', 0)
+    cache_misses = counts.get('claude', 0) + counts.get('claude_batch', 0)
+    lookups = cache_hits + cache_misses
+    # ルールベース抽出で完結した件数（Claude APIを呼ばなかった件数）
+    local_extractions = counts.get('local', 0)
+    extractions = local_extractions + cache_misses
+
+    # Claude APIのトークン使用量（プロンプトキャッシュの読み込み・書き込みを含む）
+    token_usage = processed_uploads.aggregate(
+        input_tokens=Coalesce(Sum('input_tokens'), 0),
+        output_tokens=Coalesce(Sum('output_tokens'), 0),
+        cache_read_input_tokens=Coalesce(Sum('cache_read_input_tokens'), 0),
+        cache_creation_input_tokens=Coalesce(Sum('cache_creation_input_tokens'), 0)
+    )
+
+    return Response({
+        'total_processed': sum(counts.values()),
+        'by_source': counts,
+        'cache_hits': cache_hits,
+        'cache_misses': cache_misses,
+        'cache_hit_rate': round(cache_hits / lookups, 4) if lookups else 0.0,
+        'local_extractions': local_extractions,
+        'local_extraction_rate': round(local_extractions / extractions, 4) if extractions else 0.0,
+        'api_calls_saved': cache_hits + local_extractions,
+        'token_usage': token_usage
+    })
 
 
 @api_view(['POST'])
@@ -676,6 +612,37 @@ def create_delivery_from_file(request, pk):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def import_manifest_from_file(request, pk):
+    """CSV/Excelのマニフェストから配送依頼を一括作成するAPI"""
+    try:
+        file_upload = FileUpload.objects.get(pk=pk, uploader=request.user)
+    except FileUpload.DoesNotExist:
+        return Response({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not has_upload_content(file_upload):
+        return Response({'error': 'ファイルデータが存在しません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        report = import_manifest(file_upload, request.user)
+    except ManifestAlreadyImportedError as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    except ManifestError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not report['created'] and report['failed']:
+        return Response({
+            'error': '取り込める行がありませんでした。',
+            **report
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'message': f"{report['created']}件の配送依頼を作成しました。",
+        **report
+    }, status=status.HTTP_201_CREATED)
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def download_file(request, pk):
@@ -692,22 +659,160 @@ def download_file(request, pk):
         return Response({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
     
     # ファイルデータの取得
-    if file_upload.file_data:
-        # DB保存形式からデコード
-        file_content = base64.b64decode(file_upload.file_data)
-    elif file_upload.file:
-        # 旧形式（FileField）から読み込み
-        try:
-            with open(file_upload.file.path, 'rb') as f:
-                file_content = f.read()
-        except Exception as e:
-            return Response({'error': f'ファイル読み込みエラー: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    else:
+    if not has_upload_content(file_upload):
         return Response({'error': 'ファイルデータが存在しません。'}, status=status.HTTP_404_NOT_FOUND)
-    
-    # HTTPレスポンスとして返す
-    response = HttpResponse(file_content, content_type=file_upload.mime_type)
-    response['Content-Disposition'] = f'attachment; filename="{file_upload.original_name}"'
-    response['Content-Length'] = file_upload.file_size
-    
+
+    # コンテンツハッシュによる強いETag（同一内容なら再ダウンロード不要）
+    etag = f'"{file_upload.content_hash}"' if file_upload.content_hash else None
+    if etag and _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    file_size = file_upload.file_size
+
+    # フロントのプロキシ（nginx / Apache等）に配信を任せる場合
+    accel_mode = settings.FILE_DOWNLOAD_ACCEL_MODE
+    file_path = upload_content_path(file_upload) if accel_mode and file_upload.content_hash else None
+    if file_path:
+        response = HttpResponse(content_type=file_upload.mime_type)
+        if accel_mode == 'x-accel-redirect':
+            relative_path = os.path.relpath(file_path, settings.BLOB_STORAGE_ROOT)
+            response['X-Accel-Redirect'] = settings.FILE_DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + relative_path
+        else:
+            response['X-Sendfile'] = file_path
+        return _set_download_headers(response, file_upload, etag)
+
+    # Rangeリクエスト（部分取得・レジューム）の判定
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or (etag and if_range == etag)):
+        byte_range = _parse_range_header(range_header, file_size)
+        if byte_range == 'unsatisfiable':
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{file_size}'
+            return response
+
+    start, end = byte_range if byte_range else (0, file_size - 1)
+
+    try:
+        stream = open_upload_content(file_upload, offset=start)
+    except Exception as e:
+        return Response({'error': f'ファイル読み込みエラー: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # チャンク単位でストリーミング（ファイル全体をメモリに載せない）
+    response = StreamingHttpResponse(
+        _iter_stream(stream, end - start + 1),
+        status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        content_type=file_upload.mime_type
+    )
+    response['Content-Length'] = end - start + 1
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+
+    return _set_download_headers(response, file_upload, etag)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def preview_file(request, pk):
+    """プレビュー（サムネイル）取得API
+
+    画像・PDFのページを ?size=small|medium|large（既定 small）のJPEGで返す。
+    PDFは ?page= でページを指定できる（既定は1ページ目）。
+    """
+    try:
+        if request.user.user_type == 'seed':
+            file_upload = FileUpload.objects.get(pk=pk)
+        else:
+            file_upload = FileUpload.objects.get(pk=pk, uploader=request.user)
+    except FileUpload.DoesNotExist:
+        return Response({'error': 'ファイルが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+
+    size = request.query_params.get('size', 'small')
+    try:
+        page = int(request.query_params.get('page', 1))
+    except ValueError:
+        return Response({'error': 'pageには数値を指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # 内容が変わらない限りプレビューも変わらないため、長期間キャッシュさせる
+    etag = f'"{file_upload.content_hash}-{size}-p{page}"' if file_upload.content_hash else None
+    if etag and _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    try:
+        preview_path = get_preview(file_upload, size, page)
+    except PreviewError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = FileResponse(open(preview_path, 'rb'), content_type='image/jpeg')
+    if etag:
+        response['ETag'] = etag
+        response['Cache-Control'] = f'private, max-age={settings.PREVIEW_CACHE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _set_download_headers(response, file_upload, etag):
+    """ダウンロードレスポンス共通のヘッダーを設定"""
+    response['Content-Disposition'] = content_disposition_header(True, file_upload.original_name)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, no-cache'
+    if etag:
+        response['ETag'] = etag
     return response
+
+
+def _etag_matches(if_none_match, etag):
+    """If-None-Match ヘッダーがETagに一致するか"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def _parse_range_header(range_header, file_size):
+    """Rangeヘッダーを解析し (開始, 終了) を返す
+
+    単一範囲のみ対応。解釈できない場合はNone（全体を返す）、
+    範囲外の場合は 'unsatisfiable' を返す。
+    """
+    if not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    start_str, _, end_str = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            # bytes=-N（末尾Nバイト）
+            suffix_length = int(end_str)
+            if suffix_length == 0:
+                return 'unsatisfiable'
+            start = max(file_size - suffix_length, 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+
+    if start >= file_size or start > end:
+        return 'unsatisfiable'
+    return start, min(end, file_size - 1)
+
+
+def _iter_stream(stream, length):
+    """ストリームから指定バイト数をチャンク単位で読み出す"""
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        stream.close()
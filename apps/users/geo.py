@@ -0,0 +1,172 @@
+import copy
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import DriverProfile
+
+EARTH_RADIUS_KM = 6371.0088
+
+# 緯度1度あたりの距離（km）
+KM_PER_DEGREE = 111.195
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """1地点から複数地点への大円距離（km）をまとめて計算する（緯度経度はラジアン）"""
+    dlat = lats - lat
+    dlng = lngs - lng
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class DriverLocationSnapshot:
+    """現在位置が登録されているドライバーの位置をNumPy配列に展開したもの
+
+    近い順の検索は配列上のベクトル演算で行い、DBへの問い合わせは結果のドライバー分だけにする。
+    """
+
+    def __init__(self, rows):
+        # rows: (user_id, 緯度, 経度, 車両タイプ, 稼働可能) の並び
+        rows = list(rows)
+        self.user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.lat_deg = np.array([float(row[1]) for row in rows], dtype=np.float64)
+        self.lats = np.radians(self.lat_deg)
+        self.lngs = np.radians(np.array([float(row[2]) for row in rows], dtype=np.float64))
+        self.vehicle_types = np.array([row[3] for row in rows], dtype=object)
+        self.is_available = np.array([row[4] for row in rows], dtype=bool)
+        self.positions = {user_id: index for index, user_id in enumerate(self.user_ids.tolist())}
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        return cls(
+            DriverProfile.objects.filter(
+                current_location_lat__isnull=False, current_location_lng__isnull=False
+            ).values_list(
+                'user_id', 'current_location_lat', 'current_location_lng', 'vehicle_type', 'is_available'
+            ).iterator(chunk_size=5000)
+        )
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def with_locations(self, locations):
+        """位置（{user_id: (緯度, 経度)}）を置き換えたコピーを返す
+
+        スナップショットにないドライバーが含まれる場合は None を返す。
+        検索中の配列は書き換えず、座標の配列だけを複製する。
+        """
+        indexes = [self.positions.get(user_id) for user_id in locations]
+        if None in indexes:
+            return None
+        snapshot = copy.copy(self)
+        if not indexes:
+            return snapshot
+        indexes = np.array(indexes, dtype=np.int64)
+        lat_deg = np.array([float(lat) for lat, _ in locations.values()], dtype=np.float64)
+        lng_deg = np.array([float(lng) for _, lng in locations.values()], dtype=np.float64)
+        snapshot.lat_deg = self.lat_deg.copy()
+        snapshot.lats = self.lats.copy()
+        snapshot.lngs = self.lngs.copy()
+        snapshot.lat_deg[indexes] = lat_deg
+        snapshot.lats[indexes] = np.radians(lat_deg)
+        snapshot.lngs[indexes] = np.radians(lng_deg)
+        return snapshot
+
+    def nearest(self, lat, lng, limit, radius_km=None, vehicle_types=None, available_only=True):
+        """(user_id, 距離km) を近い順に最大 limit 件返す"""
+        mask = np.ones(len(self), dtype=bool)
+        if available_only:
+            mask &= self.is_available
+        if vehicle_types:
+            mask &= np.isin(self.vehicle_types, list(vehicle_types))
+        if radius_km is not None:
+            # 緯度の範囲で先に絞り込み、距離の計算対象を減らす
+            mask &= np.abs(self.lat_deg - lat) <= radius_km / KM_PER_DEGREE
+
+        candidates = np.flatnonzero(mask)
+        distances = haversine_km(np.radians(lat), np.radians(lng), self.lats[candidates], self.lngs[candidates])
+        if radius_km is not None:
+            within = distances <= radius_km
+            candidates, distances = candidates[within], distances[within]
+
+        if len(candidates) > limit:
+            # 上位 limit 件だけを部分ソートで取り出す
+            top = np.argpartition(distances, limit - 1)[:limit]
+            candidates, distances = candidates[top], distances[top]
+        order = np.argsort(distances, kind='stable')
+        return [
+            (int(user_id), float(distance))
+            for user_id, distance in zip(self.user_ids[candidates[order]], distances[order])
+        ]
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+# 無効化・座標の置き換えのたびに進める（作成中に古くなったスナップショットを保存しないため）
+_snapshot_generation = 0
+
+
+def get_driver_locations():
+    """ドライバー位置のスナップショットを返す（プロセス内で共有）
+
+    DRIVER_LOCATION_SNAPSHOT_TTL 秒を過ぎたもの、プロフィールが変更されたものは作り直す。
+    作り直しはロックの外で行い、ロック中は参照の差し替えだけを行う。
+    """
+    global _snapshot
+    with _snapshot_lock:
+        snapshot, generation = _snapshot, _snapshot_generation
+    if snapshot is not None and time.monotonic() - snapshot.built_at <= settings.DRIVER_LOCATION_SNAPSHOT_TTL:
+        return snapshot
+
+    snapshot = DriverLocationSnapshot.load()
+    with _snapshot_lock:
+        if _snapshot_generation == generation:
+            _snapshot = snapshot
+    return snapshot
+
+
+def invalidate_driver_locations():
+    """次の検索でスナップショットを作り直す"""
+    global _snapshot, _snapshot_generation
+    with _snapshot_lock:
+        _snapshot = None
+        _snapshot_generation += 1
+
+
+def update_driver_locations(locations):
+    """書き戻した位置（{user_id: (緯度, 経度)}）を共有中のスナップショットに反映する
+
+    スナップショットにないドライバー（新しく位置を登録したドライバー）が含まれる場合は作り直す。
+    置き換える前から作成中のスナップショットはこの位置を含まない可能性があるため、世代を進めて保存させない。
+    """
+    global _snapshot, _snapshot_generation
+    with _snapshot_lock:
+        _snapshot_generation += 1
+        if _snapshot is not None:
+            _snapshot = _snapshot.with_locations(locations)
+
+
+@receiver([post_save, post_delete], sender=DriverProfile)
+def driver_profile_changed(sender, **kwargs):
+    invalidate_driver_locations()
+
+
+def find_nearest_drivers(lat, lng, limit, radius_km=None, vehicle_types=None, available_only=True):
+    """指定地点に近いドライバーのプロフィールを近い順に返す（distance_km 属性付き）"""
+    matches = get_driver_locations().nearest(
+        lat, lng, limit, radius_km=radius_km, vehicle_types=vehicle_types, available_only=available_only
+    )
+    profiles = DriverProfile.objects.select_related('user').in_bulk(
+        [user_id for user_id, _ in matches], field_name='user_id'
+    )
+    results = []
+    for user_id, distance in matches:
+        profile = profiles.get(user_id)
+        if profile is None or (available_only and not profile.is_available):
+            continue  # スナップショット作成後に削除された・稼働不可になった
+        profile.distance_km = distance
+        results.append(profile)
+    return results
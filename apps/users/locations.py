@@ -0,0 +1,151 @@
+import atexit
+import logging
+import threading
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .geo import update_driver_locations
+from .models import DriverProfile
+
+logger = logging.getLogger(__name__)
+
+# 位置を書き戻す bulk_update の単位
+LOCATION_UPDATE_BATCH_SIZE = 500
+
+
+class LocationBuffer:
+    """ドライバーごとの最新の位置をメモリに保持し、まとめてDBに書き戻すバッファ
+
+    同じドライバーの位置は次の書き戻しまでに何度届いても最新の1件にまとめられるため、
+    DBへの書き込みは「書き戻し間隔あたりドライバー1件」に抑えられる。
+    バッファはプロセスのメモリ上にあるため、プロセスが異常終了（強制終了・クラッシュ）した場合は
+    最後の書き戻し以降に受け取った位置が失われる（通常の終了時は atexit で書き戻す）。
+    """
+
+    def __init__(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id, lat, lng, recorded_at):
+        """位置を記録する（既に新しい位置を保持している場合は無視する）"""
+        with self._lock:
+            current = self._latest.get(user_id)
+            if current is None or current[2] <= recorded_at:
+                self._latest[user_id] = (lat, lng, recorded_at)
+
+    def __len__(self):
+        return len(self._latest)
+
+    def flush(self):
+        """保持している位置を DriverProfile にまとめて書き戻し、書き戻した件数を返す
+
+        DBの位置の記録日時（location_recorded_at）より新しい位置のみ書き戻す。
+        """
+        with self._lock:
+            pending, self._latest = self._latest, {}
+        if not pending:
+            return 0
+
+        try:
+            now = timezone.now()
+            with transaction.atomic():
+                # 他のワーカー・プロフィール更新APIがより新しい位置を書き込んでいる場合は上書きしない
+                # （行ロックして記録日時を比べる。ロックはDBへの書き込みの間だけ保持する）
+                profiles = [
+                    profile
+                    for profile in DriverProfile.objects.select_for_update().filter(
+                        user_id__in=pending
+                    ).only('pk', 'user_id', 'location_recorded_at')
+                    if profile.location_recorded_at is None
+                    or profile.location_recorded_at < pending[profile.user_id][2]
+                ]
+                for profile in profiles:
+                    lat, lng, recorded_at = pending[profile.user_id]
+                    profile.current_location_lat = Decimal(f'{lat:.6f}')
+                    profile.current_location_lng = Decimal(f'{lng:.6f}')
+                    profile.location_recorded_at = recorded_at
+                    profile.updated_at = now
+                DriverProfile.objects.bulk_update(
+                    profiles,
+                    ['current_location_lat', 'current_location_lng', 'location_recorded_at', 'updated_at'],
+                    batch_size=LOCATION_UPDATE_BATCH_SIZE
+                )
+        except Exception:
+            # 書き戻せなかった位置は、その後により新しい位置が届いていなければ次回に持ち越す
+            with self._lock:
+                for user_id, point in pending.items():
+                    current = self._latest.get(user_id)
+                    if current is None or current[2] < point[2]:
+                        self._latest[user_id] = point
+            raise
+
+        # 近くのドライバー検索のスナップショットの座標を置き換える（全件の読み直しはしない）
+        update_driver_locations({
+            profile.user_id: (profile.current_location_lat, profile.current_location_lng) for profile in profiles
+        })
+        return len(profiles)
+
+
+_buffer = LocationBuffer()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(max(settings.DRIVER_LOCATION_FLUSH_INTERVAL, 1))
+        close_old_connections()
+        try:
+            flush_driver_locations()
+        except Exception:
+            logger.exception("ドライバー位置の書き戻しに失敗しました")
+        finally:
+            close_old_connections()
+
+
+def _flush_at_exit():
+    try:
+        flush_driver_locations()
+    except Exception:
+        logger.exception("終了時のドライバー位置の書き戻しに失敗しました")
+
+
+# ワーカーの通常の終了時（再起動・SIGTERMによる停止を含む）にバッファの位置を書き戻す
+atexit.register(_flush_at_exit)
+
+
+def _ensure_flusher():
+    """書き戻し用のスレッドを起動する（プロセス内で1つ）"""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, name='driver-location-flusher', daemon=True)
+            _flusher.start()
+
+
+def record_driver_locations(user_id, points):
+    """ドライバーの位置（(緯度, 経度, 記録日時) の並び）をバッファに記録する
+
+    DRIVER_LOCATION_FLUSH_INTERVAL が0以下の場合はその場でDBに書き戻す。
+    """
+    for lat, lng, recorded_at in points:
+        _buffer.record(user_id, lat, lng, recorded_at)
+    if settings.DRIVER_LOCATION_FLUSH_INTERVAL <= 0:
+        flush_driver_locations()
+    else:
+        _ensure_flusher()
+
+
+def flush_driver_locations():
+    """バッファの位置をDBに書き戻し、書き戻した件数を返す"""
+    count = _buffer.flush()
+    if count:
+        logger.info("ドライバー位置を%s件書き戻しました", count)
+    return count
+
+
+def pending_driver_locations():
+    """まだDBに書き戻していない位置の件数"""
+    return len(_buffer)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_user_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverprofile',
+            name='location_recorded_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='位置の記録日時'),
+        ),
+    ]
@@ -46,6 +46,8 @@ class DriverProfile(models.Model):
     is_available = models.BooleanField('稼働可能', default=True)
     current_location_lat = models.DecimalField('現在位置（緯度）', max_digits=9, decimal_places=6, null=True, blank=True)
     current_location_lng = models.DecimalField('現在位置（経度）', max_digits=9, decimal_places=6, null=True, blank=True)
+    # 現在位置の記録日時（これより古い位置では上書きしない）
+    location_recorded_at = models.DateTimeField('位置の記録日時', null=True, blank=True)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
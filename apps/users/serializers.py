@@ -42,6 +42,7 @@ class DriverProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = DriverProfile
         fields = '__all__'
+        read_only_fields = ['location_recorded_at']
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -6,8 +6,10 @@ urlpatterns = [
     path('register/', views.UserRegistrationView.as_view(), name='user-register'),
     path('profile/', views.UserProfileView.as_view(), name='user-profile'),
     path('driver-profile/', views.DriverProfileView.as_view(), name='driver-profile'),
+    path('driver-location/', views.driver_location, name='driver-location'),
     path('available-drivers/', views.available_drivers, name='available-drivers'),
     path('drivers/', views.all_drivers, name='all-drivers'),
+    path('drivers/nearest/', views.nearest_drivers, name='nearest-drivers'),
     path('drivers/<int:driver_id>/delete/', views.delete_driver, name='delete-driver'),
     # 一時的に標準のTokenObtainPairViewを使用
     path('token/', TokenObtainPairView.as_view(), name='token-obtain-pair'),
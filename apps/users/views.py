@@ -2,7 +2,13 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.delivery.models import DeliveryRequest
+from .geo import find_nearest_drivers
+from .locations import record_driver_locations
 from .models import DriverProfile
 from .serializers import UserSerializer, DriverProfileSerializer, UserRegistrationSerializer, CustomTokenObtainPairSerializer
 
@@ -50,6 +56,73 @@ class DriverProfileView(generics.RetrieveUpdateAPIView):
             return Response({'error': 'ドライバーではありません。'}, status=status.HTTP_403_FORBIDDEN)
         return super().get(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        # 位置を直接更新した場合は記録日時を更新し、それより前に受信した位置で上書きされないようにする
+        if {'current_location_lat', 'current_location_lng'} & serializer.validated_data.keys():
+            serializer.save(location_recorded_at=timezone.now())
+        else:
+            serializer.save()
+
+
+def _parse_location_point(point, now):
+    """位置 {lat, lng, recorded_at（省略可）} を (緯度, 経度, 記録日時) にする（不正な場合はNone）"""
+    if not isinstance(point, dict):
+        return None
+    try:
+        lat, lng = float(point['lat']), float(point['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+
+    recorded_at = now
+    if point.get('recorded_at'):
+        try:
+            recorded_at = parse_datetime(str(point['recorded_at']))
+        except ValueError:
+            return None
+        if recorded_at is None:
+            return None
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at)
+        # 端末の時計が進んでいても、後から届く位置を無視しないようにする
+        recorded_at = min(recorded_at, now)
+    return lat, lng, recorded_at
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def driver_location(request):
+    """ドライバーの現在位置の受信API
+
+    {"points": [{"lat": .., "lng": .., "recorded_at": ..}, ...]} または {"lat": .., "lng": ..} を受け付ける。
+    位置はメモリに保持し、DRIVER_LOCATION_FLUSH_INTERVAL 秒ごとにまとめてDBへ書き戻す。
+    書き戻す前にワーカーが異常終了した場合、その間の位置は失われる（次の送信で最新の位置に戻る）。
+    """
+    if request.user.user_type != 'driver':
+        return Response({'error': 'ドライバーではありません。'}, status=status.HTTP_403_FORBIDDEN)
+
+    data = request.data if isinstance(request.data, dict) else {}
+    points = data.get('points', [data] if 'lat' in data else None)
+    if not isinstance(points, list) or not points:
+        return Response({'error': '位置情報（points）が必要です。'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(points) > settings.DRIVER_LOCATION_MAX_POINTS:
+        return Response(
+            {'error': f'一度に送信できる位置情報は{settings.DRIVER_LOCATION_MAX_POINTS}件までです。'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    now = timezone.now()
+    parsed = []
+    for index, point in enumerate(points):
+        location = _parse_location_point(point, now)
+        if location is None:
+            return Response({'error': f'{index + 1}件目の位置情報が正しくありません。'}, status=status.HTTP_400_BAD_REQUEST)
+        parsed.append(location)
+
+    record_driver_locations(request.user.id, parsed)
+    return Response({'accepted': len(parsed)}, status=status.HTTP_202_ACCEPTED)
+
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -60,6 +133,76 @@ def available_drivers(request):
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def nearest_drivers(request):
+    """近くのドライバー検索API
+
+    ?delivery_request=<id>（集荷地点）または ?lat=&lng= から近い順に返す。
+    radius_km（半径）、vehicle_type（カンマ区切り）、available=false（稼働不可も含める）、limit で絞り込む。
+    """
+    if request.user.user_type not in ['seed', 'company']:
+        return Response({'error': '権限がありません。'}, status=status.HTTP_403_FORBIDDEN)
+
+    params = request.query_params
+    if params.get('delivery_request'):
+        delivery_requests = DeliveryRequest.objects.all()
+        if request.user.user_type != 'seed':
+            delivery_requests = delivery_requests.filter(requester=request.user)
+        try:
+            delivery_request = delivery_requests.get(pk=params['delivery_request'])
+        except (DeliveryRequest.DoesNotExist, ValueError):
+            return Response({'error': '案件が見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
+        if delivery_request.sender_lat is None or delivery_request.sender_lng is None:
+            return Response({'error': '案件に集荷地点の位置情報がありません。'}, status=status.HTTP_400_BAD_REQUEST)
+        lat, lng = float(delivery_request.sender_lat), float(delivery_request.sender_lng)
+    else:
+        try:
+            lat, lng = float(params['lat']), float(params['lng'])
+        except (KeyError, ValueError):
+            return Response({'error': '緯度・経度（lat, lng）または案件ID（delivery_request）が必要です。'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return Response({'error': '緯度・経度が範囲外です。'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        radius_km = float(params['radius_km']) if params.get('radius_km') else None
+        limit = int(params.get('limit', settings.NEAREST_DRIVERS_DEFAULT_LIMIT))
+    except ValueError:
+        return Response({'error': 'radius_km・limit は数値で指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+    if (radius_km is not None and radius_km <= 0) or limit <= 0:
+        return Response({'error': 'radius_km・limit は正の数で指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(limit, settings.NEAREST_DRIVERS_MAX_LIMIT)
+    vehicle_types = [name for name in params.get('vehicle_type', '').split(',') if name]
+
+    drivers = find_nearest_drivers(
+        lat, lng, limit,
+        radius_km=radius_km,
+        vehicle_types=vehicle_types,
+        available_only=params.get('available') != 'false'
+    )
+    return Response({
+        'lat': lat,
+        'lng': lng,
+        'results': [
+            {
+                'id': profile.user.id,
+                'username': profile.user.username,
+                'first_name': profile.user.first_name,
+                'last_name': profile.user.last_name,
+                'phone_number': profile.user.phone_number,
+                'vehicle_type': profile.vehicle_type,
+                'vehicle_number': profile.vehicle_number,
+                'is_available': profile.is_available,
+                'current_location_lat': profile.current_location_lat,
+                'current_location_lng': profile.current_location_lng,
+                'distance_km': round(profile.distance_km, 3),
+            }
+            for profile in drivers
+        ]
+    })
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def all_drivers(request):
@@ -0,0 +1,134 @@
+import base64
+import json
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """プランナーの統計情報から件数を見積もる（COUNT(*) を実行しない）
+
+    PostgreSQL以外では正確な件数を返す。
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """(created_at, id) の降順で前後のページをたどるカーソル（キーセット）ページネーション
+
+    OFFSET・COUNT(*) を使わないため、件数が増えても各ページの取得コストが変わらない。
+    途中に行が追加・削除されても、ページの境界がずれない。
+    件数は estimated_count としてプランナーの見積もりを返す。
+    """
+    cursor_query_param = 'cursor'
+    page_size = None
+
+    def __init__(self, page_size=None):
+        self.page_size = page_size or self.page_size
+
+    def encode_cursor(self, item, direction):
+        position = {'c': item.created_at.isoformat(), 'i': item.pk, 'd': direction}
+        return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            created_at = parse_datetime(position['c'])
+            pk = int(position['i'])
+            direction = position['d']
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound('無効なカーソルです。')
+        if created_at is None or direction not in ('next', 'prev'):
+            raise NotFound('無効なカーソルです。')
+        return created_at, pk, direction
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.estimated_count = estimate_count(queryset)
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            page = list(queryset.order_by('-created_at', '-pk')[:self.page_size + 1])
+            has_more = len(page) > self.page_size
+            page = page[:self.page_size]
+            self.has_next, self.has_previous = has_more, False
+        else:
+            created_at, pk, direction = cursor
+            if direction == 'next':
+                # (created_at, id) < カーソル位置
+                queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, pk__gte=pk)
+                page = list(queryset.order_by('-created_at', '-pk')[:self.page_size + 1])
+                has_more = len(page) > self.page_size
+                page = page[:self.page_size]
+                self.has_next, self.has_previous = has_more, True
+            else:
+                # (created_at, id) > カーソル位置 を昇順に取得して並べ直す
+                queryset = queryset.filter(created_at__gte=created_at).exclude(created_at=created_at, pk__lte=pk)
+                page = list(queryset.order_by('created_at', 'pk')[:self.page_size + 1])
+                has_more = len(page) > self.page_size
+                page = page[:self.page_size][::-1]
+                self.has_next, self.has_previous = True, has_more
+
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], 'next'))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], 'prev'))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'estimated_count': self.estimated_count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class StandardPagination(PageNumberPagination):
+    """通常はページ番号のページネーション、?pagination=cursor でカーソルページネーションに切り替える
+
+    カーソルのページでは ?cursor= 付きの next / previous をそのままたどる。
+    """
+    cursor_class = KeysetPagination
+
+    def is_cursor_request(self, request):
+        return (request.query_params.get('pagination') == 'cursor'
+                or self.cursor_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.is_cursor_request(request):
+            self.cursor_paginator = self.cursor_class(page_size=self.get_page_size(request))
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
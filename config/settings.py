@@ -291,4 +291,121 @@ AUTH_USER_MODEL = 'users.User'
 
 # Claude API settings
 CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
-CLAUDE_API_URL = 'https://api.anthropic.com/v1/messages'
+CLAUDE_API_URL = os.getenv('CLAUDE_API_URL', 'https://api.anthropic.com/v1/messages')
+
+# 帳票処理ジョブ（process_ocr_jobs ワーカー）設定
+PROCESSING_JOB_MAX_ATTEMPTS = int(os.getenv('PROCESSING_JOB_MAX_ATTEMPTS', '3'))
+PROCESSING_JOB_RETRY_DELAY = int(os.getenv('PROCESSING_JOB_RETRY_DELAY', '30'))  # 秒（試行ごとに倍増）
+PROCESSING_JOB_POLL_INTERVAL = float(os.getenv('PROCESSING_JOB_POLL_INTERVAL', '2'))  # 秒
+PROCESSING_JOB_STALE_AFTER = int(os.getenv('PROCESSING_JOB_STALE_AFTER', '900'))  # 秒
+PROCESSING_JOB_CONCURRENCY = int(os.getenv('PROCESSING_JOB_CONCURRENCY', '4'))  # ワーカーあたりの同時処理数（CLAUDE_API_MAX_CONCURRENCY が上限）
+# 帳票の処理中の印（processing_started_at）の有効期間（秒）。これを過ぎたものは処理が中断されたとみなし、再度処理できる
+FILE_PROCESSING_CLAIM_TIMEOUT = int(os.getenv('FILE_PROCESSING_CLAIM_TIMEOUT', '900'))
+
+# BLOBストア設定（アップロードファイル本体の保存先）
+# 'local': BLOB_STORAGE_ROOT 配下にSHA-256ごとに保存 / 's3': S3互換ストレージ（MinIO等）に保存（boto3が必要）
+BLOB_STORAGE_BACKEND = os.getenv('BLOB_STORAGE_BACKEND', 'local')
+BLOB_STORAGE_ROOT = Path(os.getenv('BLOB_STORAGE_ROOT', str(MEDIA_ROOT / 'blobs')))
+BLOB_STORAGE_S3_BUCKET = os.getenv('BLOB_STORAGE_S3_BUCKET', '')
+BLOB_STORAGE_S3_PREFIX = os.getenv('BLOB_STORAGE_S3_PREFIX', 'uploads')
+BLOB_STORAGE_S3_ENDPOINT_URL = os.getenv('BLOB_STORAGE_S3_ENDPOINT_URL')  # MinIO等を使う場合に指定
+BLOB_STORAGE_S3_ACCESS_KEY_ID = os.getenv('BLOB_STORAGE_S3_ACCESS_KEY_ID')
+BLOB_STORAGE_S3_SECRET_ACCESS_KEY = os.getenv('BLOB_STORAGE_S3_SECRET_ACCESS_KEY')
+BLOB_STORAGE_S3_REGION = os.getenv('BLOB_STORAGE_S3_REGION')
+
+# BLOBの圧縮保存（gzip）。対象の形式のみ圧縮し、圧縮後のサイズが元の MAX_RATIO 倍以下の場合だけ圧縮して保存する
+BLOB_COMPRESSION_ENABLED = os.getenv('BLOB_COMPRESSION_ENABLED', 'True').lower() == 'true'
+BLOB_COMPRESSION_CONTENT_TYPES = os.getenv(
+    'BLOB_COMPRESSION_CONTENT_TYPES',
+    'application/pdf,text/csv,application/csv,text/plain,application/json,application/vnd.ms-excel'
+).split(',')
+BLOB_COMPRESSION_LEVEL = int(os.getenv('BLOB_COMPRESSION_LEVEL', '6'))
+BLOB_COMPRESSION_MAX_RATIO = float(os.getenv('BLOB_COMPRESSION_MAX_RATIO', '0.9'))
+
+# Claude APIの生レスポンス（claude_response）を圧縮して保存する最小サイズ（バイト）
+CLAUDE_RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('CLAUDE_RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+
+# ファイルダウンロード配信設定
+# '': Djangoがストリーミング配信 / 'x-accel-redirect': nginx / 'x-sendfile': Apache(mod_xsendfile)等
+FILE_DOWNLOAD_ACCEL_MODE = os.getenv('FILE_DOWNLOAD_ACCEL_MODE', '')
+# nginx の internal location（BLOB_STORAGE_ROOT を alias に指定する）
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv('FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-blobs/')
+
+# アップロード設定
+FILE_UPLOAD_MAX_SIZE = int(os.getenv('FILE_UPLOAD_MAX_SIZE', str(10 * 1024 * 1024)))  # バイト
+# 分割アップロード（/api/files/uploads/chunked/）の受信中データ保存先
+CHUNKED_UPLOAD_ROOT = Path(os.getenv('CHUNKED_UPLOAD_ROOT', str(MEDIA_ROOT / 'chunked_uploads')))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', str(5 * 1024 * 1024)))  # バイト
+CHUNKED_UPLOAD_EXPIRY_HOURS = int(os.getenv('CHUNKED_UPLOAD_EXPIRY_HOURS', '24'))
+
+# PDF抽出設定
+# ページ並列処理のワーカープロセス数（1以下で無効）と、並列処理を行う最小ページ数
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '8'))
+# 画像ベースPDFからClaudeに送る画像の抽出設定
+PDF_IMAGE_MAX_PAGES = int(os.getenv('PDF_IMAGE_MAX_PAGES', '5'))  # 画像を抽出する最大ページ数
+PDF_IMAGE_MIN_AREA = int(os.getenv('PDF_IMAGE_MIN_AREA', str(200 * 200)))  # これより小さい埋め込み画像（ロゴ等）は無視
+PDF_RASTER_DPI = int(os.getenv('PDF_RASTER_DPI', '150'))  # 埋め込み画像が無いページのラスタライズ解像度
+PDF_IMAGE_PIXEL_BUDGET = int(os.getenv('PDF_IMAGE_PIXEL_BUDGET', str(12 * 1000 * 1000)))  # 1ドキュメントの合計ピクセル上限
+
+# Claude送信前の画像前処理
+IMAGE_PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS_ENABLED', 'True').lower() == 'true'
+IMAGE_MAX_LONG_EDGE = int(os.getenv('IMAGE_MAX_LONG_EDGE', '1568'))  # 長辺の最大ピクセル数
+IMAGE_GRAYSCALE = os.getenv('IMAGE_GRAYSCALE', 'False').lower() == 'true'
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_PREPROCESS_CACHE_ROOT = Path(os.getenv('IMAGE_PREPROCESS_CACHE_ROOT', str(MEDIA_ROOT / 'preprocessed_images')))
+
+# 画像ベースPDFの1リクエストに含めるページ画像の上限
+CLAUDE_MAX_IMAGES_PER_REQUEST = int(os.getenv('CLAUDE_MAX_IMAGES_PER_REQUEST', '5'))
+CLAUDE_IMAGE_BYTE_BUDGET = int(os.getenv('CLAUDE_IMAGE_BYTE_BUDGET', str(10 * 1024 * 1024)))  # Base64の合計バイト数
+CLAUDE_IMAGE_TOKEN_BUDGET = int(os.getenv('CLAUDE_IMAGE_TOKEN_BUDGET', '12000'))  # 推定入力トークン数
+
+# CSV/Excelマニフェストの一括取り込み
+MANIFEST_IMPORT_BATCH_SIZE = int(os.getenv('MANIFEST_IMPORT_BATCH_SIZE', '1000'))  # 読み込み・bulk_createの単位
+MANIFEST_IMPORT_MAX_ERRORS = int(os.getenv('MANIFEST_IMPORT_MAX_ERRORS', '1000'))  # レスポンスに含めるエラー行数の上限
+
+# ルールベース抽出（必須項目がすべてしきい値以上の信頼度で取れた場合はClaude APIを呼ばない）
+LOCAL_EXTRACTION_ENABLED = os.getenv('LOCAL_EXTRACTION_ENABLED', 'True').lower() == 'true'
+LOCAL_EXTRACTION_MIN_CONFIDENCE = float(os.getenv('LOCAL_EXTRACTION_MIN_CONFIDENCE', '0.8'))
+
+# Claude APIクライアント（接続プール・タイムアウト・再試行・同時実行数・サーキットブレーカー）
+CLAUDE_API_CONNECT_TIMEOUT = float(os.getenv('CLAUDE_API_CONNECT_TIMEOUT', '5'))  # 秒
+CLAUDE_API_READ_TIMEOUT = float(os.getenv('CLAUDE_API_READ_TIMEOUT', '120'))  # 秒
+CLAUDE_API_MAX_RETRIES = int(os.getenv('CLAUDE_API_MAX_RETRIES', '2'))  # 429/5xx・通信エラー時の再試行回数
+CLAUDE_API_RETRY_BACKOFF = float(os.getenv('CLAUDE_API_RETRY_BACKOFF', '1'))  # 再試行間隔の基準（秒）
+CLAUDE_API_RETRY_BACKOFF_MAX = float(os.getenv('CLAUDE_API_RETRY_BACKOFF_MAX', '20'))  # 再試行間隔の上限（秒）
+CLAUDE_API_MAX_CONCURRENCY = int(os.getenv('CLAUDE_API_MAX_CONCURRENCY', '4'))  # プロセスあたりの同時リクエスト数
+CLAUDE_API_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CLAUDE_API_CIRCUIT_FAILURE_THRESHOLD', '5'))  # 連続失敗回数
+CLAUDE_API_CIRCUIT_RESET_TIMEOUT = float(os.getenv('CLAUDE_API_CIRCUIT_RESET_TIMEOUT', '30'))  # 呼び出し停止時間（秒）
+
+# Message Batches APIによるまとめて処理（manage.py process_claude_batches）
+CLAUDE_BATCH_API_URL = os.getenv('CLAUDE_BATCH_API_URL', 'https://api.anthropic.com/v1/messages/batches')
+CLAUDE_BATCH_MAX_REQUESTS = int(os.getenv('CLAUDE_BATCH_MAX_REQUESTS', '500'))  # 1バッチに含める最大件数
+CLAUDE_BATCH_MAX_BYTES = int(os.getenv('CLAUDE_BATCH_MAX_BYTES', str(200 * 1024 * 1024)))  # 1バッチのリクエストの合計サイズの上限（バイト）
+CLAUDE_BATCH_MAX_PREPARE_FAILURES = int(os.getenv('CLAUDE_BATCH_MAX_PREPARE_FAILURES', '3'))  # この回数登録に失敗したファイルは対象外にする
+CLAUDE_BATCH_POLL_INTERVAL = float(os.getenv('CLAUDE_BATCH_POLL_INTERVAL', '60'))  # 完了確認の間隔（秒）
+
+# 帳票処理の進捗ストリーム（SSE）
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))  # 進捗が無い間のkeep-alive送信間隔（秒）
+STREAM_TICKET_TTL = int(os.getenv('STREAM_TICKET_TTL', '30'))  # 接続用チケットの有効期間（秒、1回限り有効）
+
+# 複数の帳票の一括処理（uploads/process-bulk/）
+BULK_PROCESS_MAX_UPLOADS = int(os.getenv('BULK_PROCESS_MAX_UPLOADS', '100'))  # 1リクエストで登録できる件数
+
+# アップロードのプレビュー（サムネイル）
+PREVIEW_CACHE_ROOT = Path(os.getenv('PREVIEW_CACHE_ROOT', str(MEDIA_ROOT / 'previews')))
+PREVIEW_JPEG_QUALITY = int(os.getenv('PREVIEW_JPEG_QUALITY', '80'))
+PREVIEW_PREGENERATE = os.getenv('PREVIEW_PREGENERATE', 'True').lower() == 'true'  # アップロード後にバックグラウンドで作成する
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', '2'))  # バックグラウンド作成のスレッド数
+PREVIEW_CACHE_MAX_AGE = int(os.getenv('PREVIEW_CACHE_MAX_AGE', str(365 * 24 * 60 * 60)))  # ブラウザでのキャッシュ期間（秒）
+
+# 近くのドライバー検索（drivers/nearest/）
+DRIVER_LOCATION_SNAPSHOT_TTL = float(os.getenv('DRIVER_LOCATION_SNAPSHOT_TTL', '10'))  # 位置のスナップショットを作り直す間隔（秒）
+NEAREST_DRIVERS_DEFAULT_LIMIT = int(os.getenv('NEAREST_DRIVERS_DEFAULT_LIMIT', '20'))
+NEAREST_DRIVERS_MAX_LIMIT = int(os.getenv('NEAREST_DRIVERS_MAX_LIMIT', '100'))
+
+# ドライバーの位置情報の受信（driver-location/）
+# 受信した位置はワーカーのメモリに保持して一定間隔で書き戻すため、ワーカーが異常終了した場合は
+# 最大で書き戻し間隔分の位置が失われる（通常の終了・再起動時は終了時に書き戻す）。
+DRIVER_LOCATION_FLUSH_INTERVAL = float(os.getenv('DRIVER_LOCATION_FLUSH_INTERVAL', '5'))  # DBへ書き戻す間隔（秒、0以下はその場で書き戻す）
+DRIVER_LOCATION_MAX_POINTS = int(os.getenv('DRIVER_LOCATION_MAX_POINTS', '100'))  # 1リクエストで送れる位置の件数
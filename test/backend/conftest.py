@@ -1,5 +1,6 @@
 import os
 import sys
+import mimetypes
 import pytest
 
 # プロジェクトのバックエンドディレクトリをPythonパスに追加
@@ -20,6 +21,7 @@ from django.contrib.auth import get_user_model
 from apps.users.models import DriverProfile
 from apps.delivery.models import DeliveryRequest, Assignment
 from apps.files.models import FileUpload
+from apps.files.storage import get_blob_store
 
 User = get_user_model()
 
@@ -109,6 +111,26 @@ def create_driver(db):
     return _create_driver
 
 
+@pytest.fixture
+def create_file_upload(db):
+    """ファイルアップロード作成ヘルパー（内容はBLOBストアに保存する）
+
+    content=None の場合はBLOBを作らない（file_data などは kwargs で指定する）。
+    """
+    def _create_file_upload(user, content=b'test', name='slip.jpg', mime_type=None, **kwargs):
+        if content is not None:
+            content_hash, file_size = get_blob_store().save([content])
+            kwargs.setdefault('content_hash', content_hash)
+            kwargs.setdefault('file_size', file_size)
+        return FileUpload.objects.create(
+            uploader=user,
+            original_name=name,
+            mime_type=mime_type or mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            **kwargs
+        )
+    return _create_file_upload
+
+
 @pytest.fixture
 def authenticated_client(api_client, create_user):
     """認証済みクライアント"""
@@ -218,8 +240,15 @@ def use_test_settings():
             }
         },
         CLAUDE_API_KEY='test-api-key',
+        CLAUDE_API_RETRY_BACKOFF=0,
         EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
         MEDIA_ROOT='/tmp/test_media',
+        BLOB_STORAGE_BACKEND='local',
+        BLOB_STORAGE_ROOT='/tmp/test_media/blobs',
+        CHUNKED_UPLOAD_ROOT='/tmp/test_media/chunked_uploads',
+        IMAGE_PREPROCESS_CACHE_ROOT='/tmp/test_media/preprocessed_images',
+        PREVIEW_CACHE_ROOT='/tmp/test_media/previews',
+        PREVIEW_PREGENERATE=False,
         CELERY_ALWAYS_EAGER=True
     ):
         yield
\ No newline at end of file
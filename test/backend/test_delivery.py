@@ -1,5 +1,10 @@
 import pytest
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from apps.delivery.models import DeliveryRequest, Assignment
 from datetime import date
@@ -366,4 +371,141 @@ class TestDeliveryAssignment:
         data = {'status': 'in_progress'}
         response = client.post(url, data, format='json')
         
-        assert response.status_code == status.HTTP_403_FORBIDDEN
\ No newline at end of file
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+@pytest.mark.django_db
+class TestDeliveryListQueryCount:
+    """配送依頼・アサイン一覧のクエリ数のテスト（件数に関わらず一定）"""
+
+    def _create_assigned_requests(self, requester, create_driver, delivery_request_data, count):
+        for i in range(count):
+            delivery_request = DeliveryRequest.objects.create(
+                requester=requester, status='assigned', **delivery_request_data
+            )
+            # 過去のアサイン（拒否）と現在のアサインを作成
+            Assignment.objects.create(delivery_request=delivery_request, driver=create_driver(), status='rejected')
+            Assignment.objects.create(delivery_request=delivery_request, driver=create_driver(), status='accepted')
+
+    def test_delivery_request_list(self, authenticated_client, create_driver, delivery_request_data,
+                                   django_assert_num_queries):
+        """配送依頼一覧が 件数 + 一覧 + アサイン の3クエリで取得でき、割り当て済みドライバーを返すテスト"""
+        client, user = authenticated_client
+        self._create_assigned_requests(user, create_driver, delivery_request_data, 10)
+
+        with django_assert_num_queries(3):
+            response = client.get(reverse('delivery-request-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 10
+        for row in response.data['results']:
+            assignment = Assignment.objects.get(delivery_request_id=row['id'], status='accepted')
+            assert row['assigned_driver']['id'] == assignment.driver_id
+            assert row['requester'] == str(user)
+
+    def test_delivery_request_detail_matches_list(self, authenticated_client, create_driver, delivery_request_data):
+        """詳細APIでも同じ割り当て済みドライバーを返すテスト"""
+        client, user = authenticated_client
+        self._create_assigned_requests(user, create_driver, delivery_request_data, 1)
+        delivery_request = DeliveryRequest.objects.get(requester=user)
+
+        response = client.get(reverse('delivery-request-detail', kwargs={'pk': delivery_request.id}))
+
+        expected = Assignment.objects.get(delivery_request=delivery_request, status='accepted').driver
+        assert response.data['assigned_driver']['id'] == expected.id
+        assert response.data['assigned_driver']['full_name'] == (expected.get_full_name() or expected.username)
+
+    def test_assignment_list(self, authenticated_client, create_driver, delivery_request_data,
+                             django_assert_num_queries):
+        """アサイン一覧が 件数 + 一覧 の2クエリで取得できるテスト"""
+        client, user = authenticated_client
+        self._create_assigned_requests(user, create_driver, delivery_request_data, 10)
+
+        with django_assert_num_queries(2):
+            response = client.get(reverse('assignment-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 20
+        row = response.data['results'][0]
+        assert row['delivery_request']['title'] == delivery_request_data['title']
+        assert row['driver']['username'].startswith('testdriver')
+
+
+@pytest.mark.django_db
+class TestExplainHotQueries:
+    """主要クエリの実行計画を確認するコマンドのテスト"""
+
+    def test_explain_hot_queries(self):
+        """シードデータで各クエリの実行計画を表示し、シードデータを残さないテスト"""
+        out = StringIO()
+        call_command('explain_hot_queries', requests=200, stdout=out)
+
+        output = out.getvalue()
+        for name in ['driver_feed', 'company_list', 'driver_active_assignments',
+                     'request_active_assignment', 'assigned_driver_prefetch']:
+            assert f'== {name}' in output
+        assert not DeliveryRequest.objects.exists()
+        assert not Assignment.objects.exists()
+
+
+@pytest.mark.django_db
+class TestCursorPagination:
+    """一覧APIのカーソル（キーセット）ページネーションのテスト"""
+
+    def _create_requests(self, requester, delivery_request_data, count):
+        for i in range(count):
+            DeliveryRequest.objects.create(requester=requester, **delivery_request_data)
+        # 作成日時が同じ行もページをまたいで重複・欠落しないこと
+        same_time = timezone.now()
+        DeliveryRequest.objects.filter(pk__in=DeliveryRequest.objects.order_by('pk').values('pk')[5:15]).update(
+            created_at=same_time
+        )
+
+    def test_walk_pages(self, authenticated_client, delivery_request_data):
+        """next / previous をたどると (created_at, id) の降順で全件を1回ずつ返すテスト"""
+        client, user = authenticated_client
+        self._create_requests(user, delivery_request_data, 45)
+        expected = list(
+            DeliveryRequest.objects.filter(requester=user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+        pages = []
+        url = reverse('delivery-request-list') + '?pagination=cursor'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            assert 'count' not in response.data
+            assert isinstance(response.data['estimated_count'], int)
+            # 正確な件数・OFFSETのクエリを実行しない
+            assert all('COUNT(' not in query['sql'] and 'OFFSET' not in query['sql'] for query in queries)
+            pages.append(response.data)
+            url = response.data['next']
+
+        assert [len(page['results']) for page in pages] == [20, 20, 5]
+        assert [row['id'] for page in pages for row in page['results']] == expected
+        assert pages[0]['previous'] is None
+
+        # 前のページに戻る
+        previous = client.get(pages[2]['previous']).data
+        assert [row['id'] for row in previous['results']] == expected[20:40]
+        first = client.get(previous['previous']).data
+        assert [row['id'] for row in first['results']] == expected[:20]
+        assert first['previous'] is None
+
+    def test_page_number_is_default(self, authenticated_client, delivery_request_data):
+        """指定しない場合は従来どおりページ番号のページネーションのテスト"""
+        client, user = authenticated_client
+        self._create_requests(user, delivery_request_data, 25)
+
+        response = client.get(reverse('delivery-request-list'), {'page': 2})
+
+        assert response.data['count'] == 25
+        assert len(response.data['results']) == 5
+
+    def test_invalid_cursor(self, authenticated_client):
+        """不正なカーソルは404を返すテスト"""
+        client, user = authenticated_client
+
+        response = client.get(reverse('assignment-list'), {'cursor': 'invalid'})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
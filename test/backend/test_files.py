@@ -1,11 +1,33 @@
 import pytest
 import os
 import json
-from unittest.mock import patch, Mock
+import base64
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import MagicMock, patch, Mock
+import fitz
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
-from apps.files.models import FileUpload
+from rest_framework_simplejwt.tokens import RefreshToken
+from apps.files.models import ClaudeBatch, FileUpload, ProcessingJob
+from apps.files.jobs import UploadInBatchError, enqueue_processing_job, claim_next_job, run_job
+from apps.files.batches import pending_uploads, submit_batch
+from apps.files import pdf_extraction
+from apps.files.pdf_extraction import extract_pdf
+from apps.files.image_preprocessing import preprocess_image_cached
+from apps.files.processing import prepare_claude_request, process_file_content, select_request_images
+from apps.files.local_extraction import extract_locally, is_confident
+from apps.files.claude_client import CircuitOpenError, ClaudeClient, get_claude_client
+from apps.files.previews import preview_cache_path
+from apps.files.storage import LocalBlobStore, S3BlobStore, get_blob_store, open_upload_content
 from apps.delivery.models import DeliveryRequest
 
 
@@ -163,7 +185,7 @@ class TestFileUpload:
 class TestClaudeAPIIntegration:
     """Claude API連携のテスト"""
 
-    @patch('apps.files.views.requests.post')
+    @patch('apps.files.claude_client.requests.Session.post')
     def test_process_with_claude_success(self, mock_post, authenticated_client, mock_claude_response, sample_extracted_data):
         """Claude API処理成功のテスト"""
         client, user = authenticated_client
@@ -205,7 +227,7 @@ class TestClaudeAPIIntegration:
         assert 'x-api-key' in call_args[1]['headers']
         assert call_args[1]['headers']['x-api-key'] == 'test-api-key'
 
-    @patch('apps.files.views.requests.post')
+    @patch('apps.files.claude_client.requests.Session.post')
     def test_process_with_claude_api_error(self, mock_post, authenticated_client):
         """Claude API エラーのテスト"""
         client, user = authenticated_client
@@ -261,7 +283,7 @@ class TestClaudeAPIIntegration:
         
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
-    @patch('apps.files.views.requests.post')
+    @patch('apps.files.claude_client.requests.Session.post')
     def test_process_with_claude_json_parse_error(self, mock_post, authenticated_client):
         """Claude APIレスポンスのJSON解析エラーテスト"""
         client, user = authenticated_client
@@ -398,4 +420,2021 @@ class TestDeliveryFromFile:
         url = reverse('create-delivery-from-file', kwargs={'pk': 99999})
         response = client.post(url)
         
-        assert response.status_code == status.HTTP_404_NOT_FOUND
\ No newline at end of file
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db(transaction=True)
+class TestProcessingJobs:
+    """帳票処理ジョブ（非同期処理）のテスト"""
+
+    def test_process_async_enqueues_job(self, authenticated_client, create_file_upload):
+        """非同期処理APIがジョブを登録してジョブIDを返すテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+
+        url = reverse('process-with-claude-async', kwargs={'pk': file_upload.id})
+        response = client.post(url)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job = ProcessingJob.objects.get(id=response.data['job_id'])
+        assert job.status == 'queued'
+        assert job.file_upload == file_upload
+
+        # 同じファイルを再度登録しても既存ジョブが返る
+        response = client.post(url)
+        assert response.data['job_id'] == job.id
+        assert ProcessingJob.objects.count() == 1
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_worker_processes_job(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """ワーカーがジョブを取得・処理し、ポーリングAPIで結果が取れるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+        job, _ = enqueue_processing_job(file_upload, user)
+
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_claude_response
+        mock_post.return_value = mock_response
+
+        call_command('process_ocr_jobs', once=True, stdout=StringIO())
+
+        job.refresh_from_db()
+        file_upload.refresh_from_db()
+        assert job.status == 'succeeded'
+        assert job.attempts == 1
+        assert file_upload.is_processed is True
+
+        url = reverse('processing-job-detail', kwargs={'pk': job.id})
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == 'succeeded'
+        assert response.data['result']['extracted_data']['sender_name'] == '山田太郎'
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_worker_requeues_on_api_error(self, mock_post, authenticated_client, create_file_upload):
+        """Claude APIエラー時にジョブが再試行待ちに戻るテスト"""
+        client, user = authenticated_client
+        job, _ = enqueue_processing_job(create_file_upload(user), user)
+
+        mock_response = Mock()
+        mock_response.status_code = 529
+        mock_response.text = 'Overloaded'
+        mock_post.return_value = mock_response
+
+        run_job(claim_next_job('test-worker'))
+
+        job.refresh_from_db()
+        assert job.status == 'queued'
+        assert job.run_after > timezone.now()
+        # 実行可能時刻までは取得されない
+        assert claim_next_job('test-worker') is None
+
+    def test_claim_skips_locked_job(self, authenticated_client, create_file_upload):
+        """ロック中のジョブを他のワーカーが取得しないテスト"""
+        client, user = authenticated_client
+        job, _ = enqueue_processing_job(create_file_upload(user), user)
+
+        def claim_in_other_connection(results):
+            try:
+                results.append(claim_next_job('other-worker'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            ProcessingJob.objects.select_for_update().get(pk=job.pk)
+            results = []
+            thread = threading.Thread(target=claim_in_other_connection, args=(results,))
+            thread.start()
+            thread.join()
+
+        assert results == [None]
+        assert claim_next_job('test-worker').pk == job.pk
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_job_skips_processed_upload(self, mock_post, authenticated_client, create_file_upload):
+        """処理済みのファイルのジョブはClaude APIを呼ばずに成功とするテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+        job, _ = enqueue_processing_job(file_upload, user)
+        FileUpload.objects.filter(pk=file_upload.pk).update(is_processed=True, extracted_data={'sender_name': '山田太郎'})
+
+        run_job(claim_next_job('test-worker'))
+
+        job.refresh_from_db()
+        assert job.status == 'succeeded'
+        assert job.result['already_processed'] is True
+        mock_post.assert_not_called()
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_claimed_upload_is_not_processed_twice(self, mock_post, authenticated_client, create_file_upload):
+        """ジョブが処理中のファイルは同期処理APIが409を返し、ジョブは試行回数を消費せずに待機に戻るテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+        FileUpload.objects.filter(pk=file_upload.pk).update(processing_started_at=timezone.now())
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+        job, _ = enqueue_processing_job(file_upload, user)
+        run_job(claim_next_job('test-worker'))
+        job.refresh_from_db()
+        assert job.status == 'queued'
+        assert job.attempts == 0
+        mock_post.assert_not_called()
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_no_transaction_during_claude_call(self, mock_post, authenticated_client, mock_claude_response,
+                                               settings, create_file_upload):
+        """Claude APIの呼び出し中はトランザクション・行ロックを保持せず、期限切れの処理中の印は引き継ぐテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+        expired = timezone.now() - timedelta(seconds=settings.FILE_PROCESSING_CLAIM_TIMEOUT + 1)
+        FileUpload.objects.filter(pk=file_upload.pk).update(processing_started_at=expired)
+        states = []
+
+        def post(*args, **kwargs):
+            claimed = FileUpload.objects.get(pk=file_upload.pk)
+            states.append((connection.in_atomic_block, claimed.processing_started_at > expired))
+            return claude_http_response(200, mock_claude_response)
+
+        mock_post.side_effect = post
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert states == [(False, True)]
+        file_upload.refresh_from_db()
+        assert file_upload.is_processed
+        assert file_upload.processing_started_at is None
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_result_is_not_overwritten(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """Claude APIの呼び出し中に別の処理で処理済みになった場合は結果を上書きしないテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user)
+
+        def post(*args, **kwargs):
+            FileUpload.objects.filter(pk=file_upload.pk).update(
+                is_processed=True, processing_source='claude_batch', extracted_data={'sender_name': '別の結果'}
+            )
+            return claude_http_response(200, mock_claude_response)
+
+        mock_post.side_effect = post
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.data['already_processed'] is True
+        file_upload.refresh_from_db()
+        assert file_upload.processing_source == 'claude_batch'
+        assert file_upload.extracted_data == {'sender_name': '別の結果'}
+
+    def test_job_detail_other_user(self, authenticated_client, create_user, create_file_upload):
+        """他人のジョブは参照できないテスト"""
+        client, user = authenticated_client
+        other_user = create_user()
+        job, _ = enqueue_processing_job(create_file_upload(other_user), other_user)
+
+        url = reverse('processing-job-detail', kwargs={'pk': job.id})
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class FakeS3Client:
+    """S3互換サーバーの代わりに使うインメモリクライアント"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def get_object(self, Bucket, Key, Range=None):
+        content = self.objects[(Bucket, Key)]
+        if Range:
+            content = content[int(Range[len('bytes='):].rstrip('-')):]
+        return {'Body': BytesIO(content)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(Key)
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.mark.django_db
+class TestBlobStorage:
+    """BLOBストアのテスト"""
+
+    def test_local_store_is_content_addressed(self, tmp_path):
+        """同一内容は同じキー（SHA-256）で1つだけ保存されるテスト"""
+        store = LocalBlobStore(tmp_path)
+        content = b'delivery slip content'
+
+        key, size = store.save([content[:5], content[5:]])
+        same_key, _ = store.save([content])
+
+        assert key == hashlib.sha256(content).hexdigest()
+        assert same_key == key
+        assert size == len(content)
+        with store.open(key) as f:
+            assert f.read() == content
+        assert len([p for p in tmp_path.rglob('*') if p.is_file()]) == 1
+
+    def test_s3_store_with_stand_in_client(self):
+        """S3互換バックエンドのテスト（スタンドインクライアント使用）"""
+        client = FakeS3Client()
+        store = S3BlobStore(bucket='test-bucket', prefix='uploads', client=client)
+
+        key, size = store.save([b'abc', b'def'])
+
+        assert ('test-bucket', f'uploads/{key}') in client.objects
+        assert store.exists(key)
+        assert store.size(key) == size == 6
+        assert store.open(key).read() == b'abcdef'
+        assert store.path(key) is None
+
+    def test_upload_stores_reference_only(self, authenticated_client):
+        """アップロード時にBLOBストアに保存され、DBには参照のみ保存されるテスト"""
+        client, user = authenticated_client
+        file_content = b'%PDF-1.4 test content'
+
+        url = reverse('file-upload-list')
+        uploaded_file = SimpleUploadedFile('slip.pdf', file_content, content_type='application/pdf')
+        response = client.post(url, {'file': uploaded_file}, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        file_upload = FileUpload.objects.get(id=response.data['id'])
+        assert file_upload.file_data is None
+        assert file_upload.content_hash == hashlib.sha256(file_content).hexdigest()
+        with open_upload_content(file_upload) as f:
+            assert f.read() == file_content
+
+    def test_migrate_file_data_to_blobs(self, authenticated_client):
+        """旧形式のBase64データをBLOBストアへ移行するコマンドのテスト"""
+        client, user = authenticated_client
+        contents = [f'legacy file {i}'.encode() for i in range(5)]
+        uploads = [
+            FileUpload.objects.create(
+                uploader=user,
+                original_name=f'legacy{i}.jpg',
+                file_data=base64.b64encode(content).decode('utf-8'),
+                file_size=len(content),
+                mime_type='image/jpeg'
+            )
+            for i, content in enumerate(contents)
+        ]
+
+        call_command('migrate_file_data_to_blobs', batch_size=2, stdout=StringIO())
+
+        for file_upload, content in zip(uploads, contents):
+            file_upload.refresh_from_db()
+            assert file_upload.file_data is None
+            assert file_upload.content_hash == hashlib.sha256(content).hexdigest()
+            with open_upload_content(file_upload) as f:
+                assert f.read() == content
+
+
+@pytest.mark.django_db
+class TestFileDownload:
+    """ファイルダウンロード（ストリーミング・Range・ETag）のテスト"""
+
+    content = bytes(range(256)) * 20
+
+    def test_download_streams_full_file(self, authenticated_client, create_file_upload):
+        """ファイル全体をストリーミングで返すテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, self.content, name='伝票.pdf')
+
+        url = reverse('download-file', kwargs={'pk': file_upload.id})
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert b''.join(response.streaming_content) == self.content
+        assert response['Content-Length'] == str(len(self.content))
+        assert response['ETag'] == f'"{file_upload.content_hash}"'
+        assert response['Accept-Ranges'] == 'bytes'
+
+    def test_download_range(self, authenticated_client, create_file_upload):
+        """Rangeリクエストで部分取得できるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, self.content, name='伝票.pdf')
+        url = reverse('download-file', kwargs={'pk': file_upload.id})
+
+        response = client.get(url, HTTP_RANGE='bytes=100-199')
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert b''.join(response.streaming_content) == self.content[100:200]
+        assert response['Content-Range'] == f'bytes 100-199/{len(self.content)}'
+
+        # 途中からの再開（bytes=N-）と末尾指定（bytes=-N）
+        response = client.get(url, HTTP_RANGE='bytes=5000-')
+        assert b''.join(response.streaming_content) == self.content[5000:]
+        response = client.get(url, HTTP_RANGE='bytes=-10')
+        assert b''.join(response.streaming_content) == self.content[-10:]
+
+        # 範囲外
+        response = client.get(url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+    def test_download_if_none_match(self, authenticated_client, create_file_upload):
+        """ETagが一致する場合に304を返すテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, self.content, name='伝票.pdf')
+
+        url = reverse('download-file', kwargs={'pk': file_upload.id})
+        response = client.get(url, HTTP_IF_NONE_MATCH=f'"{file_upload.content_hash}"')
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_download_x_accel_redirect(self, authenticated_client, settings, create_file_upload):
+        """X-Accel-Redirectモードでプロキシに配信を任せるテスト"""
+        settings.FILE_DOWNLOAD_ACCEL_MODE = 'x-accel-redirect'
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, self.content, name='伝票.pdf')
+
+        url = reverse('download-file', kwargs={'pk': file_upload.id})
+        response = client.get(url)
+
+        key = file_upload.content_hash
+        assert response.status_code == status.HTTP_200_OK
+        assert response['X-Accel-Redirect'] == f'/protected-blobs/{key[:2]}/{key[2:4]}/{key}'
+        assert response.content == b''
+
+
+@pytest.mark.django_db
+class TestChunkedUpload:
+    """分割アップロード（レジューム可能）のテスト"""
+
+    content = os.urandom(25 * 1024)
+
+    def _start_session(self, client, total_size=None):
+        url = reverse('upload-session-create')
+        data = {
+            'original_name': 'manifest.pdf',
+            'mime_type': 'application/pdf',
+            'total_size': total_size or len(self.content)
+        }
+        return client.post(url, data, format='json')
+
+    def _put_chunk(self, client, session_id, offset, chunk):
+        url = reverse('upload-session-detail', kwargs={'pk': session_id})
+        return client.put(f'{url}?offset={offset}', chunk, content_type='application/octet-stream')
+
+    def test_chunked_upload_and_finalize(self, authenticated_client):
+        """チャンク送信→完了でFileUploadが作成されるテスト"""
+        client, user = authenticated_client
+        response = self._start_session(client)
+        assert response.status_code == status.HTTP_201_CREATED
+        session_id = response.data['id']
+
+        chunk_size = 10 * 1024
+        for offset in range(0, len(self.content), chunk_size):
+            response = self._put_chunk(client, session_id, offset, self.content[offset:offset + chunk_size])
+            assert response.status_code == status.HTTP_200_OK
+        assert response.data['received_size'] == len(self.content)
+
+        url = reverse('upload-session-finalize', kwargs={'pk': session_id})
+        response = client.post(url, {'sha256': hashlib.sha256(self.content).hexdigest()}, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        file_upload = FileUpload.objects.get(id=response.data['id'])
+        assert file_upload.uploader == user
+        assert file_upload.file_size == len(self.content)
+        with open_upload_content(file_upload) as f:
+            assert f.read() == self.content
+        assert not os.path.exists(f'/tmp/test_media/chunked_uploads/{session_id}.part')
+
+    def test_resume_after_interruption(self, authenticated_client):
+        """オフセット不一致時に現在位置を返し、そこから再開できるテスト"""
+        client, user = authenticated_client
+        session_id = self._start_session(client).data['id']
+
+        self._put_chunk(client, session_id, 0, self.content[:10000])
+
+        # 失敗したと思い込んで先のオフセットから送った場合
+        response = self._put_chunk(client, session_id, 20000, self.content[20000:])
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['received_size'] == 10000
+
+        # 受信状況を確認して再開
+        response = client.get(reverse('upload-session-detail', kwargs={'pk': session_id}))
+        offset = response.data['received_size']
+        response = self._put_chunk(client, session_id, offset, self.content[offset:])
+        assert response.data['received_size'] == len(self.content)
+
+        # 全データ受信後は完了できる
+        url = reverse('upload-session-finalize', kwargs={'pk': session_id})
+        response = client.post(url)
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_finalize_incomplete_upload(self, authenticated_client):
+        """全データ受信前の完了APIは失敗するテスト"""
+        client, user = authenticated_client
+        session_id = self._start_session(client).data['id']
+        self._put_chunk(client, session_id, 0, self.content[:100])
+
+        url = reverse('upload-session-finalize', kwargs={'pk': session_id})
+        response = client.post(url)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not FileUpload.objects.exists()
+
+    def test_total_size_limit(self, authenticated_client, settings):
+        """FILE_UPLOAD_MAX_SIZE を超えるファイルは受け付けないテスト"""
+        settings.FILE_UPLOAD_MAX_SIZE = 1024 * 1024
+        client, user = authenticated_client
+
+        response = self._start_session(client, total_size=2 * 1024 * 1024)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestProcessingResultReuse:
+    """同一内容ファイルの処理結果再利用のテスト"""
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_reuse_processed_result(self, mock_post, authenticated_client, sample_extracted_data, create_file_upload):
+        """同じ内容の処理済みファイルがあればClaude APIを呼ばずに結果を返すテスト"""
+        client, user = authenticated_client
+        processed = create_file_upload(
+            user, b'same slip content', is_processed=True, processing_source='claude',
+            extracted_data=sample_extracted_data, claude_response={'id': 'msg_cached'}
+        )
+        duplicate = create_file_upload(user, b'same slip content')
+
+        url = reverse('process-with-claude', kwargs={'pk': duplicate.id})
+        response = client.post(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['cached'] is True
+        assert response.data['source_upload_id'] == processed.id
+        assert response.data['extracted_data'] == sample_extracted_data
+        mock_post.assert_not_called()
+
+        duplicate.refresh_from_db()
+        assert duplicate.is_processed is True
+        assert duplicate.processing_source == 'cache'
+        assert duplicate.claude_response == {'id': 'msg_cached'}
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_no_reuse_across_users(self, mock_post, authenticated_client, create_user, sample_extracted_data, create_file_upload):
+        """他の事業者の処理結果は再利用しないテスト"""
+        client, user = authenticated_client
+        other_user = create_user()
+        create_file_upload(other_user, b'same slip content', is_processed=True, extracted_data=sample_extracted_data)
+        own_upload = create_file_upload(user, b'same slip content')
+
+        mock_response = Mock()
+        mock_response.status_code = 500
+        mock_response.text = 'error'
+        mock_post.return_value = mock_response
+
+        url = reverse('process-with-claude', kwargs={'pk': own_upload.id})
+        response = client.post(url)
+
+        assert mock_post.called
+        assert 'cached' not in response.data
+
+    def test_processing_stats(self, authenticated_client, sample_extracted_data, create_file_upload):
+        """処理統計APIでキャッシュヒット数（API呼び出し削減数）が取れるテスト"""
+        client, user = authenticated_client
+        create_file_upload(user, b'same slip content', is_processed=True, processing_source='claude', extracted_data=sample_extracted_data)
+        create_file_upload(user, b'same slip content', is_processed=True, processing_source='cache', extracted_data=sample_extracted_data)
+        create_file_upload(user, b'same slip content', is_processed=True, processing_source='cache', extracted_data=sample_extracted_data)
+
+        response = client.get(reverse('processing-stats'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['cache_hits'] == 2
+        assert response.data['cache_misses'] == 1
+        assert response.data['api_calls_saved'] == 2
+
+
+def build_pdf(page_texts=(), image_pages=0):
+    """テスト用PDFを作成（テキストページ＋表、画像のみのページ）"""
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+        for row in range(2):
+            for col in range(2):
+                page.draw_rect(fitz.Rect(72 + col * 100, 150 + row * 30, 172 + col * 100, 180 + row * 30))
+                page.insert_text((80 + col * 100, 170 + row * 30), f'r{row}c{col}')
+    for i in range(image_pages):
+        page = doc.new_page()
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 60 + i, 40), False)
+        pix.clear_with(200)
+        page.insert_image(page.rect, pixmap=pix)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class TestPdfExtraction:
+    """PDF抽出エンジンのテスト"""
+
+    def test_text_based_pdf(self):
+        """テキストベースPDFからテキスト・表・ページごとの処理時間が取れるテスト"""
+        result = extract_pdf(build_pdf(['sender: Yamada Taro 03-1111-2222 Tokyo Minato-ku 1-1-1', 'page two text']))
+
+        assert result['type'] == 'text_based_pdf'
+        assert result['has_tables'] is True
+        assert [table['page'] for table in result['tables']] == [1, 2]
+        assert '--- ページ 1 ---' in result['text']
+        assert 'r0c0 | r0c1' in result['text']
+        assert [timing['page'] for timing in result['page_timings']] == [1, 2]
+
+    def test_image_based_pdf(self):
+        """画像ベースPDFと判定され画像が抽出されるテスト"""
+        result = extract_pdf(build_pdf(image_pages=2))
+
+        assert result['type'] == 'image_based_pdf'
+        assert [image['page'] for image in result['images']] == [1, 2]
+        assert base64.b64decode(result['images'][0]['data']).startswith(b'\x89PNG')
+
+    def test_invalid_pdf(self):
+        """壊れたPDFの場合はエラーメッセージを返すテスト"""
+        result = extract_pdf(b'not a pdf')
+
+        assert isinstance(result, str)
+        assert 'PDF読み取りエラー' in result
+
+    @pytest.mark.django_db
+    def test_process_stored_pdf_without_temp_file(self, create_user):
+        """BLOBストアのPDFを一時ファイルを作らずに処理するテスト"""
+        user = create_user()
+        content_hash, file_size = get_blob_store().save([build_pdf(['delivery slip text for extraction test'])])
+        file_upload = FileUpload.objects.create(
+            uploader=user,
+            original_name='slip.pdf',
+            content_hash=content_hash,
+            file_size=file_size,
+            mime_type='application/pdf'
+        )
+
+        with patch('tempfile.NamedTemporaryFile') as mock_tempfile:
+            content = process_file_content(file_upload)
+
+        mock_tempfile.assert_not_called()
+        assert content['type'] == 'text'
+        assert 'delivery slip text' in content['content']
+
+    def test_parallel_extraction_matches_inline(self, settings):
+        """ページ並列処理の結果がインライン処理とページ順まで一致するテスト"""
+        data = build_pdf([f'page {i} delivery manifest line item text' for i in range(6)], image_pages=0)
+
+        settings.PDF_EXTRACTION_WORKERS = 1
+        inline_result = extract_pdf(data)
+
+        settings.PDF_EXTRACTION_WORKERS = 2
+        settings.PDF_PARALLEL_MIN_PAGES = 2
+        executor = pdf_extraction._get_executor()
+        with patch('apps.files.pdf_extraction._extract_pages_parallel', wraps=pdf_extraction._extract_pages_parallel) as mock_parallel, \
+                patch.object(executor, 'submit', wraps=executor.submit) as mock_submit:
+            parallel_result = extract_pdf(data)
+
+        mock_parallel.assert_called_once()
+        # ワーカーにはPDFのバイト列ではなく一時ファイルのパスを渡し、処理後に削除する
+        paths = {call.args[1] for call in mock_submit.call_args_list}
+        assert len(paths) == 1
+        path = paths.pop()
+        assert isinstance(path, str)
+        assert not os.path.exists(path)
+        assert parallel_result['text'] == inline_result['text']
+        assert parallel_result['tables'] == inline_result['tables']
+        assert [timing['page'] for timing in parallel_result['page_timings']] == list(range(1, 7))
+
+    def _open_image_pdf(self, image_pages):
+        data = build_pdf(image_pages=image_pages)
+        doc = fitz.open(stream=data, filetype='pdf')
+        pages = [pdf_extraction._extract_page(page, i + 1) for i, page in enumerate(doc)]
+        return doc, pages
+
+    def test_page_images_are_lazy_and_bounded(self):
+        """画像は遅延生成され、最大ページ数で打ち切られるテスト"""
+        doc, pages = self._open_image_pdf(5)
+
+        generator = pdf_extraction.iter_page_images(doc, pages, max_pages=2, min_area=0, dpi=72, pixel_budget=10 ** 8)
+        first = next(generator)
+        assert first['page'] == 1
+        assert first['source'] == 'embedded'
+        assert [image['page'] for image in generator] == [2]
+
+    def test_small_images_fall_back_to_rasterize(self):
+        """小さな埋め込み画像しか無いページはラスタライズされるテスト"""
+        doc, pages = self._open_image_pdf(1)
+
+        images = list(pdf_extraction.iter_page_images(doc, pages, max_pages=1, min_area=10 ** 6, dpi=72, pixel_budget=10 ** 8))
+
+        assert images[0]['source'] == 'raster'
+        assert images[0]['width'] == round(doc[0].rect.width)
+
+    def test_pixel_budget(self):
+        """合計ピクセル数の上限を超えないよう縮小・打ち切りされるテスト"""
+        doc, pages = self._open_image_pdf(3)
+        budget = 600 * 800
+
+        images = list(pdf_extraction.iter_page_images(doc, pages, max_pages=3, min_area=10 ** 6, dpi=150, pixel_budget=budget))
+
+        assert images
+        assert sum(image['width'] * image['height'] for image in images) <= budget
+
+    def test_large_embedded_image_is_rendered_within_budget(self):
+        """予算を超える埋め込み画像は予算内の倍率で描画し、最小の解像度でも収まらない場合は追加しないテスト"""
+        doc = fitz.open()
+        page = doc.new_page()
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 2000, 1500), False)
+        pix.clear_with(200)
+        page.insert_image(page.rect, pixmap=pix)
+        pages = [pdf_extraction._extract_page(page, 1)]
+        budget = 400 * 400
+
+        images = list(pdf_extraction.iter_page_images(doc, pages, max_pages=1, min_area=0, dpi=150, pixel_budget=budget))
+
+        assert len(images) == 1
+        assert images[0]['source'] == 'embedded'
+        assert budget * 0.9 < images[0]['width'] * images[0]['height'] <= budget
+
+        # 最小の解像度（MIN_RENDER_DPI）で描画しても予算を超える場合は終了する
+        assert list(pdf_extraction.iter_page_images(doc, pages, max_pages=1, min_area=0, dpi=150, pixel_budget=1000)) == []
+
+
+def build_image(size=(3000, 2000), exif_orientation=None, image_format='PNG'):
+    """テスト用画像を作成（EXIFの向き情報を付与可能）"""
+    from PIL import Image
+    image = Image.new('RGB', size, (200, 120, 40))
+    output = BytesIO()
+    if exif_orientation:
+        exif = Image.Exif()
+        exif[0x0112] = exif_orientation
+        image.save(output, format=image_format, exif=exif)
+    else:
+        image.save(output, format=image_format)
+    return output.getvalue()
+
+
+class TestImagePreprocessing:
+    """Claude送信前の画像前処理のテスト"""
+
+    def test_downscale_and_reencode(self, settings):
+        """長辺が上限まで縮小されJPEGに再エンコードされるテスト"""
+        from PIL import Image
+        settings.IMAGE_MAX_LONG_EDGE = 1000
+        data = build_image()
+
+        processed, media_type = preprocess_image_cached(data, 'image/png')
+
+        assert media_type == 'image/jpeg'
+        assert len(processed) < len(data)
+        with Image.open(BytesIO(processed)) as image:
+            assert image.format == 'JPEG'
+            assert image.size == (1000, 667)
+
+    def test_exif_rotation_and_grayscale(self, settings):
+        """EXIFの向きに従って回転し、グレースケール化されるテスト"""
+        from PIL import Image
+        settings.IMAGE_GRAYSCALE = True
+        data = build_image(size=(400, 200), exif_orientation=6, image_format='JPEG')
+
+        processed, _ = preprocess_image_cached(data, 'image/jpeg')
+
+        with Image.open(BytesIO(processed)) as image:
+            assert image.size == (200, 400)
+            assert image.mode == 'L'
+
+    def test_cached_by_content_hash(self, settings):
+        """同じ内容の画像は前処理結果のキャッシュが使われるテスト"""
+        data = build_image(size=(800, 600))
+        first, _ = preprocess_image_cached(data, 'image/png')
+
+        with patch('apps.files.image_preprocessing.preprocess_image') as mock_preprocess:
+            second, media_type = preprocess_image_cached(data, 'image/png')
+            mock_preprocess.assert_not_called()
+        assert second == first
+        assert media_type == 'image/jpeg'
+
+        # 設定が変わった場合は別のキャッシュになる
+        settings.IMAGE_JPEG_QUALITY = 40
+        third, _ = preprocess_image_cached(data, 'image/png')
+        assert third != first
+
+    def test_transparent_image_on_white(self, settings):
+        """透過PNG（RGBA・透過色付きのパレット）の透過部分が白背景になるテスト"""
+        from PIL import Image
+        settings.IMAGE_GRAYSCALE = False
+        rgba = Image.new('RGBA', (200, 100), (0, 0, 0, 0))
+        rgba.paste((0, 0, 0, 255), (0, 0, 50, 100))  # 左側だけ黒い文字部分
+        palette = rgba.convert('P')
+        palette.info['transparency'] = palette.getpixel((150, 50))
+
+        for image in (rgba, palette):
+            output = BytesIO()
+            image.save(output, format='PNG', transparency=image.info.get('transparency'))
+            processed, _ = preprocess_image_cached(output.getvalue(), 'image/png')
+
+            with Image.open(BytesIO(processed)) as result:
+                assert min(result.getpixel((150, 50))) > 240
+                assert max(result.getpixel((10, 50))) < 20
+
+    def test_invalid_image_falls_back(self):
+        """画像として読めないデータは元のまま返すテスト"""
+        assert preprocess_image_cached(b'test', 'image/jpeg') == (b'test', 'image/jpeg')
+
+    def test_disabled(self, settings):
+        """前処理を無効にした場合は元のまま返すテスト"""
+        settings.IMAGE_PREPROCESS_ENABLED = False
+        data = build_image(size=(800, 600))
+        assert preprocess_image_cached(data, 'image/png') == (data, 'image/png')
+
+    @pytest.mark.django_db
+    def test_image_upload_is_preprocessed(self, create_user, settings):
+        """画像アップロードのClaude送信データが前処理されるテスト"""
+        settings.IMAGE_MAX_LONG_EDGE = 500
+        data = build_image()
+        content_hash, file_size = get_blob_store().save([data])
+        file_upload = FileUpload.objects.create(
+            uploader=create_user(),
+            content_hash=content_hash,
+            original_name='photo.png',
+            file_type='image',
+            file_size=file_size,
+            mime_type='image/png'
+        )
+
+        content = process_file_content(file_upload)
+
+        assert content['type'] == 'image'
+        assert content['media_type'] == 'image/jpeg'
+        assert len(base64.b64decode(content['base64'])) < len(data)
+
+    def test_scanned_pdf_images_are_preprocessed(self):
+        """画像ベースPDFの画像も前処理されるテスト"""
+        file_upload = FileUpload(original_name='scan.pdf', file_data=base64.b64encode(build_pdf(image_pages=1)).decode())
+
+        content = process_file_content(file_upload)
+
+        assert content['type'] == 'image_based_pdf'
+        assert content['images'][0]['media_type'] == 'image/jpeg'
+
+
+def build_scanned_pdf(page_count, duplicate_last=False):
+    """テキストを含まない（ラスタライズ対象の）複数ページPDFを作成"""
+    doc = fitz.open()
+    for i in range(page_count):
+        page = doc.new_page()
+        offset = i - 1 if duplicate_last and i == page_count - 1 else i
+        page.draw_rect(fitz.Rect(72 + offset * 40, 72, 200 + offset * 40, 200), color=(0, 0, 0), fill=(0, 0, 0))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class TestMultiImageRequest:
+    """画像ベースPDFの複数ページ画像を1リクエストで送るテスト"""
+
+    def _image(self, page, data, width=100, height=100):
+        return {'page': page, 'index': None, 'data': data, 'width': width, 'height': height}
+
+    def test_select_orders_and_deduplicates(self):
+        """ページ順に並べ、同じ内容のページを除外するテスト"""
+        images = [self._image(3, 'ccc'), self._image(1, 'aaa'), self._image(2, 'aaa')]
+
+        selected = select_request_images(images, max_images=5, byte_budget=10 ** 6, token_budget=10 ** 6)
+
+        assert [image['page'] for image in selected] == [1, 3]
+
+    def test_select_respects_limits(self):
+        """枚数・バイト数・トークン数の上限で打ち切るテスト"""
+        images = [self._image(page, 'x' * 100 + str(page), width=750, height=100) for page in range(1, 6)]
+
+        assert len(select_request_images(images, max_images=2, byte_budget=10 ** 6, token_budget=10 ** 6)) == 2
+        assert len(select_request_images(images, max_images=5, byte_budget=250, token_budget=10 ** 6)) == 2
+        assert len(select_request_images(images, max_images=5, byte_budget=10 ** 6, token_budget=300)) == 3
+        # 1枚目は予算を超えていても送る
+        assert len(select_request_images(images, max_images=5, byte_budget=1, token_budget=1)) == 1
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_all_pages_in_one_request(self, mock_post, authenticated_client, mock_claude_response):
+        """複数ページが1回のリクエストにページ順でまとめて送られるテスト"""
+        client, user = authenticated_client
+        content_hash, file_size = get_blob_store().save([build_scanned_pdf(4, duplicate_last=True)])
+        file_upload = FileUpload.objects.create(
+            uploader=user,
+            original_name='scan.pdf',
+            content_hash=content_hash,
+            file_size=file_size,
+            mime_type='application/pdf'
+        )
+
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_claude_response
+        mock_post.return_value = mock_response
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert mock_post.call_count == 1
+        content = mock_post.call_args.kwargs['json']['messages'][0]['content']
+        labels = [block['text'] for block in content if block['type'] == 'text'][1:]
+        assert labels == ['Page 1:', 'Page 2:', 'Page 3:']
+        assert sum(1 for block in content if block['type'] == 'image') == 3
+
+
+MANIFEST_HEADER = '差出人名,差出人電話番号,差出人住所,受取人名,受取人電話番号,配送先住所,品名,数量,配送希望日,金額\n'
+
+
+def manifest_row(i, date='2024-12-25', quantity='2'):
+    return f'山田{i},03-1111-2222,東京都港区1-1-{i},佐藤{i},03-3333-4444,東京都品川区2-2-{i},書類{i},{quantity},{date},1500\n'
+
+
+class TestManifestImport:
+    """CSV/Excelマニフェストの一括取り込みのテスト"""
+
+    def _import(self, client, file_upload):
+        return client.post(reverse('import-manifest', kwargs={'pk': file_upload.id}))
+
+    def test_import_csv(self, authenticated_client, create_file_upload):
+        """UTF-8のCSVから配送依頼が一括作成されるテスト"""
+        client, user = authenticated_client
+        content = MANIFEST_HEADER + ''.join(manifest_row(i) for i in range(1, 4))
+        file_upload = create_file_upload(user, content.encode('utf-8-sig'), name='manifest.csv')
+
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['created'] == 3
+        assert response.data['failed'] == 0
+        delivery = DeliveryRequest.objects.get(sender_name='山田2')
+        assert delivery.requester == user
+        assert delivery.title == '書類2'
+        assert delivery.item_quantity == 2
+        assert str(delivery.delivery_date) == '2024-12-25'
+        assert delivery.request_amount == 1500
+
+    def test_reimport_is_rejected(self, authenticated_client, create_file_upload):
+        """取り込み済みのファイルを再度取り込むと409を返し、配送依頼を重複作成しないテスト"""
+        client, user = authenticated_client
+        content = MANIFEST_HEADER + ''.join(manifest_row(i) for i in range(1, 4))
+        file_upload = create_file_upload(user, content.encode('utf-8'), name='manifest.csv')
+
+        assert self._import(client, file_upload).status_code == status.HTTP_201_CREATED
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert DeliveryRequest.objects.filter(requester=user).count() == 3
+        file_upload.refresh_from_db()
+        assert file_upload.manifest_imported_at is not None
+
+    def test_import_shift_jis_with_row_errors(self, authenticated_client, settings, create_file_upload):
+        """Shift_JISのCSVを取り込み、不正な行は行番号付きで報告されるテスト"""
+        settings.MANIFEST_IMPORT_BATCH_SIZE = 2
+        client, user = authenticated_client
+        content = (
+            MANIFEST_HEADER
+            + manifest_row(1)
+            + manifest_row(2, date='12月25日')
+            + manifest_row(3, quantity='0')
+            + manifest_row(4, date='2024/12/26')
+            + manifest_row(5)
+        )
+        file_upload = create_file_upload(user, content.encode('cp932'), name='manifest.csv')
+
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['total_rows'] == 5
+        assert response.data['created'] == 3
+        assert response.data['failed'] == 2
+        assert [error['row'] for error in response.data['errors']] == [3, 4]
+        assert 'delivery_date' in response.data['errors'][0]['errors']
+        assert 'item_quantity' in response.data['errors'][1]['errors']
+        assert DeliveryRequest.objects.filter(requester=user).count() == 3
+
+    def test_import_xlsx(self, authenticated_client, create_file_upload):
+        """Excel（xlsx）から配送依頼が一括作成されるテスト"""
+        import openpyxl
+        from datetime import datetime
+        client, user = authenticated_client
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['sender_name', 'sender_phone', 'sender_address', 'recipient_name',
+                      'recipient_phone', 'recipient_address', 'item_name', 'delivery_date'])
+        for i in range(3):
+            sheet.append([f'山田{i}', '0311112222', '東京都港区', '佐藤', '0333334444', '東京都品川区', '書類',
+                          datetime(2024, 12, 25)])
+        output = BytesIO()
+        workbook.save(output)
+        file_upload = create_file_upload(user, output.getvalue(), name='manifest.xlsx')
+
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['created'] == 3
+        assert str(DeliveryRequest.objects.get(sender_name='山田0').delivery_date) == '2024-12-25'
+
+    def test_missing_required_columns(self, authenticated_client, create_file_upload):
+        """必須列が無い場合は何も作成せずエラーになるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, '差出人名,品名\n山田,書類\n'.encode('utf-8'), name='manifest.csv')
+
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert '必須の列がありません' in response.data['error']
+        assert not DeliveryRequest.objects.exists()
+
+    def test_unsupported_file_type(self, authenticated_client, create_file_upload):
+        """CSV/xlsx以外のファイルはエラーになるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, b'%PDF', name='slip.pdf')
+
+        response = self._import(client, file_upload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_large_manifest_uses_batched_inserts(self, authenticated_client, settings, django_assert_max_num_queries, create_file_upload):
+        """大量の行がバッチ単位のINSERTで取り込まれるテスト"""
+        settings.MANIFEST_IMPORT_BATCH_SIZE = 500
+        client, user = authenticated_client
+        content = MANIFEST_HEADER + ''.join(manifest_row(i) for i in range(5000))
+        file_upload = create_file_upload(user, content.encode('utf-8'), name='manifest.csv')
+
+        with django_assert_max_num_queries(30):
+            response = self._import(client, file_upload)
+
+        assert response.data['created'] == 5000
+        assert DeliveryRequest.objects.count() == 5000
+
+
+LABELED_SLIP_TEXT = """配送依頼書
+【差出人】
+氏名：山田　太郎
+電話：０３－１１１１－２２２２
+住所：
+〒105-0011
+東京都港区芝公園1-1-1
+【お届け先】
+お名前 佐藤花子
+TEL 03-3333-4444
+住所 東京都品川区2-2-2
+品名: 書類
+数量: 3個
+配送希望日: 2024年12月25日
+備考: 直接手渡し希望
+金額: ¥1,500
+"""
+
+
+def build_text_pdf(lines):
+    """1行ずつテキストを書き込んだPDFを作成"""
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((72, 72 + i * 20), line)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class TestLocalExtraction:
+    """ルールベース抽出（Claude APIを呼ばない高速経路）のテスト"""
+
+    def test_extract_labeled_text(self):
+        """ラベル付きテキストから項目と信頼度が取れるテスト"""
+        extracted_data, field_scores = extract_locally({'type': 'text', 'content': LABELED_SLIP_TEXT})
+
+        assert extracted_data['sender_name'] == '山田 太郎'
+        assert extracted_data['sender_phone'] == '03-1111-2222'
+        assert extracted_data['sender_address'] == '〒105-0011 東京都港区芝公園1-1-1'
+        assert extracted_data['recipient_name'] == '佐藤花子'
+        assert extracted_data['recipient_phone'] == '03-3333-4444'
+        assert extracted_data['item_quantity'] == 3
+        assert extracted_data['delivery_date'] == '2024-12-25'
+        assert extracted_data['request_amount'] == 1500
+        assert extracted_data['delivery_time'] == ''
+        assert field_scores['delivery_time'] == 0.0
+        assert is_confident(field_scores) is True
+
+    def test_invalid_required_field_is_not_confident(self):
+        """必須項目の形式が正しくない場合はClaudeに回すテスト"""
+        text = LABELED_SLIP_TEXT.replace('2024年12月25日', '年末まで')
+        extracted_data, field_scores = extract_locally({'type': 'text', 'content': text})
+
+        assert field_scores['delivery_date'] < 0.8
+        assert is_confident(field_scores) is False
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_labeled_pdf_skips_claude(self, mock_post, authenticated_client, create_file_upload):
+        """ラベル付きのテキストPDFはClaude APIを呼ばずに処理されるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, build_text_pdf([
+            'sender_name: Yamada Taro', 'sender_phone: 03-1111-2222', 'sender_address: Tokyo-to Minato-ku 1-1-1 105-0011',
+            'recipient_name: Sato Hanako', 'recipient_phone: 03-3333-4444', 'recipient_address: 141-0001 Shinagawa-ku 2-2-2',
+            'item_name: Documents', 'delivery_date: 2024/12/25',
+        ]), 'slip.pdf')
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['extracted_data']['sender_name'] == 'Yamada Taro'
+        assert response.data['field_scores']['delivery_date'] >= 0.8
+        mock_post.assert_not_called()
+
+        file_upload.refresh_from_db()
+        assert file_upload.processing_source == 'local'
+        assert file_upload.field_scores['sender_phone'] >= 0.8
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_csv_skips_claude(self, mock_post, authenticated_client, create_file_upload):
+        """見出し付きのCSVは最初の行がルールベースで抽出されるテスト"""
+        client, user = authenticated_client
+        content = MANIFEST_HEADER + manifest_row(1) + manifest_row(2)
+        file_upload = create_file_upload(user, content.encode('cp932'), 'slip.csv')
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['extracted_data']['sender_name'] == '山田1'
+        assert response.data['extracted_data']['item_quantity'] == 2
+        mock_post.assert_not_called()
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_incomplete_pdf_falls_back_to_claude(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """必須項目が足りない場合はClaude APIで処理されるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, build_text_pdf([
+            'sender_name: Yamada Taro', 'item_name: Documents',
+            'Please deliver this parcel to the usual address by the end of the month.',
+        ]), 'slip.pdf')
+
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_claude_response
+        mock_post.return_value = mock_response
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert mock_post.called
+        file_upload.refresh_from_db()
+        assert file_upload.processing_source == 'claude'
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_extraction_error_falls_back_to_claude(self, mock_post, authenticated_client, mock_claude_response,
+                                                   create_file_upload):
+        """ルールベース抽出が例外で失敗した場合もClaude APIで処理されるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, (MANIFEST_HEADER + manifest_row(1)).encode('utf-8'), 'slip.csv')
+
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_claude_response
+        mock_post.return_value = mock_response
+
+        with patch('apps.files.processing.extract_locally', side_effect=ValueError('unexpected layout')):
+            response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert mock_post.called
+        file_upload.refresh_from_db()
+        assert file_upload.processing_source == 'claude'
+
+    def test_stats_report_local_extractions(self, authenticated_client, sample_extracted_data):
+        """処理統計APIでルールベース抽出の件数・割合が取れるテスト"""
+        client, user = authenticated_client
+        for source in ['local', 'local', 'local', 'claude']:
+            FileUpload.objects.create(
+                uploader=user, original_name='slip.pdf', file_size=0, mime_type='application/pdf', is_processed=True,
+                processing_source=source, extracted_data=sample_extracted_data
+            )
+
+        response = client.get(reverse('processing-stats'))
+
+        assert response.data['local_extractions'] == 3
+        assert response.data['local_extraction_rate'] == 0.75
+        assert response.data['api_calls_saved'] == 3
+
+
+def claude_http_response(status_code, body=None, headers=None):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = body or {}
+    response.text = json.dumps(body or {})
+    return response
+
+
+class TestClaudeClient:
+    """Claude APIクライアント（再試行・同時実行数・サーキットブレーカー）のテスト"""
+
+    def _client(self, **kwargs):
+        options = {'api_url': 'https://claude.test/v1/messages', 'api_key': 'key', 'backoff': 0}
+        options.update(kwargs)
+        return ClaudeClient(**options)
+
+    def test_shared_session_and_timeouts(self, settings):
+        """プロセス内で同じクライアント（接続プール）を使い、タイムアウトを指定するテスト"""
+        settings.CLAUDE_API_CONNECT_TIMEOUT = 3
+        settings.CLAUDE_API_READ_TIMEOUT = 60
+        client = get_claude_client()
+        assert get_claude_client() is client
+
+        with patch.object(client.session, 'post', return_value=claude_http_response(200)) as mock_post:
+            client.create_message({'model': 'test'})
+
+        assert mock_post.call_args.kwargs['timeout'] == (3, 60)
+        assert client.session.headers['x-api-key'] == 'test-api-key'
+
+    def test_retry_on_rate_limit(self):
+        """429の場合はretry-afterに従って再試行するテスト"""
+        client = self._client(max_retries=2)
+        responses = [claude_http_response(429, headers={'retry-after': '0'}), claude_http_response(200, {'usage': {'input_tokens': 10}})]
+
+        with patch.object(client.session, 'post', side_effect=responses) as mock_post:
+            response = client.create_message({})
+
+        assert response.status_code == 200
+        assert mock_post.call_count == 2
+
+    def test_gives_up_after_max_retries(self):
+        """再試行回数を超えたら最後のレスポンスを返すテスト"""
+        client = self._client(max_retries=2)
+
+        with patch.object(client.session, 'post', return_value=claude_http_response(503)) as mock_post:
+            response = client.create_message({})
+
+        assert response.status_code == 503
+        assert mock_post.call_count == 3
+
+    def test_connection_error_is_retried(self):
+        """通信エラーは再試行し、続く場合は例外を送出するテスト"""
+        import requests
+        client = self._client(max_retries=1)
+
+        with patch.object(client.session, 'post', side_effect=requests.ConnectionError('refused')) as mock_post:
+            with pytest.raises(requests.ConnectionError):
+                client.create_message({})
+
+        assert mock_post.call_count == 2
+
+    def test_circuit_breaker(self):
+        """連続失敗でサーキットが開き、一定時間後の試行が成功すれば閉じるテスト"""
+        client = self._client(max_retries=0, failure_threshold=2, reset_timeout=60)
+
+        with patch.object(client.session, 'post', return_value=claude_http_response(500)) as mock_post:
+            client.create_message({})
+            client.create_message({})
+            with pytest.raises(CircuitOpenError):
+                client.create_message({})
+        assert mock_post.call_count == 2
+
+        client.breaker.reset_timeout = 0
+        with patch.object(client.session, 'post', return_value=claude_http_response(200)):
+            assert client.create_message({}).status_code == 200
+        assert client.breaker.is_open is False
+
+    def test_concurrency_limit(self):
+        """同時リクエスト数が上限を超えないテスト"""
+        client = self._client(max_concurrency=2)
+        in_flight = 0
+        max_in_flight = 0
+        lock = threading.Lock()
+
+        def slow_post(*args, **kwargs):
+            nonlocal in_flight, max_in_flight
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            threading.Event().wait(0.05)
+            with lock:
+                in_flight -= 1
+            return claude_http_response(200)
+
+        with patch.object(client.session, 'post', side_effect=slow_post):
+            threads = [threading.Thread(target=client.create_message, args=({},)) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert max_in_flight == 2
+
+    def test_circuit_recovers_after_unexpected_error(self):
+        """半開状態の試行が想定外の例外で失敗しても、その後の試行でサーキットが閉じるテスト"""
+        import requests
+        client = self._client(max_retries=0, failure_threshold=1, reset_timeout=0)
+
+        with patch.object(client.session, 'post', return_value=claude_http_response(500)):
+            client.create_message({})
+        with patch.object(client.session, 'post', side_effect=requests.exceptions.ChunkedEncodingError('broken')):
+            with pytest.raises(requests.exceptions.ChunkedEncodingError):
+                client.create_message({})
+
+        with patch.object(client.session, 'post', return_value=claude_http_response(200)):
+            assert client.create_message({}).status_code == 200
+        assert client.breaker.is_open is False
+
+    def test_stream_holds_slot_until_closed(self):
+        """ストリーミングのレスポンスを閉じるまで同時実行数の枠を保持するテスト"""
+        client = self._client(max_concurrency=1)
+        response = claude_http_response(200)
+
+        with patch.object(client.session, 'post', return_value=response):
+            streamed = client.stream_message({})
+            assert client._semaphore.acquire(blocking=False) is False
+            streamed.close()
+            streamed.close()
+
+        assert client._semaphore.acquire(blocking=False) is True
+
+    def test_process_returns_503_when_circuit_open(self, authenticated_client):
+        """サーキットが開いている場合は処理APIが503を返すテスト"""
+        client, user = authenticated_client
+        file_upload = FileUpload.objects.create(
+            uploader=user, original_name='slip.jpg', file_data='dGVzdA==',
+            file_size=4, mime_type='image/jpeg'
+        )
+
+        with patch.object(get_claude_client().breaker, 'before_call', side_effect=CircuitOpenError()):
+            response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class FakeBatchAPI:
+    """Message Batches APIのローカル代替サーバー（テスト用）"""
+
+    def __init__(self, message, errored_ids=(), polls_until_ended=1):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        api = self
+        self.message = message
+        self.errored_ids = set(errored_ids)
+        self.polls_until_ended = polls_until_ended
+        self.batches = {}
+        self.polls = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, content_type='application/json'):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                assert self.headers['x-api-key'] == 'test-api-key'
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                batch_id = f"msgbatch_{len(api.batches) + 1}"
+                api.batches[batch_id] = body['requests']
+                self._send_json({'id': batch_id, 'type': 'message_batch', 'processing_status': 'in_progress'})
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                batch_id = parts[3]
+                if parts[-1] == 'results':
+                    lines = []
+                    for request in api.batches[batch_id]:
+                        if request['custom_id'] in api.errored_ids:
+                            result = {'type': 'errored', 'error': {'type': 'invalid_request_error'}}
+                        else:
+                            result = {'type': 'succeeded', 'message': api.message}
+                        lines.append(json.dumps({'custom_id': request['custom_id'], 'result': result}))
+                    self._send_json('\n'.join(lines).encode(), 'application/binary')
+                    return
+                api.polls += 1
+                ended = api.polls >= api.polls_until_ended
+                self._send_json({
+                    'id': batch_id,
+                    'processing_status': 'ended' if ended else 'in_progress',
+                    'results_url': f"{api.base_url}/{batch_id}/results" if ended else None
+                })
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1/messages/batches"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestClaudeBatches:
+    """Message Batches APIによるまとめて処理のテスト"""
+
+    @pytest.fixture
+    def batch_api(self, settings, mock_claude_response):
+        api = FakeBatchAPI(mock_claude_response, polls_until_ended=2)
+        settings.CLAUDE_BATCH_API_URL = api.base_url
+        yield api
+        api.close()
+
+    def _create_uploads(self, create_file_upload, user, count):
+        return [create_file_upload(user, f'slip {i}'.encode(), name=f'slip{i}.jpg') for i in range(count)]
+
+    def test_submit_poll_and_write_back(self, batch_api, create_user, create_file_upload):
+        """未処理ファイルをバッチで登録し、完了後に結果がまとめて書き戻されるテスト"""
+        user = create_user()
+        uploads = self._create_uploads(create_file_upload, user, 3)
+        batch_api.errored_ids = {f'upload-{uploads[2].pk}'}
+
+        out = StringIO()
+        call_command('process_claude_batches', '--submit-only', stdout=out)
+        batch = ClaudeBatch.objects.get()
+        assert batch.request_count == 3
+        assert len(batch_api.batches[batch.batch_id]) == 3
+        assert FileUpload.objects.filter(claude_batch=batch).count() == 3
+
+        # 2回目の登録では同じファイルを含めない
+        call_command('process_claude_batches', '--submit-only', stdout=out)
+        assert ClaudeBatch.objects.count() == 1
+
+        call_command('process_claude_batches', '--poll-only', '--wait', '--poll-interval', '0', stdout=out)
+
+        batch.refresh_from_db()
+        assert batch.status == 'ended'
+        assert batch.succeeded_count == 2
+        assert batch.errored_count == 1
+
+        processed = FileUpload.objects.get(pk=uploads[0].pk)
+        assert processed.is_processed is True
+        assert processed.processing_source == 'claude_batch'
+        assert processed.extracted_data['sender_name'] == '山田太郎'
+        assert FileUpload.objects.get(pk=uploads[2].pk).is_processed is False
+
+    def test_uploads_with_jobs_are_excluded(self, batch_api, create_user, create_file_upload):
+        """処理ジョブ待ちのファイルはバッチに含めないテスト"""
+        user = create_user()
+        uploads = self._create_uploads(create_file_upload, user, 2)
+        enqueue_processing_job(uploads[0], user)
+
+        call_command('process_claude_batches', '--submit-only', stdout=StringIO())
+
+        requests_sent = batch_api.batches['msgbatch_1']
+        assert [request['custom_id'] for request in requests_sent] == [f'upload-{uploads[1].pk}']
+
+    def test_processed_upload_is_not_overwritten(self, batch_api, create_user, create_file_upload):
+        """バッチの完了前に他の処理で処理済みになったファイルは、書き戻しで結果を上書きしないテスト"""
+        user = create_user()
+        uploads = self._create_uploads(create_file_upload, user, 2)
+        call_command('process_claude_batches', '--submit-only', stdout=StringIO())
+        FileUpload.objects.filter(pk=uploads[0].pk).update(
+            is_processed=True, processing_source='claude', extracted_data={'sender_name': '別の結果'}, input_tokens=10
+        )
+
+        call_command('process_claude_batches', '--poll-only', '--wait', '--poll-interval', '0', stdout=StringIO())
+
+        processed_elsewhere = FileUpload.objects.get(pk=uploads[0].pk)
+        assert processed_elsewhere.processing_source == 'claude'
+        assert processed_elsewhere.extracted_data == {'sender_name': '別の結果'}
+        assert processed_elsewhere.input_tokens == 10
+        assert FileUpload.objects.get(pk=uploads[1].pk).processing_source == 'claude_batch'
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_batch_uploads_are_not_processed_again(self, mock_post, authenticated_client, create_file_upload):
+        """バッチに登録済みのファイルは同期処理・非同期処理・一括処理・ジョブでClaude APIを呼ばないテスト"""
+        client, user = authenticated_client
+        upload = create_file_upload(user)
+        batch = ClaudeBatch.objects.create(batch_id='msgbatch_1', request_count=1)
+        FileUpload.objects.filter(pk=upload.pk).update(claude_batch=batch)
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': upload.id}))
+        assert response.status_code == status.HTTP_409_CONFLICT
+        response = client.post(reverse('process-with-claude-async', kwargs={'pk': upload.id}))
+        assert response.status_code == status.HTTP_409_CONFLICT
+        response = client.post(reverse('process-bulk'), {'upload_ids': [upload.id]}, format='json')
+        assert response.data['results'][0]['status'] == status.HTTP_409_CONFLICT
+        response = client.post(reverse('process-bulk'), {'all_unprocessed': True}, format='json')
+        assert response.data['total'] == 0
+        with pytest.raises(UploadInBatchError):
+            enqueue_processing_job(upload, user)
+        assert ProcessingJob.objects.count() == 0
+
+        # バッチへの登録前に作られたジョブも、バッチの完了まで待機に戻る
+        job = ProcessingJob.objects.create(file_upload=upload, requested_by=user)
+        run_job(claim_next_job('test-worker'))
+        job.refresh_from_db()
+        assert job.status == 'queued'
+        assert job.attempts == 0
+        mock_post.assert_not_called()
+
+    def test_split_by_size(self, batch_api, create_user, create_file_upload):
+        """リクエストの合計サイズが上限に達したら次のバッチに分けるテスト"""
+        user = create_user()
+        uploads = self._create_uploads(create_file_upload, user, 3)
+        payload, _ = prepare_claude_request(uploads[0])
+        request_size = len(json.dumps({'custom_id': f'upload-{uploads[0].pk}', 'params': payload}))
+
+        batches, summary = submit_batch(max_bytes=request_size * 2 + 10)
+
+        assert [batch.request_count for batch in batches] == [2, 1]
+        assert summary['submitted'] == 3
+        assert FileUpload.objects.filter(claude_batch__isnull=True).count() == 0
+
+    def test_prepare_failures_are_excluded(self, batch_api, settings, create_user, create_file_upload):
+        """登録用のリクエストを作れないファイルは失敗回数を記録し、上限に達したら対象から外すテスト"""
+        settings.CLAUDE_BATCH_MAX_PREPARE_FAILURES = 2
+        user = create_user()
+        broken = create_file_upload(user, b'PK', name='archive.zip', mime_type='application/zip')
+
+        for _ in range(2):
+            _, summary = submit_batch()
+            assert summary['skipped'] == 1
+
+        broken.refresh_from_db()
+        assert broken.batch_prepare_failures == 2
+        _, summary = submit_batch()
+        assert summary['skipped'] == 0
+        assert not pending_uploads().filter(pk=broken.pk).exists()
+
+    def test_nothing_to_submit(self, batch_api):
+        """対象が無い場合はバッチを作らないテスト"""
+        out = StringIO()
+        call_command('process_claude_batches', stdout=out)
+
+        assert ClaudeBatch.objects.count() == 0
+        assert '登録対象のファイルはありません' in out.getvalue()
+
+
+class TestPromptCaching:
+    """共通指示のプロンプトキャッシュとトークン使用量の記録のテスト"""
+
+    def test_shared_cached_prefix(self, authenticated_client, settings, create_file_upload):
+        """どの形式でも共通指示が同じシステムプロンプト（キャッシュ対象）になるテスト"""
+        settings.LOCAL_EXTRACTION_ENABLED = False
+        client, user = authenticated_client
+        pdf_upload = create_file_upload(user, build_text_pdf(['Please deliver to Sato Hanako at the Shinagawa office before noon on Friday.']), 'slip.pdf')
+        image_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+
+        pdf_payload, _ = prepare_claude_request(pdf_upload)
+        image_payload, _ = prepare_claude_request(image_upload)
+
+        assert pdf_payload['system'] == image_payload['system']
+        assert pdf_payload['system'][-1]['cache_control'] == {'type': 'ephemeral'}
+        assert '"sender_name"' in pdf_payload['system'][0]['text']
+        # 文書ごとの内容には共通指示を含めない
+        user_text = pdf_payload['messages'][0]['content'][0]['text']
+        assert '"sender_name"' not in user_text
+        assert 'Please deliver to Sato Hanako' in user_text
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_records_cache_token_usage(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """キャッシュの読み込み・書き込みトークン数が記録され、統計APIで集計されるテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        mock_claude_response['usage'] = {
+            'input_tokens': 1500, 'output_tokens': 200,
+            'cache_read_input_tokens': 1200, 'cache_creation_input_tokens': 0
+        }
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_claude_response
+        mock_post.return_value = mock_response
+
+        response = client.post(reverse('process-with-claude', kwargs={'pk': file_upload.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        file_upload.refresh_from_db()
+        assert file_upload.cache_read_input_tokens == 1200
+        assert file_upload.cache_creation_input_tokens == 0
+        assert file_upload.input_tokens == 1500
+
+        stats = client.get(reverse('processing-stats')).data
+        assert stats['token_usage']['cache_read_input_tokens'] == 1200
+        assert stats['token_usage']['output_tokens'] == 200
+
+
+def claude_stream_response(message, chunks, error=None):
+    """ストリーミング（SSE）形式のMessages APIレスポンスのモック"""
+    events = [{'type': 'message_start', 'message': {**message, 'content': [], 'usage': {'input_tokens': 1500, 'output_tokens': 1}}}]
+    events += [
+        {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}}
+        for chunk in chunks
+    ]
+    if error:
+        events.append({'type': 'error', 'error': {'type': 'overloaded_error', 'message': error}})
+    events.append({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': 200}})
+    events.append({'type': 'message_stop'})
+
+    lines = []
+    for event in events:
+        lines += [f"event: {event['type']}".encode(), f"data: {json.dumps(event)}".encode(), b'']
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {}
+    response.iter_lines.return_value = lines
+    return response
+
+
+def read_sse_events(response):
+    """SSEのレスポンスを (イベント名, データ) のリストにする"""
+    events = []
+    for block in b''.join(response).decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.filterwarnings('ignore:StreamingHttpResponse must consume asynchronous iterators')
+class TestProcessingProgressStream:
+    """帳票処理の進捗ストリーム（SSE）のテスト"""
+
+    def _auth_header(self, user):
+        return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_streams_stage_events(self, mock_post, client, create_user, mock_claude_response, create_file_upload):
+        """処理段階ごとのイベントと生成中のテキストが順に送られ、結果が保存されるテスト"""
+        user = create_user()
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        text = mock_claude_response['content'][0]['text']
+        mock_post.return_value = claude_stream_response(mock_claude_response, [text[:40], text[40:]])
+
+        response = client.get(
+            reverse('process-with-claude-stream', kwargs={'pk': file_upload.id}), **self._auth_header(user)
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'text/event-stream'
+        events = read_sse_events(response)
+        stages = [event for event, _ in events]
+        assert stages == [
+            'started', 'decoded', 'images_selected', 'request_sent',
+            'tokens', 'tokens', 'parsed', 'saved', 'complete'
+        ]
+        assert ''.join(data['text'] for event, data in events if event == 'tokens') == text
+        assert events[-1][1]['status'] == 200
+        assert events[-1][1]['extracted_data']['sender_name'] == '山田太郎'
+        assert mock_post.call_args.kwargs['json']['stream'] is True
+        assert mock_post.call_args.kwargs['stream'] is True
+
+        file_upload.refresh_from_db()
+        assert file_upload.is_processed
+        assert file_upload.processing_source == 'claude'
+        assert file_upload.extracted_data['recipient_name'] == '佐藤花子'
+        assert file_upload.input_tokens == 1500
+        assert file_upload.output_tokens == 200
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_stream_error_event(self, mock_post, client, create_user, mock_claude_response, create_file_upload):
+        """ストリーミング中にエラーになった場合は error イベントで終わり、未処理のままになるテスト"""
+        user = create_user()
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        mock_post.return_value = claude_stream_response(mock_claude_response, ['```json'], error='Overloaded')
+
+        response = client.get(
+            reverse('process-with-claude-stream', kwargs={'pk': file_upload.id}), **self._auth_header(user)
+        )
+
+        event, data = read_sse_events(response)[-1]
+        assert event == 'error'
+        assert data['status'] == 500
+        assert data['details'] == 'Overloaded'
+        file_upload.refresh_from_db()
+        assert not file_upload.is_processed
+
+    def test_requires_jwt(self, client, create_user, create_file_upload):
+        """JWTが無い場合は401、クエリ文字列のJWTは受け付けないテスト"""
+        user = create_user()
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        file_upload.is_processed = True
+        file_upload.save()
+        url = reverse('process-with-claude-stream', kwargs={'pk': file_upload.id})
+
+        assert client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+        assert client.get(url, {'token': str(RefreshToken.for_user(user).access_token)}).status_code == status.HTTP_401_UNAUTHORIZED
+
+        response = client.get(url, **self._auth_header(user))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert json.loads(response.content)['error'] == '既に処理済みです。'
+
+    def test_stream_ticket_is_single_use(self, client, settings, create_user, create_file_upload):
+        """EventSource用の接続用チケットは対象のファイルに1回だけ使え、期限切れは無効になるテスト"""
+        user = create_user()
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        file_upload.is_processed = True
+        file_upload.save()
+        other_upload = create_file_upload(user, build_image(size=(100, 100)), 'other.png')
+        ticket_url = reverse('process-stream-ticket', kwargs={'pk': file_upload.id})
+        url = reverse('process-with-claude-stream', kwargs={'pk': file_upload.id})
+
+        assert client.post(ticket_url).status_code == status.HTTP_401_UNAUTHORIZED
+        response = client.post(ticket_url, **self._auth_header(user))
+        assert response.status_code == status.HTTP_201_CREATED
+        ticket = response.json()['ticket']
+        assert response.json()['stream_url'].endswith(f'{url}?ticket={ticket}')
+
+        other_url = reverse('process-with-claude-stream', kwargs={'pk': other_upload.id})
+        assert client.get(other_url, {'ticket': ticket}).status_code == status.HTTP_401_UNAUTHORIZED
+        assert client.get(url, {'ticket': ticket}).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(url, {'ticket': ticket}).status_code == status.HTTP_401_UNAUTHORIZED
+
+        settings.STREAM_TICKET_TTL = 0
+        ticket = client.post(ticket_url, **self._auth_header(user)).json()['ticket']
+        assert client.get(url, {'ticket': ticket}).status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_busy_upload_returns_409(self, client, create_user, create_file_upload):
+        """同じファイルを処理中の場合はストリームを開始せず409を返すテスト"""
+        user = create_user()
+        file_upload = create_file_upload(user, build_image(size=(200, 100)), 'slip.png')
+        FileUpload.objects.filter(pk=file_upload.pk).update(processing_started_at=timezone.now())
+
+        response = client.get(
+            reverse('process-with-claude-stream', kwargs={'pk': file_upload.id}), **self._auth_header(user)
+        )
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        file_upload.refresh_from_db()
+        assert not file_upload.is_processed
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBulkProcessing:
+    """複数の帳票の一括処理（処理ジョブの登録）のテスト"""
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_enqueues_jobs(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """ファイルごとに処理ジョブを登録して202を返し、ワーカーが処理するテスト"""
+        client, user = authenticated_client
+        uploads = [create_file_upload(user, build_image(size=(200 + i, 100)), name='slip.png') for i in range(3)]
+        processed = create_file_upload(user, build_image(size=(300, 100)), name='slip.png')
+        processed.is_processed = True
+        processed.save()
+        upload_ids = [upload.id for upload in uploads] + [processed.id, 999999]
+
+        response = client.post(reverse('process-bulk'), {'upload_ids': upload_ids}, format='json')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['total'] == 5
+        assert response.data['queued'] == 3
+        assert response.data['failed'] == 2
+        assert [result['upload_id'] for result in response.data['results']] == upload_ids
+        results = {result['upload_id']: result for result in response.data['results']}
+        assert results[processed.id]['status'] == status.HTTP_400_BAD_REQUEST
+        assert results[999999]['status'] == status.HTTP_404_NOT_FOUND
+        jobs = ProcessingJob.objects.filter(pk__in=response.data['job_ids'])
+        assert sorted(job.file_upload_id for job in jobs) == sorted(upload.id for upload in uploads)
+        mock_post.assert_not_called()
+
+        # 同じファイルを再度指定しても、処理待ちのジョブを返す
+        response = client.post(reverse('process-bulk'), {'upload_ids': [uploads[0].id]}, format='json')
+        assert response.data['results'][0]['created'] is False
+        assert ProcessingJob.objects.count() == 3
+
+        mock_post.return_value = claude_http_response(200, mock_claude_response)
+        call_command('process_ocr_jobs', once=True, stdout=StringIO())
+        assert FileUpload.objects.filter(pk__in=[upload.id for upload in uploads], is_processed=True).count() == 3
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_status_url_reports_results(self, mock_post, authenticated_client, mock_claude_response,
+                                        create_user, create_file_upload):
+        """一括処理の status_url でジョブごとの処理結果と件数をまとめて取得できるテスト"""
+        client, user = authenticated_client
+        uploads = [create_file_upload(user, build_image(size=(200 + i, 100)), name='slip.png') for i in range(2)]
+        other_user = create_user()
+        other_job, _ = enqueue_processing_job(create_file_upload(other_user), other_user)
+
+        response = client.post(reverse('process-bulk'), {'upload_ids': [upload.id for upload in uploads]}, format='json')
+        status_url = response.data['status_url']
+
+        response = client.get(status_url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['counts']['queued'] == 2
+        assert response.data['finished'] is False
+
+        mock_post.return_value = claude_http_response(200, mock_claude_response)
+        call_command('process_ocr_jobs', once=True, stdout=StringIO())
+
+        response = client.get(status_url)
+        assert response.data['total'] == 2
+        assert response.data['counts']['succeeded'] == 2
+        assert response.data['finished'] is True
+        assert [result['file_upload'] for result in response.data['results']] == [upload.id for upload in uploads]
+        assert response.data['results'][0]['result']['extracted_data']['sender_name'] == '山田太郎'
+
+        # 他人のジョブは含まれない
+        response = client.get(reverse('processing-job-list'), {'ids': str(other_job.id)})
+        assert response.data['total'] == 0
+        response = client.get(reverse('processing-job-list'), {'ids': 'abc'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_worker_limits_concurrency(self, mock_post, authenticated_client, mock_claude_response,
+                                       settings, create_file_upload):
+        """ワーカーが CLAUDE_API_MAX_CONCURRENCY を上限に複数のジョブを同時に処理するテスト"""
+        settings.CLAUDE_API_MAX_CONCURRENCY = 2
+        client, user = authenticated_client
+        for i in range(4):
+            upload = create_file_upload(user, build_image(size=(200 + i, 100)), name='slip.png')
+            enqueue_processing_job(upload, user)
+        barrier = threading.Barrier(2, timeout=10)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def post(*args, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            # 2件が同時に処理されていなければタイムアウトする
+            barrier.wait()
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return claude_http_response(200, mock_claude_response)
+
+        mock_post.side_effect = post
+        call_command('process_ocr_jobs', once=True, concurrency=4, stdout=StringIO())
+
+        assert ProcessingJob.objects.filter(status='succeeded').count() == 4
+        assert in_flight[1] == 2
+
+    @patch('apps.files.claude_client.requests.Session.post')
+    def test_all_unprocessed_reuses_duplicates(self, mock_post, authenticated_client, mock_claude_response, create_file_upload):
+        """all_unprocessed で未処理の全件を登録し、同じ内容のファイルは結果を再利用するテスト"""
+        client, user = authenticated_client
+        first = create_file_upload(user, build_image(size=(200, 100)), name='slip.png')
+        duplicate = create_file_upload(user, build_image(size=(200, 100)), name='copy.png')
+        other = create_file_upload(user, build_image(size=(210, 100)), name='slip.png')
+        mock_post.return_value = claude_http_response(200, mock_claude_response)
+
+        response = client.post(reverse('process-bulk'), {'all_unprocessed': True}, format='json')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['queued'] == 3
+        assert response.data['remaining'] == 0
+        call_command('process_ocr_jobs', once=True, stdout=StringIO())
+
+        assert mock_post.call_count == 2
+        assert FileUpload.objects.get(pk=duplicate.pk).processing_source == 'cache'
+        assert FileUpload.objects.get(pk=first.pk).processing_source == 'claude'
+        assert FileUpload.objects.get(pk=other.pk).processing_source == 'claude'
+
+    def test_all_unprocessed_reports_remaining(self, authenticated_client, settings, create_file_upload):
+        """all_unprocessed で上限を超える場合は古い順に上限まで登録し、残りの件数を返すテスト"""
+        settings.BULK_PROCESS_MAX_UPLOADS = 2
+        client, user = authenticated_client
+        uploads = [create_file_upload(user, f'slip {i}'.encode(), name=f'slip{i}.jpg') for i in range(5)]
+
+        response = client.post(reverse('process-bulk'), {'all_unprocessed': True}, format='json')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert [result['upload_id'] for result in response.data['results']] == [uploads[0].id, uploads[1].id]
+        assert response.data['remaining'] == 3
+
+    def test_validation(self, authenticated_client, settings):
+        """対象の指定が無い・件数が多すぎる場合は400を返すテスト"""
+        settings.BULK_PROCESS_MAX_UPLOADS = 2
+        client, user = authenticated_client
+
+        assert client.post(reverse('process-bulk'), {}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+        response = client.post(reverse('process-bulk'), {'upload_ids': [1, 2, 3]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = client.post(reverse('process-bulk'), {'upload_ids': ['abc']}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestFileUploadList:
+    """ファイル一覧APIが大きな列を読み込まないことのテスト"""
+
+    def _create_uploads(self, create_file_upload, user, count):
+        # 旧形式の file_data（1件64KB）と大きな生レスポンスを持つファイル
+        file_data = base64.b64encode(os.urandom(64 * 1024)).decode('utf-8')
+        for i in range(count):
+            create_file_upload(
+                user, None, name=f'slip{i}.png', file_data=file_data, file_size=64 * 1024, is_processed=True,
+                claude_response={'content': [{'type': 'text', 'text': 'x' * 10000}]},
+                extracted_data={'sender_name': '山田太郎'}
+            )
+
+    def test_list_excludes_heavy_fields(self, authenticated_client, django_assert_max_num_queries, create_file_upload):
+        """一覧ではファイルデータ・生レスポンスを取得せず、件数に関わらずクエリ数が一定のテスト"""
+        client, user = authenticated_client
+        self._create_uploads(create_file_upload, user, 10)
+
+        with CaptureQueriesContext(connection) as queries, django_assert_max_num_queries(2):
+            response = client.get(reverse('file-upload-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 10
+        row = response.data['results'][0]
+        assert 'file_data' not in row
+        assert 'claude_response' not in row
+        assert row['extracted_data'] == {'sender_name': '山田太郎'}
+        assert row['uploader']['id'] == user.id
+        assert all('"file_data"' not in query['sql'] and '"claude_response"' not in query['sql'] for query in queries)
+        # 1件あたり64KBのファイルデータを含まない
+        assert len(response.content) < 10 * 1024
+
+    def test_include_opt_in_and_detail(self, authenticated_client, create_file_upload):
+        """?include= で指定した項目のみ一覧に含め、詳細APIでは従来どおり全項目を返すテスト"""
+        client, user = authenticated_client
+        self._create_uploads(create_file_upload, user, 2)
+
+        row = client.get(reverse('file-upload-list'), {'include': 'claude_response'}).data['results'][0]
+        assert 'claude_response' in row
+        assert 'file_data' not in row
+
+        upload = FileUpload.objects.filter(uploader=user).first()
+        detail = client.get(reverse('file-upload-detail', kwargs={'pk': upload.id})).data
+        assert detail['file_data'] == upload.file_data
+        assert detail['claude_response'] == upload.claude_response
+
+    def test_cursor_pagination(self, authenticated_client, create_file_upload):
+        """?pagination=cursor でも大きな列を読み込まずにページをたどれるテスト"""
+        client, user = authenticated_client
+        self._create_uploads(create_file_upload, user, 25)
+
+        first = client.get(reverse('file-upload-list'), {'pagination': 'cursor'}).data
+        second = client.get(first['next']).data
+
+        ids = [row['id'] for row in first['results'] + second['results']]
+        assert ids == list(FileUpload.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        assert second['next'] is None
+        assert 'file_data' not in second['results'][0]
+
+
+@pytest.mark.django_db
+class TestFilePreview:
+    """プレビュー（サムネイル）APIとディスクキャッシュのテスト"""
+
+    def _open(self, response):
+        from PIL import Image
+        return Image.open(BytesIO(b''.join(response.streaming_content)))
+
+    def test_image_preview_is_cached(self, authenticated_client, create_file_upload):
+        """画像を指定サイズに縮小したJPEGを返し、ディスクにキャッシュするテスト"""
+        client, user = authenticated_client
+        file_upload = create_file_upload(user, build_image(size=(3000, 2000)), 'slip.png')
+        url = reverse('preview-file', kwargs={'pk': file_upload.id})
+
+        response = client.get(url, {'size': 'small'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'image/jpeg'
+        assert 'max-age=' in response['Cache-Control']
+        assert 'immutable' in response['Cache-Control']
+        etag = response['ETag']
+        preview = self._open(response)
+        assert preview.format == 'JPEG'
+        assert max(preview.size) == 160
+        cache_path = preview_cache_path(file_upload.content_hash, 'small')
+        assert cache_path.exists()
+
+        # キャッシュから返す（元ファイルは読まない）
+        with patch('apps.files.previews.open_upload_content') as mock_open:
+            assert client.get(url, {'size': 'small'}).status_code == status.HTTP_200_OK
+        mock_open.assert_not_called()
+
+        response = client.get(url, {'size': 'small'}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_pdf_page_preview(self, authenticated_client, create_file_upload):
+        """PDFの指定ページを描画し、存在しないページ・未対応の形式は400を返すテスト"""
+        client, user = authenticated_client
+        pdf_upload = create_file_upload(user, build_scanned_pdf(2), 'slip.pdf')
+        url = reverse('preview-file', kwargs={'pk': pdf_upload.id})
+
+        response = client.get(url, {'size': 'medium', 'page': 2})
+        assert response.status_code == status.HTTP_200_OK
+        assert max(self._open(response).size) == 480
+
+        assert client.get(url, {'page': 3}).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(url, {'size': 'huge'}).status_code == status.HTTP_400_BAD_REQUEST
+
+        csv_upload = create_file_upload(user, MANIFEST_HEADER.encode('utf-8'), 'manifest.csv')
+        response = client.get(reverse('preview-file', kwargs={'pk': csv_upload.id}))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_pregenerated_after_upload(self, authenticated_client, settings, django_capture_on_commit_callbacks):
+        """アップロード後にバックグラウンドで全サイズのプレビューを作成するテスト"""
+        settings.PREVIEW_PREGENERATE = True
+        client, user = authenticated_client
+        image = SimpleUploadedFile('slip.png', build_image(size=(1200, 800)), content_type='image/png')
+
+        with patch('apps.files.previews._get_executor') as mock_executor, \
+                django_capture_on_commit_callbacks(execute=True):
+            mock_executor.return_value.submit.side_effect = lambda func, *args: func(*args)
+            response = client.post(reverse('file-upload-list'), {'file': image}, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        content_hash = FileUpload.objects.get(pk=response.data['id']).content_hash
+        for size in ['small', 'medium', 'large']:
+            assert preview_cache_path(content_hash, size).exists()
+
+
+@pytest.mark.django_db
+class TestStoredDataCompression:
+    """BLOB・claude_responseの圧縮保存と一括圧縮コマンドのテスト"""
+
+    csv_content = (MANIFEST_HEADER + ''.join(manifest_row(i) for i in range(200))).encode('utf-8')
+
+    def test_local_store_compresses_by_content_type(self, tmp_path):
+        """圧縮対象の形式のみgzipで保存し、展開しながら読み出せるテスト"""
+        store = LocalBlobStore(tmp_path)
+        key, size = store.save([self.csv_content], content_type='text/csv')
+
+        assert key == hashlib.sha256(self.csv_content).hexdigest()
+        assert size == len(self.csv_content)
+        compressed_path = tmp_path / key[:2] / key[2:4] / f'{key}.gz'
+        assert compressed_path.stat().st_size < len(self.csv_content) / 3
+        assert store.path(key) is None
+        assert store.size(key) == len(self.csv_content)
+        with store.open(key) as f:
+            assert f.read() == self.csv_content
+        with store.open(key, offset=100) as f:
+            assert f.read() == self.csv_content[100:]
+
+        # 画像は圧縮しない・小さくならないデータも圧縮しない
+        image = build_image(size=(200, 100))
+        image_key, _ = store.save([image], content_type='image/png')
+        assert store.path(image_key) is not None
+        random_key, _ = store.save([os.urandom(4096)], content_type='application/pdf')
+        assert store.path(random_key) is not None
+
+    def test_s3_store_compression(self):
+        """S3互換ストレージでも圧縮して保存・展開して読み出せるテスト"""
+        client = FakeS3Client()
+        store = S3BlobStore(bucket='test-bucket', prefix='uploads', client=client)
+        key, _ = store.save([self.csv_content], content_type='text/csv')
+
+        assert ('test-bucket', f'uploads/{key}.gz') in client.objects
+        assert ('test-bucket', f'uploads/{key}') not in client.objects
+        assert store.exists(key)
+        assert store.size(key) == len(self.csv_content)
+        assert store.open(key, offset=10).read() == self.csv_content[10:]
+
+    def test_download_and_processing_read_compressed_blob(self, authenticated_client):
+        """圧縮して保存したCSVのダウンロード（Range含む）・読み取りが元の内容で行えるテスト"""
+        client, user = authenticated_client
+        upload = SimpleUploadedFile('manifest.csv', self.csv_content, content_type='text/csv')
+        response = client.post(reverse('file-upload-list'), {'file': upload}, format='multipart')
+        file_upload = FileUpload.objects.get(pk=response.data['id'])
+        assert get_blob_store().path(file_upload.content_hash) is None
+
+        url = reverse('download-file', kwargs={'pk': file_upload.id})
+        assert b''.join(client.get(url).streaming_content) == self.csv_content
+        response = client.get(url, HTTP_RANGE='bytes=10-19')
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert b''.join(response.streaming_content) == self.csv_content[10:20]
+
+        processed = process_file_content(file_upload)
+        assert processed['type'] == 'csv'
+        assert len(processed['content']['data']) == 200
+
+    def test_claude_response_is_compressed(self, create_user, mock_claude_response):
+        """大きなclaude_responseは圧縮して保存され、読み込み時に元に戻るテスト"""
+        user = create_user()
+        mock_claude_response['content'][0]['text'] *= 20
+        file_upload = FileUpload.objects.create(
+            uploader=user, original_name='slip.png', file_size=0, mime_type='image/png',
+            claude_response=mock_claude_response
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT claude_response::text FROM files_fileupload WHERE id = %s', [file_upload.id])
+            stored = cursor.fetchone()[0]
+        assert '__compressed__' in stored
+        assert len(stored) < len(json.dumps(mock_claude_response, ensure_ascii=False)) / 2
+
+        file_upload.refresh_from_db()
+        assert file_upload.claude_response == mock_claude_response
+        assert FileUpload.objects.values_list('claude_response', flat=True).get(pk=file_upload.id) == mock_claude_response
+
+    def test_backfill_command(self, create_user, mock_claude_response, settings):
+        """既存のBLOB・claude_responseを一括で圧縮するコマンドのテスト"""
+        user = create_user()
+        # 他のテストで圧縮済みのBLOBと重ならない内容にする
+        content = self.csv_content + os.urandom(8).hex().encode('ascii')
+        content_hash, file_size = get_blob_store().save([content])
+        assert get_blob_store().path(content_hash) is not None
+
+        mock_claude_response['content'][0]['text'] *= 20
+        settings.CLAUDE_RESPONSE_COMPRESSION_MIN_BYTES = 10 ** 9
+        file_upload = FileUpload.objects.create(
+            uploader=user, original_name='manifest.csv', content_hash=content_hash,
+            file_size=file_size, mime_type='text/csv', claude_response=mock_claude_response
+        )
+        settings.CLAUDE_RESPONSE_COMPRESSION_MIN_BYTES = 1024
+        assert not FileUpload.objects.filter(claude_response__has_key='__compressed__').exists()
+
+        out = StringIO()
+        call_command('compress_stored_data', batch_size=1, stdout=out)
+
+        assert 'BLOB 圧縮: 1件' in out.getvalue()
+        assert get_blob_store().path(content_hash) is None
+        with open_upload_content(file_upload) as f:
+            assert f.read() == content
+        assert FileUpload.objects.filter(pk=file_upload.pk, claude_response__has_key='__compressed__').exists()
+        file_upload.refresh_from_db()
+        assert file_upload.claude_response == mock_claude_response
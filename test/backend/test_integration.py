@@ -97,7 +97,7 @@ class TestFullWorkflow:
         assert len(response.data['results']) == 1
         assert response.data['results'][0]['status'] == 'completed'
 
-    @patch('apps.files.views.requests.post')
+    @patch('apps.files.claude_client.requests.Session.post')
     def test_file_to_delivery_workflow(self, mock_post, api_client, user_data, mock_claude_response):
         """ファイルから配送依頼作成までのワークフロー"""
         
@@ -1,7 +1,14 @@
 import pytest
+from unittest.mock import patch
 from django.urls import reverse
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from apps.delivery.models import DeliveryRequest
+from apps.users.geo import (
+    DriverLocationSnapshot, get_driver_locations, invalidate_driver_locations, update_driver_locations
+)
+from apps.users.locations import flush_driver_locations, pending_driver_locations
 from apps.users.models import DriverProfile
 
 User = get_user_model()
@@ -204,4 +211,283 @@ class TestDriverProfile:
         emails = [item['user']['email'] for item in response.data]
         assert 'driver1@example.com' in emails
         assert 'driver2@example.com' in emails
-        assert 'driver3@example.com' not in emails
\ No newline at end of file
+        assert 'driver3@example.com' not in emails
+
+@pytest.mark.django_db
+class TestNearestDrivers:
+    """近くのドライバー検索のテスト"""
+
+    def _place(self, driver, lat, lng, **kwargs):
+        profile = driver.driver_profile
+        profile.current_location_lat = lat
+        profile.current_location_lng = lng
+        for name, value in kwargs.items():
+            setattr(profile, name, value)
+        profile.save()
+        return driver
+
+    def _create_drivers(self, create_driver):
+        # 東京駅からの距離: 約0.5km / 約3km / 約8km / 約400km（大阪）
+        near = self._place(create_driver(), '35.684000', '139.767000')
+        middle = self._place(create_driver(), '35.708000', '139.780000', vehicle_type='truck')
+        far = self._place(create_driver(), '35.750000', '139.800000')
+        osaka = self._place(create_driver(), '34.702500', '135.495900')
+        unavailable = self._place(create_driver(), '35.681500', '139.766000', is_available=False)
+        create_driver()  # 位置情報なし
+        return near, middle, far, osaka, unavailable
+
+    def test_nearest_from_point(self, authenticated_client, create_driver):
+        """地点から近い順に、稼働可能で位置情報のあるドライバーを返すテスト"""
+        client, user = authenticated_client
+        near, middle, far, osaka, unavailable = self._create_drivers(create_driver)
+
+        response = client.get(reverse('nearest-drivers'), {'lat': '35.681236', 'lng': '139.767125'})
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.data['results']
+        assert [row['id'] for row in results] == [near.id, middle.id, far.id, osaka.id]
+        assert results[0]['distance_km'] < 1
+        assert 390 < results[-1]['distance_km'] < 410
+
+    def test_filters(self, authenticated_client, create_driver):
+        """半径・車両タイプ・稼働可否・件数で絞り込むテスト"""
+        client, user = authenticated_client
+        near, middle, far, osaka, unavailable = self._create_drivers(create_driver)
+        url = reverse('nearest-drivers')
+        point = {'lat': '35.681236', 'lng': '139.767125'}
+
+        within = client.get(url, {**point, 'radius_km': '5'}).data['results']
+        assert [row['id'] for row in within] == [near.id, middle.id]
+
+        trucks = client.get(url, {**point, 'vehicle_type': 'truck'}).data['results']
+        assert [row['id'] for row in trucks] == [middle.id]
+
+        everyone = client.get(url, {**point, 'available': 'false', 'limit': '2'}).data['results']
+        assert [row['id'] for row in everyone] == [unavailable.id, near.id]
+
+    def test_nearest_to_delivery_request(self, authenticated_client, create_driver, delivery_request_data):
+        """配送依頼の集荷地点から検索し、集荷地点が無い場合は400を返すテスト"""
+        client, user = authenticated_client
+        near, middle, far, osaka, unavailable = self._create_drivers(create_driver)
+        delivery_request = DeliveryRequest.objects.create(
+            requester=user, sender_lat='34.700000', sender_lng='135.500000', **delivery_request_data
+        )
+        no_location = DeliveryRequest.objects.create(requester=user, **delivery_request_data)
+        url = reverse('nearest-drivers')
+
+        response = client.get(url, {'delivery_request': delivery_request.id, 'limit': '1'})
+        assert [row['id'] for row in response.data['results']] == [osaka.id]
+
+        response = client.get(url, {'delivery_request': no_location.id})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_profile_changes_are_reflected(self, authenticated_client, create_driver):
+        """プロフィールの変更（稼働不可など）が次の検索に反映されるテスト"""
+        client, user = authenticated_client
+        near, middle, far, osaka, unavailable = self._create_drivers(create_driver)
+        url = reverse('nearest-drivers')
+        point = {'lat': '35.681236', 'lng': '139.767125', 'limit': '1'}
+        assert client.get(url, point).data['results'][0]['id'] == near.id
+
+        self._place(near, near.driver_profile.current_location_lat, near.driver_profile.current_location_lng,
+                    is_available=False)
+
+        assert client.get(url, point).data['results'][0]['id'] == middle.id
+
+    def test_validation_and_permission(self, authenticated_client, create_driver):
+        """パラメーター不正は400、ドライバーは403を返すテスト"""
+        client, user = authenticated_client
+        url = reverse('nearest-drivers')
+
+        assert client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(url, {'lat': '95', 'lng': '139'}).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(url, {'lat': '35', 'lng': '139', 'radius_km': '-1'}).status_code == status.HTTP_400_BAD_REQUEST
+
+        client.force_authenticate(user=create_driver())
+        assert client.get(url, {'lat': '35', 'lng': '139'}).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_snapshot_invalidated_while_loading_is_not_kept(self, create_driver):
+        """作成中に無効化されたスナップショットは共有せず、次の検索で作り直すテスト"""
+        self._place(create_driver(), '35.684000', '139.767000')
+        invalidate_driver_locations()
+        load = DriverLocationSnapshot.load.__func__
+
+        def load_then_invalidate(cls):
+            snapshot = load(cls)
+            invalidate_driver_locations()
+            return snapshot
+
+        with patch.object(DriverLocationSnapshot, 'load', classmethod(load_then_invalidate)):
+            stale = get_driver_locations()
+
+        assert len(stale) == 1
+        fresh = get_driver_locations()
+        assert fresh is not stale
+        assert get_driver_locations() is fresh
+
+    def test_snapshot_loaded_before_location_update_is_not_kept(self, create_driver):
+        """作成中に座標が置き換えられたスナップショットは共有せず、古い座標で上書きしないテスト"""
+        driver = create_driver()
+        self._place(driver, '35.684000', '139.767000')
+        current = get_driver_locations()
+        load = DriverLocationSnapshot.load.__func__
+
+        def load_then_update(cls):
+            snapshot = load(cls)
+            update_driver_locations({driver.id: (34.7025, 135.4959)})
+            return snapshot
+
+        with patch.object(DriverLocationSnapshot, 'load', classmethod(load_then_update)), \
+                patch('apps.users.geo.time.monotonic', return_value=current.built_at + 10 ** 6):
+            stale = get_driver_locations()
+
+        assert stale.nearest(35.684, 139.767, 1)[0] == (driver.id, 0.0)
+        updated = get_driver_locations()
+        assert updated is not stale
+        assert updated.nearest(34.7025, 135.4959, 1)[0] == (driver.id, 0.0)
+
+    def test_snapshot_scales(self):
+        """数万件のドライバーでも配列上で近い順に絞り込めるテスト"""
+        rows = [(i, 35 + (i % 200) * 0.005, 139 + (i // 200) * 0.005, 'motorcycle', True) for i in range(40000)]
+        snapshot = DriverLocationSnapshot(rows)
+
+        results = snapshot.nearest(35.0, 139.0, 5, radius_km=1)
+
+        assert results[0] == (0, 0.0)
+        assert len(results) == 5
+        assert [distance for _, distance in results] == sorted(distance for _, distance in results)
+
+
+@pytest.mark.django_db
+class TestDriverLocation:
+    """ドライバーの位置情報の受信と書き戻しのテスト"""
+
+    @pytest.fixture(autouse=True)
+    def buffered(self, settings):
+        # 書き戻しはテストから明示的に行う
+        settings.DRIVER_LOCATION_FLUSH_INTERVAL = 3600
+        flush_driver_locations()
+
+    def test_batched_points_are_coalesced(self, authenticated_driver_client):
+        """まとめて送った位置は記録日時が最新のものだけを、書き戻し時にDBへ保存するテスト"""
+        client, driver = authenticated_driver_client
+        points = [
+            {'lat': 35.681236, 'lng': 139.767125, 'recorded_at': '2026-01-01T09:00:10+09:00'},
+            {'lat': 35.690000, 'lng': 139.700000, 'recorded_at': '2026-01-01T09:00:20+09:00'},
+            {'lat': 35.600000, 'lng': 139.600000, 'recorded_at': '2026-01-01T09:00:00+09:00'},
+        ]
+
+        response = client.post(reverse('driver-location'), {'points': points}, format='json')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['accepted'] == 3
+        profile = DriverProfile.objects.get(user=driver)
+        assert profile.current_location_lat is None
+        assert pending_driver_locations() == 1
+
+        assert flush_driver_locations() == 1
+        profile.refresh_from_db()
+        assert str(profile.current_location_lat) == '35.690000'
+        assert str(profile.current_location_lng) == '139.700000'
+        assert pending_driver_locations() == 0
+
+    def test_flush_is_one_bulk_update(self, api_client, create_driver, django_assert_num_queries):
+        """多数のドライバーの繰り返しの位置が 取得（行ロック） + 更新 の2クエリで書き戻されるテスト"""
+        drivers = [create_driver() for _ in range(30)]
+        for i in range(3):
+            for driver in drivers:
+                api_client.force_authenticate(user=driver)
+                response = api_client.post(
+                    reverse('driver-location'), {'lat': 35 + i * 0.01, 'lng': 139 + driver.id * 0.001}, format='json'
+                )
+                assert response.status_code == status.HTTP_202_ACCEPTED
+
+        # テストはトランザクション内で動くため、セーブポイントの作成・解放の2クエリが加わる
+        with django_assert_num_queries(4):
+            assert flush_driver_locations() == 30
+
+        profile = DriverProfile.objects.get(user=drivers[0])
+        assert str(profile.current_location_lat) == '35.020000'
+
+    def test_flush_does_not_overwrite_newer_location(self, authenticated_driver_client):
+        """他のワーカー・プロフィール更新APIが書き込んだより新しい位置を、古い位置で上書きしないテスト"""
+        client, driver = authenticated_driver_client
+        client.post(
+            reverse('driver-location'), {'lat': 35.0, 'lng': 139.0, 'recorded_at': '2026-01-01T09:00:00+09:00'},
+            format='json'
+        )
+
+        response = client.patch(
+            reverse('driver-profile'), {'current_location_lat': '34.702500', 'current_location_lng': '135.495900'},
+            format='json'
+        )
+        assert response.status_code == status.HTTP_200_OK
+        profile = DriverProfile.objects.get(user=driver)
+        assert profile.location_recorded_at is not None
+
+        assert flush_driver_locations() == 0
+        profile.refresh_from_db()
+        assert str(profile.current_location_lat) == '34.702500'
+
+        # 別のワーカーが書き戻した位置より古い位置も書き戻さない
+        DriverProfile.objects.filter(pk=profile.pk).update(location_recorded_at=None)
+        client.post(reverse('driver-location'), {'lat': 35.1, 'lng': 139.1}, format='json')
+        DriverProfile.objects.filter(pk=profile.pk).update(location_recorded_at=timezone.now())
+        assert flush_driver_locations() == 0
+        profile.refresh_from_db()
+        assert str(profile.current_location_lat) == '34.702500'
+
+    def test_flush_updates_snapshot_coordinates(self, api_client, create_driver):
+        """書き戻しでは近くのドライバー検索のスナップショットを読み直さず、座標だけを置き換えるテスト"""
+        located = create_driver()
+        profile = located.driver_profile
+        profile.current_location_lat, profile.current_location_lng = '35.000000', '139.000000'
+        profile.save()
+        snapshot = get_driver_locations()
+
+        api_client.force_authenticate(user=located)
+        api_client.post(reverse('driver-location'), {'lat': 34.7025, 'lng': 135.4959}, format='json')
+        with patch.object(DriverLocationSnapshot, 'load', side_effect=AssertionError('reloaded')):
+            flush_driver_locations()
+            updated = get_driver_locations()
+
+        assert updated.built_at == snapshot.built_at
+        assert updated.nearest(34.7025, 135.4959, 1)[0] == (located.id, 0.0)
+        assert snapshot.nearest(35.0, 139.0, 1)[0] == (located.id, 0.0)
+
+        # 位置を新しく登録したドライバーはスナップショットにないため作り直す
+        newcomer = create_driver()
+        assert len(get_driver_locations()) == 1
+        api_client.force_authenticate(user=newcomer)
+        api_client.post(reverse('driver-location'), {'lat': 34.7025, 'lng': 135.4959}, format='json')
+        flush_driver_locations()
+        assert len(get_driver_locations()) == 2
+
+    def test_immediate_flush(self, authenticated_driver_client, settings):
+        """書き戻し間隔が0以下の場合はその場でDBに保存するテスト"""
+        settings.DRIVER_LOCATION_FLUSH_INTERVAL = 0
+        client, driver = authenticated_driver_client
+
+        client.post(reverse('driver-location'), {'lat': '34.7025', 'lng': '135.4959'}, format='json')
+
+        profile = DriverProfile.objects.get(user=driver)
+        assert str(profile.current_location_lat) == '34.702500'
+        assert pending_driver_locations() == 0
+
+    def test_validation_and_permission(self, authenticated_driver_client, create_user, settings):
+        """不正な位置・件数超過は400、ドライバー以外は403を返すテスト"""
+        settings.DRIVER_LOCATION_MAX_POINTS = 2
+        client, driver = authenticated_driver_client
+        url = reverse('driver-location')
+
+        assert client.post(url, {}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+        assert client.post(url, {'points': [{'lat': 91, 'lng': 139}]}, format='json').status_code == 400
+        assert client.post(url, {'points': [{'lat': 35}]}, format='json').status_code == 400
+        assert client.post(
+            url, {'points': [{'lat': 35, 'lng': 139, 'recorded_at': 'yesterday'}]}, format='json'
+        ).status_code == 400
+        assert client.post(url, {'points': [{'lat': 35, 'lng': 139}] * 3}, format='json').status_code == 400
+        assert pending_driver_locations() == 0
+
+        client.force_authenticate(user=create_user())
+        assert client.post(url, {'lat': 35, 'lng': 139}, format='json').status_code == status.HTTP_403_FORBIDDEN